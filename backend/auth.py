@@ -1,25 +1,71 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Awaitable, Callable, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import statistics
+import time
 import jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 
+from cache import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
 # ================= JWT CONFIG =================
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "dev-secret-change-this")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Verified claims, keyed by token digest, so repeat requests skip HMAC + parsing
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+# How long a worker trusts its copy of a user's token_version; a revocation
+# made on another worker takes effect here within this window
+TOKEN_VERSION_TTL_SECONDS = float(os.environ.get("TOKEN_VERSION_TTL_SECONDS", "30"))
+
 # ================= PASSWORD HASHING =================
+# Defaults match passlib's; `python auth.py benchmark` suggests values for a host
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "4"))
+
+# Hashing runs in worker processes so it never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+# Requests waiting for a hashing slot beyond this get a 503 instead of queueing
+PASSWORD_HASH_MAX_WAITING = int(os.environ.get("PASSWORD_HASH_MAX_WAITING", "256"))
+# Workers are not forked from the server process (live event loop, Mongo client)
+PASSWORD_HASH_START_METHOD = os.environ.get(
+    "PASSWORD_HASH_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
 pwd_context = CryptContext(
     schemes=["argon2"],
-    deprecated="auto"
+    deprecated="auto",
+    argon2__rounds=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM
 )
 
 # ================= SECURITY =================
 security = HTTPBearer()
 
+# Comma-separated account emails allowed on admin endpoints
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.environ.get("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
 
 def _normalize_password(password: str) -> str:
     """
@@ -32,27 +78,198 @@ def _normalize_password(password: str) -> str:
     return pwd_bytes.decode("utf-8", errors="ignore")
 
 
-def hash_password(password: str) -> str:
+def _hash_sync(password: str) -> str:
     password = _normalize_password(password)
     return pwd_context.hash(password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+def _verify_and_update_sync(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
     plain_password = _normalize_password(plain_password)
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs Argon2 in a process pool behind a concurrency limit."""
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        concurrency: int = PASSWORD_HASH_CONCURRENCY,
+        max_waiting: int = PASSWORD_HASH_MAX_WAITING
+    ):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {
+            "waiting": 0, "running": 0, "max_waiting": 0,
+            "completed": 0, "failed": 0, "rejected": 0, "pool_restarts": 0
+        }
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD)
+        )
+
+    async def _submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); the pool is unusable from then on
+            logger.warning("Password hashing pool broken, restarting it")
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                self.stats["pool_restarts"] += 1
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password hashing is unavailable, please retry"
+            )
+
+    async def _run(self, fn, *args):
+        if self.stats["waiting"] >= self.max_waiting:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in attempts in progress, please retry"
+            )
+        # Created lazily so importing this module never forks workers
+        if self._executor is None:
+            self._executor = self._new_executor()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self.stats["waiting"] += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.stats["waiting"])
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+        self.stats["running"] += 1
+        try:
+            result = await self._submit(fn, *args)
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.stats["running"] -= 1
+            self._semaphore.release()
+        self.stats["completed"] += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_sync, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(_verify_and_update_sync, plain_password, hashed_password)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "workers": self.workers, "concurrency": self.concurrency}
 
+    async def shutdown(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Waiting for the workers to exit blocks, so keep it off the event loop
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    (matches, new_hash). `new_hash` is set when the stored hash uses other
+    Argon2 parameters than the configured ones and should be replaced.
+    """
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
+
+
+def create_access_token(
+    data: dict,
+    expires_delta: Optional[timedelta] = None,
+    *,
+    is_active: Optional[bool] = None,
+    has_profile: Optional[bool] = None,
+    token_version: int = 0
+) -> str:
+    """
+    Signed JWT for `data`. The optional claims carry account status only;
+    tokens are readable by anyone holding them, so personal details stay
+    out. `token_version` must match the user's current one for the token to
+    be accepted.
+    """
     to_encode = data.copy()
 
     expire = datetime.now(timezone.utc) + (
         expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
 
-    to_encode.update({"exp": expire})
+    optional = {"is_active": is_active, "has_profile": has_profile}
+    to_encode.update({k: v for k, v in optional.items() if v is not None})
+    to_encode.update({"exp": expire, "ver": token_version})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# ================= TOKEN VERIFICATION =================
+
+_verified_tokens: "OrderedDict[bytes, dict]" = OrderedDict()
+token_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+# user_id -> current token_version, set up by the app via use_token_versions
+_token_versions: Optional[AsyncTTLCache] = None
+
+
+def use_token_versions(loader: Callable[[str], Awaitable[Optional[int]]]):
+    """
+    Enable revocation checks. `loader` returns the user's current
+    token_version, or None if the user no longer exists.
+    """
+    global _token_versions
+    _token_versions = AsyncTTLCache(loader, TOKEN_CACHE_SIZE, TOKEN_VERSION_TTL_SECONDS)
+
+
+def forget_token_version(user_id: str):
+    """Drop this worker's cached token_version after bumping it."""
+    if _token_versions is not None:
+        _token_versions.invalidate(user_id)
+
+
+def token_cache_snapshot() -> dict:
+    snapshot = {**token_cache_stats, "size": len(_verified_tokens), "maxsize": TOKEN_CACHE_SIZE}
+    if _token_versions is not None:
+        snapshot["versions"] = _token_versions.snapshot()
+    return snapshot
+
+
+def _verified_claims(token: str) -> dict:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = _verified_tokens.get(key)
+    if claims is not None:
+        if claims["exp"] > time.time():
+            _verified_tokens.move_to_end(key)
+            token_cache_stats["hits"] += 1
+            return claims
+        del _verified_tokens[key]
+
+    token_cache_stats["misses"] += 1
+    claims = decode_access_token(token)
+    _verified_tokens[key] = claims
+    while len(_verified_tokens) > TOKEN_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+        token_cache_stats["evictions"] += 1
+    return claims
+
+
 def decode_access_token(token: str) -> dict:
     try:
         return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -61,17 +278,16 @@ def decode_access_token(token: str) -> dict:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token expired"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token"
         )
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> dict:
-    payload = decode_access_token(credentials.credentials)
+async def user_from_token(token: str) -> dict:
+    """Resolve a bearer token to the current user (also used by WebSockets)."""
+    payload = _verified_claims(token)
 
     user_id = payload.get("user_id")
     if not user_id:
@@ -80,7 +296,103 @@ async def get_current_user(
             detail="Invalid credentials"
         )
 
+    if _token_versions is not None:
+        current_version = await _token_versions.get(user_id)
+        if current_version is None or payload.get("ver", 0) != current_version:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token revoked"
+            )
+
     return {
         "user_id": user_id,
-        "email": payload.get("email")
+        "email": payload.get("email"),
+        "claims": payload
     }
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> dict:
+    return await user_from_token(credentials.credentials)
+
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict:
+    if (current_user.get("email") or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+
+# ================= BENCHMARK =================
+
+def _median_hash_ms(time_cost: int, memory_cost: int, parallelism: int, rounds: int) -> float:
+    context = CryptContext(
+        schemes=["argon2"],
+        argon2__rounds=time_cost,
+        argon2__memory_cost=memory_cost,
+        argon2__parallelism=parallelism
+    )
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        context.hash("benchmark-password")
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def calibrate(target_ms: float, parallelism: int, rounds: int, min_time_cost: int = 2) -> Optional[dict]:
+    """
+    Strongest parameters whose median hash time stays within `target_ms`:
+    the largest memory cost that fits at `min_time_cost`, then the largest
+    time cost at that memory.
+    """
+    best = None
+    for memory_cost in (19456, 32768, 47104, 65536, 131072, 262144):
+        ms = _median_hash_ms(min_time_cost, memory_cost, parallelism, rounds)
+        print(f"  m={memory_cost:>6} KiB t={min_time_cost} p={parallelism}: {ms:7.1f} ms")
+        if ms > target_ms:
+            break
+        best = {"time_cost": min_time_cost, "memory_cost": memory_cost, "parallelism": parallelism, "ms": ms}
+    if best is None:
+        return None
+
+    time_cost = best["time_cost"]
+    while True:
+        ms = _median_hash_ms(time_cost + 1, best["memory_cost"], parallelism, rounds)
+        print(f"  m={best['memory_cost']:>6} KiB t={time_cost + 1} p={parallelism}: {ms:7.1f} ms")
+        if ms > target_ms:
+            break
+        time_cost += 1
+        best.update(time_cost=time_cost, ms=ms)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Argon2 and pick parameters for this host")
+    parser.add_argument("command", choices=["benchmark"])
+    parser.add_argument("--target-ms", type=float, default=50)
+    parser.add_argument("--parallelism", type=int, default=ARGON2_PARALLELISM)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    current = _median_hash_ms(ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM, args.rounds)
+    print(
+        f"current: t={ARGON2_TIME_COST} m={ARGON2_MEMORY_COST} KiB p={ARGON2_PARALLELISM}: "
+        f"{current:.1f} ms per hash, ~{PASSWORD_HASH_WORKERS * 1000 / current:.0f} hashes/s "
+        f"with {PASSWORD_HASH_WORKERS} workers"
+    )
+    print(f"calibrating for {args.target_ms:.0f} ms:")
+    best = calibrate(args.target_ms, args.parallelism, args.rounds)
+    if best is None:
+        print("even the minimum parameters exceed the target; raise --target-ms")
+        raise SystemExit(1)
+    print(f"ARGON2_TIME_COST={best['time_cost']}")
+    print(f"ARGON2_MEMORY_COST={best['memory_cost']}")
+    print(f"ARGON2_PARALLELISM={best['parallelism']}")
+
+
+if __name__ == "__main__":
+    main()
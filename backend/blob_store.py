@@ -0,0 +1,139 @@
+"""
+Content-addressed blob storage.
+
+Blobs are keyed by the hex SHA-256 of their bytes, so identical uploads are
+stored once and a key never changes meaning (safe to cache forever). Writes
+stream to a temporary file while hashing and are renamed into place, so a
+blob is either absent or complete.
+
+  LocalBlobStore  files under BLOB_STORE_PATH, sharded by digest prefix
+
+Other backends (e.g. an object store) implement the same BlobStore methods.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE_PATH = os.environ.get("BLOB_STORE_PATH", str(Path(__file__).parent / "storage" / "blobs"))
+BLOB_READ_CHUNK_SIZE = 64 * 1024
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+def is_digest(value: str) -> bool:
+    return bool(DIGEST_RE.match(value))
+
+
+class BlobStore(ABC):
+    """Interface for content-addressed blob backends."""
+
+    @abstractmethod
+    async def put(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        """Store a byte stream; returns (digest, size)."""
+
+    @abstractmethod
+    async def size(self, digest: str) -> Optional[int]:
+        """Size in bytes, or None if the blob does not exist."""
+
+    @abstractmethod
+    def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Stream bytes [start, end] (inclusive) of a blob."""
+
+    @abstractmethod
+    async def delete(self, digest: str):
+        """Remove a blob; a no-op if it does not exist."""
+
+    async def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        async def single():
+            yield data
+        return await self.put(single())
+
+    async def read_bytes(self, digest: str) -> bytes:
+        return b"".join([chunk async for chunk in self.read(digest)])
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files at <root>/<d[0:2]>/<d[2:4]>/<digest>."""
+
+    def __init__(self, root: str = BLOB_STORE_PATH):
+        self.root = Path(root)
+        (self.root / "tmp").mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    async def put(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        tmp_path = self.root / "tmp" / uuid.uuid4().hex
+        hasher = hashlib.sha256()
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Blob exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(f.close)
+            digest = hasher.hexdigest()
+            await asyncio.to_thread(self._commit, tmp_path, self._path(digest))
+            return digest, size
+        finally:
+            if not f.closed:
+                await asyncio.to_thread(f.close)
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    @staticmethod
+    def _commit(tmp_path: Path, path: Path):
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+    async def size(self, digest: str) -> Optional[int]:
+        try:
+            return (await asyncio.to_thread(self._path(digest).stat)).st_size
+        except FileNotFoundError:
+            return None
+
+    async def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(digest), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = BLOB_READ_CHUNK_SIZE if remaining is None else min(BLOB_READ_CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def delete(self, digest: str):
+        try:
+            await asyncio.to_thread(self._path(digest).unlink)
+        except FileNotFoundError:
+            pass
+
+
+def blob_store_from_env() -> BlobStore:
+    backend = os.environ.get("BLOB_STORE_BACKEND", "local")
+    if backend != "local":
+        raise ValueError(f"Unknown BLOB_STORE_BACKEND: {backend}")
+    return LocalBlobStore()
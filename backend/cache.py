@@ -0,0 +1,108 @@
+"""
+Async read-through cache.
+
+AsyncTTLCache wraps an async loader with a bounded LRU of values that expire
+after `ttl_seconds`. Concurrent misses for the same key share one load, and
+invalidate() drops both the cached value and any load already in flight, so
+a read that raced a write cannot put the old value back. The load runs as
+its own task, so a cancelled caller doesn't strand the others waiting on it.
+
+Each process has its own cache; writes made through another worker become
+visible here when the TTL runs out.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+def retrieve_exception(task: asyncio.Task):
+    """Done-callback so a failed load nobody waited on doesn't warn."""
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncTTLCache:
+    """Bounded LRU + TTL cache in front of an async loader."""
+
+    def __init__(
+        self,
+        loader: Callable[[Hashable], Awaitable[Any]],
+        maxsize: int,
+        ttl_seconds: float
+    ):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {
+            "hits": 0, "misses": 0, "coalesced": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: Hashable) -> Any:
+        """Cached value for `key`, loading it on a miss. Treat it as read-only."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self._entries[key]
+            self.stats["expirations"] += 1
+
+        # Coalesce concurrent misses for the same key into one load
+        task = self._loading.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._load(key))
+            task.add_done_callback(retrieve_exception)
+            self._loading[key] = task
+        # Shielded: cancelling this caller must not cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable) -> Any:
+        task = asyncio.current_task()
+        try:
+            value = await self.loader(key)
+            # Skip the store if the key was invalidated while loading
+            if self._loading.get(key) is task:
+                self._store(key, value)
+            return value
+        finally:
+            if self._loading.get(key) is task:
+                del self._loading[key]
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        """Forget `key` after a write so the next read reloads it."""
+        self._entries.pop(key, None)
+        self._loading.pop(key, None)
+        self.stats["invalidations"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._loading.clear()
+
+    def snapshot(self) -> dict:
+        """Counters plus current size, for health/metrics endpoints."""
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+        }
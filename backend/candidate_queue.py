@@ -0,0 +1,175 @@
+"""
+Materialized per-user candidate queues.
+
+Each active user has a ranked list of candidate entries (the same
+{"profile", "match_score", "distance_km"} dicts /matches/potential returns)
+kept in memory. Background workers refill a queue when it drops below the
+low watermark or gets older than the TTL, so reads are a single dict lookup
+except for a user's very first request.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_QUEUE_SIZE = int(os.environ.get("CANDIDATE_QUEUE_SIZE", "100"))
+CANDIDATE_QUEUE_LOW_WATERMARK = int(os.environ.get("CANDIDATE_QUEUE_LOW_WATERMARK", "20"))
+CANDIDATE_QUEUE_TTL_SECONDS = float(os.environ.get("CANDIDATE_QUEUE_TTL_SECONDS", "300"))
+CANDIDATE_QUEUE_MAX_USERS = int(os.environ.get("CANDIDATE_QUEUE_MAX_USERS", "10000"))
+CANDIDATE_QUEUE_WORKERS = int(os.environ.get("CANDIDATE_QUEUE_WORKERS", "2"))
+# Don't reload a short queue more often than this (e.g. nobody new nearby)
+CANDIDATE_QUEUE_MIN_REFILL_SECONDS = float(os.environ.get("CANDIDATE_QUEUE_MIN_REFILL_SECONDS", "30"))
+
+Loader = Callable[[str, int], Awaitable[List[dict]]]
+
+
+class _QueueState:
+    __slots__ = ("entries", "loaded_at", "generation", "popped")
+
+    def __init__(self):
+        self.entries: Optional[List[dict]] = None
+        self.loaded_at = 0.0
+        self.generation = 0
+        # Targets popped while a refill is in flight, filtered out of its result
+        self.popped = set()
+
+
+class CandidateQueues:
+    """Per-user ranked candidate queues filled by background workers."""
+
+    def __init__(
+        self,
+        loader: Loader,
+        size: int = CANDIDATE_QUEUE_SIZE,
+        low_watermark: int = CANDIDATE_QUEUE_LOW_WATERMARK,
+        ttl_seconds: float = CANDIDATE_QUEUE_TTL_SECONDS,
+        max_users: int = CANDIDATE_QUEUE_MAX_USERS,
+        workers: int = CANDIDATE_QUEUE_WORKERS
+    ):
+        self.loader = loader
+        self.size = size
+        self.low_watermark = low_watermark
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.workers = workers
+        self._queues: "OrderedDict[str, _QueueState]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._pending = set()
+        self._requests: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ---------- reads ----------
+
+    async def get(self, user_id: str) -> List[dict]:
+        """Current ranked queue for `user_id`; loads it on first use."""
+        state = self._state(user_id)
+        if state.entries is not None:
+            if self._needs_refill(state):
+                self.request_refill(user_id)
+            return state.entries
+        while state.entries is None:
+            await self._refill(user_id)
+            # An invalidate during the load discards its result: load the
+            # state that replaced it rather than answering with nothing
+            state = self._state(user_id)
+        return state.entries
+
+    async def page(self, user_id: str, offset: int, limit: int, max_distance_km: Optional[float] = None) -> List[dict]:
+        """Entries [offset, offset + limit) of the queue, counted after the distance filter."""
+        entries = await self.get(user_id)
+        if max_distance_km is not None:
+            entries = [e for e in entries if e["distance_km"] <= max_distance_km]
+        return entries[offset:offset + limit]
+
+    # ---------- writes ----------
+
+    def pop(self, user_id: str, target_user_id: str):
+        """Drop `target_user_id` from the user's queue after a swipe."""
+        state = self._queues.get(user_id)
+        if state is None:
+            return
+        if user_id in self._inflight:
+            state.popped.add(target_user_id)
+        if state.entries is not None:
+            state.entries = [e for e in state.entries if e["profile"]["user_id"] != target_user_id]
+            if self._needs_refill(state):
+                self.request_refill(user_id)
+
+    def invalidate(self, user_id: str):
+        """Forget the user's queue, e.g. after their profile or interests changed."""
+        state = self._queues.pop(user_id, None)
+        if state is not None:
+            # Makes any in-flight refill discard its (now stale) result
+            state.generation += 1
+
+    # ---------- refills ----------
+
+    def _state(self, user_id: str) -> _QueueState:
+        state = self._queues.get(user_id)
+        if state is None:
+            state = self._queues[user_id] = _QueueState()
+            while len(self._queues) > self.max_users:
+                self._queues.popitem(last=False)
+        else:
+            self._queues.move_to_end(user_id)
+        return state
+
+    def _needs_refill(self, state: _QueueState) -> bool:
+        age = time.monotonic() - state.loaded_at
+        if age >= self.ttl_seconds:
+            return True
+        return len(state.entries) < self.low_watermark and age >= CANDIDATE_QUEUE_MIN_REFILL_SECONDS
+
+    def request_refill(self, user_id: str):
+        """Queue a background refill; no-op if one is already pending."""
+        if self._requests is None or user_id in self._pending or user_id in self._inflight:
+            return
+        self._pending.add(user_id)
+        self._requests.put_nowait(user_id)
+
+    async def _refill(self, user_id: str):
+        # Coalesce concurrent refills for the same user into one load
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = self._inflight[user_id] = asyncio.create_task(self._load(user_id))
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        await asyncio.shield(task)
+
+    async def _load(self, user_id: str):
+        state = self._state(user_id)
+        generation = state.generation
+        state.popped = set()
+
+        entries = await self.loader(user_id, self.size)
+
+        if self._queues.get(user_id) is not state or state.generation != generation:
+            return
+        state.entries = [e for e in entries if e["profile"]["user_id"] not in state.popped]
+        state.loaded_at = time.monotonic()
+        state.popped = set()
+
+    async def _worker(self):
+        while True:
+            user_id = await self._requests.get()
+            self._pending.discard(user_id)
+            try:
+                await self._refill(user_id)
+            except Exception:
+                logger.exception("Candidate queue refill failed for %s", user_id)
+
+    def start(self):
+        if self._requests is None:
+            self._requests = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._requests = None
+        self._pending.clear()
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import logging
+from typing import Dict, List
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Error codes Mongo returns when an index with the same name or key
+# already exists with different options.
+INDEX_CONFLICT_CODES = {85, 86}
+
+
+# ================= APPLY =================
+
+async def ensure_indexes(db, specs: Dict[str, List[IndexModel]]) -> dict:
+    """
+    Create every declared index.
+
+    create_index is a no-op for indexes that already exist with the same
+    definition, so this is safe to run on every startup. A failing index
+    (duplicate data under a unique key, conflicting options) is logged and
+    skipped so it never blocks the rest.
+    """
+    result = {"applied": [], "failed": []}
+
+    for collection_name, models in specs.items():
+        collection = db[collection_name]
+        for model in models:
+            name = model.document["name"]
+            try:
+                await collection.create_indexes([model])
+                result["applied"].append(f"{collection_name}.{name}")
+            except OperationFailure as e:
+                level = logging.WARNING if e.code in INDEX_CONFLICT_CODES else logging.ERROR
+                logger.log(level, "Index %s.%s not applied: %s", collection_name, name, e)
+                result["failed"].append({
+                    "index": f"{collection_name}.{name}",
+                    "error": str(e)
+                })
+
+    return result
+
+
+# ================= REPORT =================
+
+async def index_report(db, specs: Dict[str, List[IndexModel]]) -> dict:
+    """
+    Compare declared indexes against the database.
+
+    missing    - declared but not present
+    undeclared - present but not declared (excluding _id_)
+    unused     - present with zero accesses since the last mongod restart
+    """
+    report = {}
+
+    for collection_name, models in specs.items():
+        collection = db[collection_name]
+        declared = {m.document["name"] for m in models}
+        existing = set((await collection.index_information()).keys())
+
+        usage = {}
+        try:
+            async for stat in collection.aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = stat["accesses"]["ops"]
+        except OperationFailure as e:
+            logger.warning("$indexStats unavailable for %s: %s", collection_name, e)
+
+        report[collection_name] = {
+            "missing": sorted(declared - existing),
+            "undeclared": sorted(existing - declared - {"_id_"}),
+            "unused": sorted(
+                name for name, ops in usage.items()
+                if ops == 0 and name != "_id_"
+            ),
+        }
+
+    return report
+
+
+# ================= CLI =================
+
+async def _run(command: str):
+    # Imported lazily so the module can be used without the app's env.
+    from server import db, client, INDEXES
+
+    try:
+        if command == "apply":
+            result = await ensure_indexes(db, INDEXES)
+            for name in result["applied"]:
+                print(f"ok      {name}")
+            for failure in result["failed"]:
+                print(f"FAILED  {failure['index']}: {failure['error']}")
+            return 1 if result["failed"] else 0
+
+        report = await index_report(db, INDEXES)
+        for collection_name, entry in report.items():
+            print(f"[{collection_name}]")
+            for key in ("missing", "undeclared", "unused"):
+                print(f"  {key:<11} {', '.join(entry[key]) or '-'}")
+        return 0
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument("command", choices=["apply", "report"], nargs="?", default="apply")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_run(args.command)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Write-behind buffer for the `interactions` collection.
+
+Views and passes don't need to be readable immediately, so handlers hand
+them to InteractionWriter, which batches them into insert_many calls by size
+or time. The buffer is bounded: when Mongo falls behind, `write` waits for
+room instead of growing memory. Likes use `write_now` because mutual-match
+detection has to see them straight away.
+"""
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_BATCH_SIZE = int(os.environ.get("INTERACTION_BATCH_SIZE", "500"))
+INTERACTION_FLUSH_SECONDS = float(os.environ.get("INTERACTION_FLUSH_SECONDS", "1"))
+INTERACTION_MAX_PENDING = int(os.environ.get("INTERACTION_MAX_PENDING", "10000"))
+INTERACTION_RETRY_SECONDS = float(os.environ.get("INTERACTION_RETRY_SECONDS", "1"))
+INTERACTION_MAX_ATTEMPTS = int(os.environ.get("INTERACTION_MAX_ATTEMPTS", "10"))
+
+_STOP = object()
+
+
+class InteractionWriter:
+    """Batches interaction documents into unordered insert_many calls."""
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = INTERACTION_BATCH_SIZE,
+        flush_seconds: float = INTERACTION_FLUSH_SECONDS,
+        max_pending: int = INTERACTION_MAX_PENDING
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"buffered": 0, "written": 0, "batches": 0, "failed_batches": 0}
+
+    async def write(self, doc: dict):
+        """Buffer `doc`; waits if the buffer is full (backpressure)."""
+        if self._queue is None:
+            await self.collection.insert_one(doc)
+            return
+        await self._queue.put(doc)
+        self.stats["buffered"] += 1
+
+    async def write_now(self, doc: dict):
+        """Insert `doc` on the request path, for writes that must be read back."""
+        await self.collection.insert_one(doc)
+
+    async def write_many_now(self, docs: List[dict]):
+        """Insert `docs` on the request path in a single bulk write."""
+        await self.collection.insert_many(docs, ordered=False)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _insert(self, batch: List[dict]):
+        # Producers block on the full queue while this retries, which is
+        # what bounds memory when Mongo lags.
+        written = len(batch)
+        for attempt in range(1, INTERACTION_MAX_ATTEMPTS + 1):
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                break
+            except BulkWriteError as e:
+                # Duplicate keys from a retried batch are fine; anything else is lost
+                written = e.details.get("nInserted", 0)
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if errors:
+                    self.stats["failed_batches"] += 1
+                    logger.error("Dropped %d interactions: %s", len(errors), errors[0].get("errmsg"))
+                break
+            except PyMongoError:
+                if attempt == INTERACTION_MAX_ATTEMPTS:
+                    self.stats["failed_batches"] += 1
+                    logger.exception("Dropped %d interactions after %d attempts", len(batch), attempt)
+                    return
+                logger.warning("Interaction flush failed, retrying %d docs", len(batch))
+                await asyncio.sleep(INTERACTION_RETRY_SECONDS * attempt)
+        self.stats["written"] += written
+        self.stats["batches"] += 1
+
+    async def _flush(self, batch: List[dict]):
+        try:
+            await self._insert(batch)
+        except Exception:
+            # A dead writer would leave producers blocked on the full queue
+            self.stats["failed_batches"] += 1
+            logger.exception("Dropped %d interactions", len(batch))
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            doc = await queue.get()
+            if doc is _STOP:
+                break
+            batch = [doc]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    doc = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if doc is _STOP:
+                    stopping = True
+                    break
+                batch.append(doc)
+            await self._flush(batch)
+
+        # Drain whatever is left after the stop marker
+        batch = []
+        while not queue.empty():
+            doc = queue.get_nowait()
+            if doc is not _STOP:
+                batch.append(doc)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run(self._queue))
+
+    async def stop(self):
+        """Flush everything buffered and stop the writer."""
+        if self._task is None:
+            return
+        # Later writes go straight to Mongo; everything already queued is drained
+        queue, self._queue = self._queue, None
+        await queue.put(_STOP)
+        await self._task
+        self._task = None
@@ -0,0 +1,93 @@
+"""
+Interest vocabulary and bitmask encoding.
+
+Every distinct interest string gets a permanent bit position, stored in the
+`interest_vocab` collection. A profile's interests are then kept as a
+bitmask in `interest_mask`, a list of signed 64-bit words (least significant
+word first) so Mongo can store it natively, and overlap/union become
+popcounts instead of set operations.
+"""
+import asyncio
+from typing import Dict, Iterable, List
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+WORD_BITS = 64
+_WORD_MASK = (1 << WORD_BITS) - 1
+
+
+# ================= MASKS =================
+
+def mask_to_words(mask: int) -> List[int]:
+    """Split a mask into signed int64 words (BSON has no unsigned ints)."""
+    words = []
+    while mask:
+        word = mask & _WORD_MASK
+        words.append(word - (1 << WORD_BITS) if word >= 1 << (WORD_BITS - 1) else word)
+        mask >>= WORD_BITS
+    return words
+
+
+def words_to_mask(words: Iterable[int]) -> int:
+    mask = 0
+    for i, word in enumerate(words):
+        mask |= (word & _WORD_MASK) << (i * WORD_BITS)
+    return mask
+
+
+def overlap_and_union(a: int, b: int):
+    """Sizes of the intersection and union of two interest masks."""
+    return (a & b).bit_count(), (a | b).bit_count()
+
+
+# ================= VOCABULARY =================
+
+class InterestVocabulary:
+    """String -> bit position mapping, cached in memory and owned by Mongo."""
+
+    def __init__(self, db):
+        self.db = db
+        self._bits: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        async for doc in self.db.interest_vocab.find({}, {"_id": 0, "name": 1, "bit": 1}):
+            self._bits[doc["name"]] = doc["bit"]
+
+    async def encode(self, interests: Iterable[str]) -> int:
+        """Mask for `interests`, allocating bits for unseen ones."""
+        mask = 0
+        for name in set(interests):
+            bit = self._bits.get(name)
+            if bit is None:
+                bit = await self._allocate(name)
+            mask |= 1 << bit
+        return mask
+
+    async def encode_words(self, interests: Iterable[str]) -> List[int]:
+        return mask_to_words(await self.encode(interests))
+
+    async def _allocate(self, name: str) -> int:
+        async with self._lock:
+            if name in self._bits:
+                return self._bits[name]
+
+            doc = await self.db.interest_vocab.find_one({"name": name}, {"_id": 0, "bit": 1})
+            if doc is None:
+                counter = await self.db.counters.find_one_and_update(
+                    {"_id": "interest_vocab"},
+                    {"$inc": {"next_bit": 1}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                bit = counter["next_bit"] - 1
+                try:
+                    await self.db.interest_vocab.insert_one({"name": name, "bit": bit})
+                    doc = {"bit": bit}
+                except DuplicateKeyError:
+                    # Another worker registered it first; its bit wins
+                    doc = await self.db.interest_vocab.find_one({"name": name}, {"_id": 0, "bit": 1})
+
+            self._bits[name] = doc["bit"]
+            return doc["bit"]
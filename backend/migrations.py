@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from blob_store import blob_store_from_env
+from interests import InterestVocabulary
+from photos import PhotoRejected, PhotoStore, decode_base64_photo, is_photo_url, photo_url
+from serialization import parse_timestamp, timestamp, timestamp_query
+from view_recorder import VIEW_DEDUP_WINDOW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Sleep between batches of long online migrations, to leave the database headroom
+MIGRATION_BATCH_PAUSE_SECONDS = float(os.environ.get("MIGRATION_BATCH_PAUSE_SECONDS", "0.05"))
+
+# ================= REGISTRY =================
+
+MIGRATIONS = {}
+
+
+def migration(name: str):
+    """Register a data migration under `name` for the CLI."""
+    def register(fn):
+        MIGRATIONS[name] = fn
+        return fn
+    return register
+
+
+# ================= MIGRATIONS =================
+
+@migration("geo-points")
+async def backfill_geo_points(db) -> dict:
+    """Add a GeoJSON `location.point` to profiles that only have lat/lng."""
+    result = await db.profiles.update_many(
+        {
+            "location.point": {"$exists": False},
+            "location.lat": {"$type": "number"},
+            "location.lng": {"$type": "number"}
+        },
+        [{"$set": {
+            "location.point": {
+                "type": "Point",
+                "coordinates": ["$location.lng", "$location.lat"]
+            }
+        }}]
+    )
+    return {"updated": result.modified_count}
+
+
+@migration("interest-masks")
+async def backfill_interest_masks(db, batch_size: int = 500) -> dict:
+    """Encode `interests` into `interest_mask` for profiles written before it existed."""
+    vocab = InterestVocabulary(db)
+    await vocab.load()
+
+    updated = 0
+    ops = []
+    async for profile in db.profiles.find(
+        {"interest_mask": {"$exists": False}},
+        {"_id": 1, "interests": 1}
+    ):
+        words = await vocab.encode_words(profile.get("interests", []))
+        ops.append(UpdateOne({"_id": profile["_id"]}, {"$set": {"interest_mask": words}}))
+        if len(ops) >= batch_size:
+            updated += (await db.profiles.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        updated += (await db.profiles.bulk_write(ops, ordered=False)).modified_count
+    return {"updated": updated}
+
+
+@migration("match-pair-keys")
+async def backfill_match_pair_keys(db, batch_size: int = 500) -> dict:
+    """
+    Set `pair_key` on legacy matches.
+
+    The oldest match of a pair keeps it; later duplicates, which the unique
+    index rejects, are deactivated instead.
+    """
+    keyed = deactivated = 0
+
+    async def apply(batch):
+        nonlocal keyed, deactivated
+        ops = [UpdateOne({"_id": _id}, {"$set": {"pair_key": key}}) for _id, key in batch]
+        rejected = set()
+        try:
+            result = await db.matches.bulk_write(ops, ordered=False)
+            keyed += result.modified_count
+        except BulkWriteError as e:
+            keyed += e.details["nModified"]
+            rejected = {err["index"] for err in e.details["writeErrors"] if err["code"] == 11000}
+        if rejected:
+            result = await db.matches.update_many(
+                {"_id": {"$in": [batch[i][0] for i in rejected]}},
+                {"$set": {"is_active": False}}
+            )
+            deactivated += result.modified_count
+
+    batch = []
+    async for match in db.matches.find(
+        {"pair_key": {"$exists": False}},
+        {"_id": 1, "user1_id": 1, "user2_id": 1}
+    ).sort("matched_at", 1):
+        key = ":".join(sorted((match["user1_id"], match["user2_id"])))
+        batch.append((match["_id"], key))
+        if len(batch) >= batch_size:
+            await apply(batch)
+            batch = []
+    if batch:
+        await apply(batch)
+    return {"keyed": keyed, "deactivated": deactivated}
+
+
+@migration("conversation-summaries")
+async def backfill_conversation_summaries(db, batch_size: int = 500) -> dict:
+    """
+    Compute last_message and per-user unread counts for existing matches.
+
+    A message is unread if it is newer than the receiver's read_up_to
+    watermark and, for messages from before watermarks, has no read_at.
+    """
+    pipeline = [
+        {"$sort": {"match_id": 1, "sent_at": 1}},
+        {"$group": {
+            "_id": "$match_id",
+            "last": {"$last": {
+                "sender_id": "$sender_id",
+                "content": "$content",
+                "sent_at": "$sent_at"
+            }},
+            "receivers": {"$addToSet": "$receiver_id"}
+        }}
+    ]
+
+    updated = 0
+    ops = []
+    async for summary in db.messages.aggregate(pipeline, allowDiskUse=True):
+        match = await db.matches.find_one({"id": summary["_id"]}, {"_id": 0, "read_up_to": 1}) or {}
+        read_up_to = match.get("read_up_to") or {}
+        unread = {}
+        for receiver_id in summary["receivers"]:
+            query = {"match_id": summary["_id"], "receiver_id": receiver_id, "read_at": None}
+            if read_up_to.get(receiver_id):
+                query = {"$and": [query, timestamp_query("sent_at", gt=read_up_to[receiver_id])]}
+            unread[receiver_id] = await db.messages.count_documents(query)
+        last = summary["last"]
+        ops.append(UpdateOne(
+            {"id": summary["_id"]},
+            {"$set": {
+                "last_message_at": last["sent_at"],
+                "last_message": {
+                    "sender_id": last["sender_id"],
+                    "snippet": last["content"][:100],
+                    "sent_at": last["sent_at"]
+                },
+                "unread": unread
+            }}
+        ))
+        if len(ops) >= batch_size:
+            updated += (await db.matches.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        updated += (await db.matches.bulk_write(ops, ordered=False)).modified_count
+    return {"updated": updated}
+
+
+@migration("external-photos")
+async def move_photos_to_blob_store(db, batch_size: int = 100) -> dict:
+    """Move base64 photos embedded in `profiles.photos` into the blob store."""
+    store = PhotoStore(db, blob_store_from_env())
+    updated = failed = 0
+    ops = []
+    async for profile in db.profiles.find({"photos.0": {"$exists": True}}, {"_id": 1, "photos": 1}):
+        photos = profile["photos"]
+        if all(is_photo_url(p) or p.startswith("http") for p in photos):
+            continue
+        moved = []
+        for value in photos:
+            if is_photo_url(value) or value.startswith("http"):
+                moved.append(value)
+                continue
+            try:
+                photo = await store.save_bytes(decode_base64_photo(value))
+                moved.append(photo_url(photo["digest"]))
+            except PhotoRejected as exc:
+                # Left embedded so nothing is lost; re-run after fixing
+                failed += 1
+                logger.warning("Profile %s: photo not moved: %s", profile["_id"], exc)
+                moved.append(value)
+        ops.append(UpdateOne({"_id": profile["_id"], "photos": photos}, {"$set": {"photos": moved}}))
+        if len(ops) >= batch_size:
+            updated += (await db.profiles.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        updated += (await db.profiles.bulk_write(ops, ordered=False)).modified_count
+    return {"updated": updated, "failed_photos": failed}
+
+
+@migration("profile-views")
+async def fold_view_interactions(db, batch_size: int = 500) -> dict:
+    """
+    Fold "view" interactions into per-pair `profile_views` counts and delete
+    them. Views inside one VIEW_DEDUP_WINDOW_SECONDS window count once, as
+    they do for live traffic. Run before `python user_stats.py backfill`.
+    """
+    window = timedelta(seconds=VIEW_DEDUP_WINDOW_SECONDS)
+    query = {"action": "view", **timestamp_query("created_at", lt=timestamp())}
+
+    folded = pairs = 0
+    ops, done = [], []
+
+    async def write_batch():
+        nonlocal folded
+        await db.profile_views.bulk_write(ops, ordered=False)
+        result = await db.interactions.delete_many({"$and": [query, {"$or": done}]})
+        folded += result.deleted_count
+        ops.clear()
+        done.clear()
+
+    async for group in db.interactions.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"viewer_id": "$user_id", "target_user_id": "$target_user_id"},
+            "seen": {"$push": "$created_at"}
+        }}
+    ], allowDiskUse=True):
+        seen = sorted(parse_timestamp(at) for at in group["seen"])
+        count, last_counted = 0, None
+        for at in seen:
+            if last_counted is None or at - last_counted >= window:
+                count += 1
+                last_counted = at
+        pair = group["_id"]
+        ops.append(UpdateOne(
+            pair,
+            {
+                "$inc": {"count": count},
+                "$min": {"first_seen": seen[0]},
+                "$max": {"last_seen": seen[-1]}
+            },
+            upsert=True
+        ))
+        done.append({"user_id": pair["viewer_id"], "target_user_id": pair["target_user_id"]})
+        pairs += 1
+        if len(ops) >= batch_size:
+            await write_batch()
+    if ops:
+        await write_batch()
+    return {"pairs": pairs, "interactions_folded": folded}
+
+
+# Timestamp fields written as ISO strings before timestamps were stored as dates
+DATETIME_FIELDS = {
+    "profiles": ["created_at", "updated_at"],
+    "interactions": ["created_at"],
+    "messages": ["sent_at", "read_at"],
+    "matches": ["matched_at", "last_message_at", "last_message.sent_at"],
+    "waitlist": ["created_at"],
+    "profile_views": ["first_seen", "last_seen"],
+    "photos": ["created_at"],
+    "subscriptions": ["start_date"],
+    "powerup_purchases": ["created_at"],
+    "user_stats": ["updated_at"],
+    "seen_sets": ["updated_at"],
+    "analytics_rollups": ["start", "computed_at"],
+}
+# Fields holding {user_id: timestamp}
+DATETIME_MAP_FIELDS = {
+    "matches": ["read_up_to"],
+}
+NATIVE_DATETIMES_STATE_ID = "native-datetimes"
+
+
+def _get_path(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _timestamp_updates(doc: dict, fields: list, map_fields: list) -> list:
+    """(path, old string, new date) for every string timestamp in `doc`."""
+    values = [(field, _get_path(doc, field)) for field in fields]
+    for field in map_fields:
+        values.extend((f"{field}.{key}", value) for key, value in (doc.get(field) or {}).items())
+    updates = []
+    for path, value in values:
+        if not isinstance(value, str):
+            continue
+        try:
+            updates.append((path, value, parse_timestamp(value)))
+        except ValueError:
+            logger.warning("%s: unparseable %s %r left as is", doc["_id"], path, value)
+    return updates
+
+
+@migration("native-datetimes")
+async def convert_timestamps_to_dates(
+    db,
+    batch_size: int = 500,
+    pause_seconds: float = MIGRATION_BATCH_PAUSE_SECONDS
+) -> dict:
+    """
+    Convert ISO string timestamps (DATETIME_FIELDS) to BSON dates.
+
+    Safe to run while the app serves traffic: each update only applies if the
+    field still holds the string that was read. Documents are converted
+    newest first, so remaining strings are always older than every date,
+    which is also how Mongo orders mixed values. Progress is checkpointed per
+    collection in `migration_state`; an interrupted run resumes from there,
+    and a run after a completed one sweeps again for stragglers.
+    """
+    state = await db.migration_state.find_one({"_id": NATIVE_DATETIMES_STATE_ID}) or {}
+    if state.get("done"):
+        state = {}
+        await db.migration_state.delete_one({"_id": NATIVE_DATETIMES_STATE_ID})
+    progress = state.get("collections", {})
+
+    async def checkpoint(name: str, collection_state: dict):
+        await db.migration_state.update_one(
+            {"_id": NATIVE_DATETIMES_STATE_ID},
+            {"$set": {f"collections.{name}": collection_state, "updated_at": timestamp()}},
+            upsert=True
+        )
+
+    result = {}
+    for name, fields in DATETIME_FIELDS.items():
+        collection_state = progress.get(name, {"last_id": None, "converted": 0, "done": False})
+        if not collection_state["done"]:
+            map_fields = DATETIME_MAP_FIELDS.get(name, [])
+            # Map keys are per-user, so collections with map fields are scanned whole
+            query = {} if map_fields else {"$or": [{field: {"$type": "string"}} for field in fields]}
+            projection = {field: 1 for field in fields + map_fields}
+            while True:
+                batch_query = dict(query)
+                if collection_state["last_id"] is not None:
+                    batch_query["_id"] = {"$lt": collection_state["last_id"]}
+                docs = await db[name].find(batch_query, projection).sort("_id", -1).limit(batch_size).to_list(batch_size)
+                if not docs:
+                    break
+                ops = [
+                    UpdateOne({"_id": doc["_id"], path: old}, {"$set": {path: new}})
+                    for doc in docs
+                    for path, old, new in _timestamp_updates(doc, fields, map_fields)
+                ]
+                if ops:
+                    collection_state["converted"] += (await db[name].bulk_write(ops, ordered=False)).modified_count
+                collection_state["last_id"] = docs[-1]["_id"]
+                await checkpoint(name, collection_state)
+                if pause_seconds:
+                    await asyncio.sleep(pause_seconds)
+            collection_state["done"] = True
+            await checkpoint(name, collection_state)
+        result[name] = collection_state["converted"]
+
+    await db.migration_state.update_one(
+        {"_id": NATIVE_DATETIMES_STATE_ID},
+        {"$set": {"done": True, "updated_at": timestamp()}},
+        upsert=True
+    )
+    return {"converted": result}
+
+
+# ================= CLI =================
+
+async def _run(name: str):
+    # Imported lazily so the module can be used without the app's env.
+    from server import db, client
+
+    try:
+        result = await MIGRATIONS[name](db)
+        print(f"{name}: {result}")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run data migrations")
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(args.name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Opaque keyset-pagination cursors.
+
+A cursor is the sort key of the last item on a page, JSON-encoded and
+base64url-wrapped so clients treat it as an opaque token.
+
+Datetimes round-trip as {"$date": iso} so a cursor keeps the stored type of
+its value. While timestamps are being migrated from ISO strings to dates a
+field holds both, and Mongo sorts every string below every date; the
+*_after filters follow that order so no item is skipped or repeated.
+"""
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+# Response header carrying the cursor for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Bidirectional lists (e.g. chat history): older page / incremental sync point
+BEFORE_CURSOR_HEADER = "X-Before-Cursor"
+AFTER_CURSOR_HEADER = "X-After-Cursor"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Type is not cursor serializable: {type(value).__name__}")
+
+
+def _decode_value(obj: dict):
+    if set(obj) == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":"), default=_encode_value).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode a cursor made by encode_cursor with `size` values."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")), object_hook=_decode_value)
+    except (ValueError, TypeError, UnicodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return values
+
+
+def descending_after(field: str, value, id_value: str) -> dict:
+    """
+    Filter for items after (value, id_value) in (field desc, id desc) order.
+
+    Mongo sorts null/missing below every other value, so in descending order
+    they come last; the filter keeps that tail reachable.
+    """
+    if value is None:
+        return {field: None, "id": {"$lt": id_value}}
+    clauses = [
+        {field: {"$lt": value}},
+        {field: value, "id": {"$lt": id_value}},
+        {field: None}
+    ]
+    if isinstance(value, datetime):
+        # Legacy string timestamps sort below dates
+        clauses.append({field: {"$type": "string"}})
+    return {"$or": clauses}
+
+
+def ascending_after(field: str, value, id_value: str) -> dict:
+    """Filter for items after (value, id_value) in (field asc, id asc) order."""
+    if value is None:
+        return {"$or": [
+            {field: None, "id": {"$gt": id_value}},
+            {field: {"$ne": None}}
+        ]}
+    clauses = [
+        {field: {"$gt": value}},
+        {field: value, "id": {"$gt": id_value}}
+    ]
+    if isinstance(value, str):
+        # Dates sort above legacy string timestamps
+        clauses.append({field: {"$type": "date"}})
+    return {"$or": clauses}
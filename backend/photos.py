@@ -0,0 +1,221 @@
+"""
+Profile photos on top of the blob store.
+
+PhotoStore streams an upload into the blob store, checks that it is an image
+by its magic bytes, renders a JPEG thumbnail (when Pillow is installed) and
+records metadata in the `photos` collection. Profiles keep only the photo
+URL (`/api/photos/<digest>`); the thumbnail is `?size=thumb` on that URL.
+
+Identical uploads share one blob, so each `photos` document counts the
+uploads holding it (`refs`). `discard` releases one and only deletes the
+photo when it held the last. An identical upload that writes its blob
+while that last delete is running can still lose it; the window is between
+removing the document and removing the blob.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from blob_store import BLOB_READ_CHUNK_SIZE, BlobStore
+from serialization import timestamp
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # thumbnails are skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PHOTO_MAX_BYTES = int(os.environ.get("PHOTO_MAX_BYTES", str(10 * 1024 * 1024)))
+PHOTO_THUMBNAIL_SIZE = int(os.environ.get("PHOTO_THUMBNAIL_SIZE", "320"))
+
+PHOTO_URL_PREFIX = "/api/photos/"
+
+# Leading bytes -> content type
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+SNIFF_BYTES = 16
+
+
+class PhotoRejected(ValueError):
+    pass
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def photo_url(digest: str) -> str:
+    return PHOTO_URL_PREFIX + digest
+
+
+def is_photo_url(value: str) -> bool:
+    return value.startswith(PHOTO_URL_PREFIX)
+
+
+def decode_base64_photo(value: str) -> bytes:
+    """Bytes of a base64 photo, with or without a data: URL prefix."""
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        raise PhotoRejected("Photo is not valid base64")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single `bytes=` Range header, or None to send
+    the whole body (no header, or a form we don't serve such as multi-range).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if first == "":
+        # RangeNotSatisfiable is a ValueError, so it's raised outside the try
+        if length <= 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+async def upload_chunks(upload) -> AsyncIterator[bytes]:
+    """Stream a FastAPI UploadFile in blob-sized chunks."""
+    while True:
+        chunk = await upload.read(BLOB_READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _render_thumbnail(data: bytes, size: int) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=85, optimize=True)
+        return out.getvalue()
+
+
+class PhotoStore:
+    """Photo uploads, thumbnails and metadata."""
+
+    def __init__(self, db, blobs: BlobStore, max_bytes: int = PHOTO_MAX_BYTES):
+        self.db = db
+        self.blobs = blobs
+        self.max_bytes = max_bytes
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> dict:
+        """Store an upload stream; returns its `photos` metadata document."""
+        head = bytearray()
+
+        async def checked():
+            async for chunk in chunks:
+                if len(head) < SNIFF_BYTES:
+                    head.extend(chunk[:SNIFF_BYTES - len(head)])
+                    if len(head) >= SNIFF_BYTES and sniff_content_type(bytes(head)) is None:
+                        raise PhotoRejected("Unsupported image type")
+                yield chunk
+
+        digest, size = await self.blobs.put(checked(), max_bytes=self.max_bytes)
+        content_type = sniff_content_type(bytes(head))
+        if content_type is None:
+            # Shorter than SNIFF_BYTES, so it got past the streaming check
+            await self.blobs.delete(digest)
+            raise PhotoRejected("Unsupported image type")
+
+        existing = await self.db.photos.find_one_and_update(
+            {"digest": digest},
+            {"$inc": {"refs": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if existing:
+            return existing
+
+        try:
+            thumbnail = await self._thumbnail(digest)
+        except PhotoRejected:
+            await self.blobs.delete(digest)
+            raise
+
+        doc = {
+            "digest": digest,
+            "content_type": content_type,
+            "size": size,
+            "thumbnail": thumbnail,
+            "created_at": timestamp()
+        }
+        await self.db.photos.update_one({"digest": digest}, {"$setOnInsert": doc, "$inc": {"refs": 1}}, upsert=True)
+        return doc
+
+    async def save_bytes(self, data: bytes) -> dict:
+        async def single():
+            yield data
+        return await self.save(single())
+
+    async def _thumbnail(self, digest: str) -> Optional[dict]:
+        if Image is None:
+            return None
+        data = await self.blobs.read_bytes(digest)
+        try:
+            thumb = await asyncio.to_thread(_render_thumbnail, data, PHOTO_THUMBNAIL_SIZE)
+        except (UnidentifiedImageError, OSError, ValueError):
+            raise PhotoRejected("Image could not be decoded")
+        thumb_digest, thumb_size = await self.blobs.put_bytes(thumb)
+        return {"digest": thumb_digest, "content_type": "image/jpeg", "size": thumb_size}
+
+    async def get(self, digest: str) -> Optional[dict]:
+        return await self.db.photos.find_one({"digest": digest}, {"_id": 0})
+
+    async def discard(self, digest: str):
+        """Release one upload's reference (e.g. it failed verification); delete the photo after the last."""
+        released = await self.db.photos.find_one_and_update(
+            {"digest": digest, "refs": {"$gt": 1}},
+            {"$inc": {"refs": -1}}
+        )
+        if released:
+            return
+        # Photos stored before reference counting only count uploads since,
+        # so a profile may still use one whose count says otherwise
+        if await self.db.profiles.count_documents({"photos": photo_url(digest)}, limit=1):
+            await self.db.photos.update_one({"digest": digest, "refs": {"$gt": 0}}, {"$inc": {"refs": -1}})
+            return
+        # None if another upload took a reference meanwhile; ours then stays
+        # counted, which only errs towards keeping the photo
+        doc = await self.db.photos.find_one_and_delete({"digest": digest, "refs": {"$lte": 1}})
+        if doc is None:
+            return
+        await self.blobs.delete(digest)
+        if doc and doc.get("thumbnail"):
+            await self.blobs.delete(doc["thumbnail"]["digest"])
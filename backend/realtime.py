@@ -0,0 +1,225 @@
+"""
+Real-time delivery over WebSockets.
+
+RealtimeHub keeps the WebSocket connections of this process, keyed by
+user_id, and fans published events out to them. Publishing goes through a
+pluggable backend:
+
+  LocalBackend  in-process only (single worker, tests)
+  MongoBackend  capped collection tailed by every worker, so an event
+                published on one process reaches connections on all of them
+
+Each connection has a bounded outgoing queue. A client that falls that far
+behind is disconnected and is expected to reconnect and resync with
+GET /messages/{match_id}?after=...
+"""
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+REALTIME_QUEUE_SIZE = int(os.environ.get("REALTIME_QUEUE_SIZE", "100"))
+REALTIME_HEARTBEAT_SECONDS = float(os.environ.get("REALTIME_HEARTBEAT_SECONDS", "25"))
+REALTIME_CAPPED_SIZE_BYTES = int(os.environ.get("REALTIME_CAPPED_SIZE_BYTES", str(64 * 1024 * 1024)))
+
+# WebSocket close codes
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+Deliver = Callable[[str, dict], None]
+
+
+# ================= BACKENDS =================
+
+class PubSubBackend:
+    """Transport between publishers and the hubs of every worker process."""
+
+    async def start(self, deliver: Deliver):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, event: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class LocalBackend(PubSubBackend):
+    """Delivers straight to this process's hub."""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, channel: str, event: dict):
+        if self._deliver is not None:
+            self._deliver(channel, event)
+
+
+class MongoBackend(PubSubBackend):
+    """Publishes into a capped collection that every process tails."""
+
+    def __init__(self, db, collection_name: str = "realtime_events"):
+        self.db = db
+        self.collection_name = collection_name
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        try:
+            await self.db.create_collection(
+                self.collection_name,
+                capped=True,
+                size=REALTIME_CAPPED_SIZE_BYTES
+            )
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail(deliver))
+
+    async def publish(self, channel: str, event: dict):
+        await self.db[self.collection_name].insert_one({"channel": channel, "event": event})
+
+    async def _tail(self, deliver: Deliver):
+        collection = self.db[self.collection_name]
+        newest = await collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        last_id = newest["_id"] if newest else None
+
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        deliver(doc["channel"], doc["event"])
+            except PyMongoError:
+                logger.exception("Realtime tail cursor failed, restarting")
+            # A tailable cursor on an empty collection dies immediately
+            await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def backend_from_env(db) -> PubSubBackend:
+    if os.environ.get("REALTIME_BACKEND", "local") == "mongo":
+        return MongoBackend(db)
+    return LocalBackend()
+
+
+# ================= HUB =================
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Wake the sender so it notices and disconnects
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class RealtimeHub:
+    """Tracks this process's WebSocket connections and pushes events to them."""
+
+    def __init__(
+        self,
+        backend: PubSubBackend,
+        queue_size: int = REALTIME_QUEUE_SIZE,
+        heartbeat_seconds: float = REALTIME_HEARTBEAT_SECONDS
+    ):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self._connections: Dict[str, Set[_Connection]] = {}
+        self.stats = {"published": 0, "delivered": 0, "dropped_connections": 0}
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        await self.backend.stop()
+        for connections in list(self._connections.values()):
+            for connection in list(connections):
+                await connection.websocket.close()
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(c) for c in self._connections.values())
+
+    async def publish(self, user_id: str, event: dict):
+        """Push `event` to every connection of `user_id`, on any worker."""
+        self.stats["published"] += 1
+        await self.backend.publish(user_id, event)
+
+    def _deliver(self, user_id: str, event: dict):
+        for connection in self._connections.get(user_id, ()):
+            connection.offer(event)
+            self.stats["delivered"] += 1
+
+    async def serve(self, websocket: WebSocket, user_id: str):
+        """Run an accepted connection until either side goes away."""
+        connection = _Connection(websocket, self.queue_size)
+        self._connections.setdefault(user_id, set()).add(connection)
+        tasks = [
+            asyncio.create_task(self._send_loop(connection)),
+            asyncio.create_task(self._receive_loop(connection)),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            connections = self._connections.get(user_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self._connections[user_id]
+
+    async def _send_loop(self, connection: _Connection):
+        while True:
+            try:
+                event = await asyncio.wait_for(connection.queue.get(), self.heartbeat_seconds)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}
+            if connection.overflowed:
+                self.stats["dropped_connections"] += 1
+                await connection.websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+                return
+            await connection.websocket.send_json(event)
+
+    async def _receive_loop(self, connection: _Connection):
+        # Any client frame (normally {"type": "pong"}) counts as a heartbeat;
+        # two missed intervals mean the peer is gone.
+        while True:
+            try:
+                await asyncio.wait_for(
+                    connection.websocket.receive_text(),
+                    self.heartbeat_seconds * 2
+                )
+            except asyncio.TimeoutError:
+                await connection.websocket.close(code=CLOSE_GOING_AWAY)
+                return
+            except WebSocketDisconnect:
+                return
@@ -0,0 +1,89 @@
+"""
+Referral code allocation.
+
+Codes are random and the `referral_code_unique` index is the source of
+truth: a waitlist document is inserted with a fresh code and only retried
+on the (rare) duplicate-key collision, so a signup costs one write no matter
+how many codes are in use. `allocate_many` reserves codes for bulk paths
+with one `$in` lookup per round instead of one query per code.
+"""
+import logging
+import random
+import string
+from typing import List
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_CODE_ALPHABET = string.ascii_uppercase + string.digits
+REFERRAL_CODE_LENGTH = 8
+MAX_ALLOCATION_ATTEMPTS = 10
+
+
+def generate_referral_code(length=REFERRAL_CODE_LENGTH):
+    """Generate a random referral code"""
+    return ''.join(random.choices(REFERRAL_CODE_ALPHABET, k=length))
+
+
+def duplicate_key_field(details: dict) -> str:
+    """
+    Name of the field whose unique index rejected a write, from a
+    DuplicateKeyError's details or a bulk write's writeErrors entry.
+    """
+    pattern = details.get("keyPattern") or details.get("keyValue") or {}
+    if pattern:
+        return next(iter(pattern))
+    # Older servers only report the index name in the message
+    message = details.get("errmsg", "")
+    return "referral_code" if "referral_code" in message else "email" if "email" in message else ""
+
+
+class ReferralCodeAllocator:
+    """Assigns unique referral codes using the unique index, not pre-checks."""
+
+    def __init__(self, collection, length: int = REFERRAL_CODE_LENGTH):
+        self.collection = collection
+        self.length = length
+        self.collisions = 0
+
+    async def insert(self, doc: dict) -> dict:
+        """
+        Insert `doc`, drawing a new `referral_code` whenever the current one is
+        missing or collides. Duplicate keys on any other field (e.g. email)
+        are re-raised.
+        """
+        for _ in range(MAX_ALLOCATION_ATTEMPTS):
+            if not doc.get("referral_code"):
+                doc["referral_code"] = generate_referral_code(self.length)
+            doc.pop("_id", None)
+            try:
+                await self.collection.insert_one(doc)
+                return doc
+            except DuplicateKeyError as exc:
+                if duplicate_key_field(exc.details or {}) != "referral_code":
+                    raise
+                self.collisions += 1
+                doc["referral_code"] = None
+        raise RuntimeError("Could not allocate a unique referral code")
+
+    async def allocate_many(self, count: int) -> List[str]:
+        """
+        `count` distinct codes not currently in use. Codes are not reserved, so
+        callers still insert against the unique index and handle collisions.
+        """
+        codes = set()
+        for _ in range(MAX_ALLOCATION_ATTEMPTS):
+            fresh = set()
+            while len(codes) + len(fresh) < count:
+                code = generate_referral_code(self.length)
+                if code not in codes:
+                    fresh.add(code)
+            if not fresh:
+                break
+            taken = await self.collection.distinct("referral_code", {"referral_code": {"$in": list(fresh)}})
+            self.collisions += len(taken)
+            codes |= fresh.difference(taken)
+        if len(codes) < count:
+            raise RuntimeError("Could not allocate enough unique referral codes")
+        return list(codes)
@@ -0,0 +1,280 @@
+"""
+Pre-aggregated platform rollups for /analytics/admin.
+
+A background task periodically (re)computes hourly buckets for the current
+and previous hour, then folds them into daily buckets. Each bucket holds
+plain counters plus a HyperLogLog sketch of the users who interacted, so
+active-user counts for any range are a merge of sketches rather than a
+`distinct` over raw interactions.
+
+`interactions` counts swipes only: profile views live in `profile_views`, one
+document per (viewer, target) pair, so `profile_views` counts pairs first or
+last seen in the bucket, and viewers count as active users in those buckets.
+
+Hourly buckets expire after ROLLUP_HOURLY_RETENTION_DAYS; daily buckets are
+kept. `python rollups.py backfill --days N` rebuilds history.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from serialization import parse_timestamp, timestamp, timestamp_query
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL_SECONDS = float(os.environ.get("ROLLUP_INTERVAL_SECONDS", "300"))
+ROLLUP_HOURLY_RETENTION_DAYS = int(os.environ.get("ROLLUP_HOURLY_RETENTION_DAYS", "35"))
+
+COUNTERS = ("new_users", "new_profiles", "new_matches", "new_messages", "interactions", "profile_views")
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+# ================= HYPERLOGLOG =================
+
+class HyperLogLog:
+    """Mergeable cardinality sketch (~0.8% standard error at p=14)."""
+
+    def __init__(self, precision: int = 14, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            self.registers = np.zeros(self.size, dtype=np.uint8)
+        else:
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+
+    def add(self, item: str):
+        h = int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, items: Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
+
+
+# ================= BUCKETS =================
+
+def hour_id(start: datetime) -> str:
+    return "hour:" + start.strftime("%Y-%m-%dT%H")
+
+
+def day_id(start: datetime) -> str:
+    return "day:" + start.strftime("%Y-%m-%d")
+
+
+def floor_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _range(field: str, start: datetime, end: datetime, native: bool = False) -> dict:
+    # Users have always stored BSON dates; other collections may still hold
+    # ISO strings until the native-datetimes migration has run
+    if native:
+        return {field: {"$gte": start, "$lt": end}}
+    return timestamp_query(field, gte=start, lt=end)
+
+
+async def compute_hour(db, start: datetime) -> dict:
+    """Recompute and store the hourly bucket starting at `start`."""
+    end = start + HOUR
+    viewed = {"$or": [_range("first_seen", start, end), _range("last_seen", start, end)]}
+    counts = {
+        "new_users": await db.users.count_documents(_range("created_at", start, end, native=True)),
+        "new_profiles": await db.profiles.count_documents(_range("created_at", start, end)),
+        "new_matches": await db.matches.count_documents(_range("matched_at", start, end)),
+        "new_messages": await db.messages.count_documents(_range("sent_at", start, end)),
+        "interactions": await db.interactions.count_documents(_range("created_at", start, end)),
+        "profile_views": await db.profile_views.count_documents(viewed),
+    }
+
+    active = HyperLogLog()
+    async for row in db.interactions.aggregate([
+        {"$match": _range("created_at", start, end)},
+        {"$group": {"_id": "$user_id"}}
+    ], allowDiskUse=True):
+        active.add(row["_id"])
+    async for row in db.profile_views.aggregate([
+        {"$match": viewed},
+        {"$group": {"_id": "$viewer_id"}}
+    ], allowDiskUse=True):
+        active.add(row["_id"])
+
+    bucket = {
+        "granularity": "hour",
+        "start": timestamp(start),
+        "counts": counts,
+        "active_users_hll": active.to_bytes(),
+        "expire_at": start + timedelta(days=ROLLUP_HOURLY_RETENTION_DAYS),
+        "computed_at": timestamp()
+    }
+    await db.analytics_rollups.replace_one({"_id": hour_id(start)}, bucket, upsert=True)
+    return bucket
+
+
+async def compute_day(db, start: datetime) -> dict:
+    """Fold the day's hourly buckets into its daily bucket."""
+    hour_ids = [hour_id(start + i * HOUR) for i in range(24)]
+    counts = dict.fromkeys(COUNTERS, 0)
+    active = HyperLogLog()
+    async for bucket in db.analytics_rollups.find({"_id": {"$in": hour_ids}}):
+        for name in COUNTERS:
+            counts[name] += bucket["counts"].get(name, 0)
+        active.merge(HyperLogLog(registers=bucket["active_users_hll"]))
+
+    bucket = {
+        "granularity": "day",
+        "start": timestamp(start),
+        "counts": counts,
+        "active_users_hll": active.to_bytes(),
+        "computed_at": timestamp()
+    }
+    await db.analytics_rollups.replace_one({"_id": day_id(start)}, bucket, upsert=True)
+    return bucket
+
+
+def bucket_plan(start: datetime, end: datetime) -> List[str]:
+    """
+    Bucket ids covering [start, end): whole days as daily buckets, the
+    partial days at either edge as hourly buckets (hour resolution). Bounds
+    are converted to UTC first, the timezone bucket ids are in.
+    """
+    start = floor_hour(parse_timestamp(start))
+    end = parse_timestamp(end)
+    ids = []
+    cursor = start
+    while cursor < end:
+        if cursor == floor_day(cursor) and cursor + DAY <= end:
+            ids.append(day_id(cursor))
+            cursor += DAY
+        else:
+            ids.append(hour_id(cursor))
+            cursor += HOUR
+    return ids
+
+
+async def query_range(db, start: datetime, end: datetime) -> dict:
+    """Summed counters and merged active-user estimate for [start, end)."""
+    ids = bucket_plan(start, end)
+    counts = dict.fromkeys(COUNTERS, 0)
+    active = HyperLogLog()
+    found = 0
+    async for bucket in db.analytics_rollups.find({"_id": {"$in": ids}}):
+        found += 1
+        for name in COUNTERS:
+            counts[name] += bucket["counts"].get(name, 0)
+        active.merge(HyperLogLog(registers=bucket["active_users_hll"]))
+    return {
+        **counts,
+        "active_users": active.count(),
+        "buckets": len(ids),
+        "missing_buckets": len(ids) - found
+    }
+
+
+# ================= SCHEDULER =================
+
+class RollupScheduler:
+    """Keeps the current/previous hour and their days rolled up."""
+
+    def __init__(self, db, interval_seconds: float = ROLLUP_INTERVAL_SECONDS):
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
+        current = floor_hour(now)
+        # The previous hour too, for writes that landed after its last run
+        for start in (current - HOUR, current):
+            await compute_hour(self.db, start)
+        for day in sorted({floor_day(current - HOUR), floor_day(current)}):
+            await compute_day(self.db, day)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                # Any failure is retried next interval rather than ending the loop
+                logger.exception("Analytics rollup failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# ================= CLI =================
+
+async def _backfill(days: int):
+    # Imported lazily so the module can be used without the app's env.
+    from server import db, client
+
+    try:
+        now = datetime.now(timezone.utc)
+        first_day = floor_day(now) - (days - 1) * DAY
+        last_hour = floor_hour(now)
+        for i in range(days):
+            day = first_day + i * DAY
+            # Fold each day straight after its hours: beyond the retention
+            # they are written already expired and the TTL monitor may drop them
+            hour = day
+            while hour < day + DAY and hour <= last_hour:
+                await compute_hour(db, hour)
+                hour += HOUR
+            await compute_day(db, day)
+        print(f"backfilled {days} days of rollups")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics rollups")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(_backfill(args.days))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Vectorized match scoring.
+
+Mirrors calculate_distance / calculate_match_score in server.py, which stay
+as the scalar reference implementation: for the same inputs both paths
+produce the same scores.
+"""
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+WORD_BITS = 64
+
+
+# ================= COLUMNAR BATCH =================
+
+@dataclass
+class CandidateBatch:
+    """Candidate profiles laid out as columns, one row per profile."""
+    profiles: List[dict]
+    lat: np.ndarray             # float64 (n,)
+    lng: np.ndarray             # float64 (n,)
+    interest_bits: np.ndarray   # uint64 (n, words)
+    interest_count: np.ndarray  # int64 (n,) distinct interests per profile
+    has_bio: np.ndarray         # bool (n,)
+    has_photos: np.ndarray      # bool (n,) at least 3 photos
+    is_verified: np.ndarray     # bool (n,)
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+def _pack_interests(interest_lists, vocab):
+    """Encode interest lists as (n, words) uint64 bitmaps over `vocab`."""
+    words = max(1, (len(vocab) + WORD_BITS - 1) // WORD_BITS)
+    bits = np.zeros((len(interest_lists), words), dtype=np.uint64)
+    for row, interests in enumerate(interest_lists):
+        for interest in interests:
+            pos = vocab[interest]
+            bits[row, pos // WORD_BITS] |= np.uint64(1 << (pos % WORD_BITS))
+    return bits
+
+
+def _stack_masks(word_lists):
+    """Stack stored interest_mask word lists into an (n, words) uint64 array."""
+    words = max(1, max(len(w) for w in word_lists))
+    bits = np.zeros((len(word_lists), words), dtype=np.uint64)
+    for row, mask in enumerate(word_lists):
+        if mask:
+            bits[row, :len(mask)] = np.array(mask, dtype=np.int64).view(np.uint64)
+    return bits
+
+
+def _interest_columns(my_profile: dict, profiles: List[dict]):
+    """
+    Interest bitmaps for the candidates and for `my_profile`.
+
+    Uses the stored vocabulary masks when every profile has one; otherwise
+    falls back to a vocabulary local to the batch, whose bit positions are
+    only meaningful within a single call.
+    """
+    masks = [p.get("interest_mask") for p in profiles]
+    my_mask = my_profile.get("interest_mask")
+    if my_mask is not None and all(m is not None for m in masks):
+        bits = _stack_masks([my_mask] + masks)
+        counts = np.bitwise_count(bits).sum(axis=1).astype(np.int64)
+        return bits[1:], counts[1:], bits[0], int(counts[0])
+
+    my_interests = set(my_profile.get("interests", []))
+    interest_sets = [set(p.get("interests", [])) for p in profiles]
+
+    vocab = {}
+    for interest in my_interests.union(*interest_sets):
+        vocab.setdefault(interest, len(vocab))
+
+    return (
+        _pack_interests(interest_sets, vocab),
+        np.fromiter((len(s) for s in interest_sets), dtype=np.int64, count=len(profiles)),
+        _pack_interests([my_interests], vocab)[0],
+        len(my_interests)
+    )
+
+
+def build_batch(my_profile: dict, profiles: List[dict]):
+    """Build a CandidateBatch plus the matching bitmap for `my_profile`."""
+    interest_bits, interest_count, my_bits, my_interest_count = _interest_columns(my_profile, profiles)
+
+    batch = CandidateBatch(
+        profiles=profiles,
+        lat=np.fromiter((p["location"]["lat"] for p in profiles), dtype=np.float64, count=len(profiles)),
+        lng=np.fromiter((p["location"]["lng"] for p in profiles), dtype=np.float64, count=len(profiles)),
+        interest_bits=interest_bits,
+        interest_count=interest_count,
+        has_bio=np.fromiter((bool(p.get("bio")) for p in profiles), dtype=bool, count=len(profiles)),
+        has_photos=np.fromiter(
+            (p.get("photo_count", len(p.get("photos", []))) >= 3 for p in profiles),
+            dtype=bool, count=len(profiles)
+        ),
+        is_verified=np.fromiter((bool(p.get("is_verified")) for p in profiles), dtype=bool, count=len(profiles)),
+    )
+    return batch, my_bits, my_interest_count
+
+
+# ================= SCORING =================
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized calculate_distance: (lat1, lon1) scalar, (lat2, lon2) arrays."""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(lat2 - lat1)
+    delta_lon = np.radians(lon2 - lon1)
+
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(delta_lon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def score_batch(batch: CandidateBatch, my_bits: np.ndarray, my_interest_count: int, distance_km: np.ndarray):
+    """Vectorized calculate_match_score over every row of `batch`."""
+    score = np.full(len(batch), 100, dtype=np.int64)
+
+    # Distance factor (max 30 points, closer = better)
+    score += np.select(
+        [distance_km <= 2, distance_km <= 5, distance_km <= 10],
+        [30, 20, 10],
+        default=0
+    )
+
+    # Interest overlap (max 40 points)
+    overlap = np.bitwise_count(batch.interest_bits & my_bits).sum(axis=1).astype(np.int64)
+    total = my_interest_count + batch.interest_count - overlap
+    has_both = (my_interest_count > 0) & (batch.interest_count > 0)
+    ratio = np.divide(overlap, total, out=np.zeros(len(batch)), where=has_both)
+    score += np.where(has_both, (ratio * 40).astype(np.int64), 0)
+
+    # Profile completeness (max 30 points)
+    score += batch.has_bio * 10
+    score += batch.has_photos * 10
+    score += batch.is_verified * 10
+
+    return np.minimum(score, 200)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the `k` best scores, best first.
+
+    Ties keep input order (like a stable sort), which is encoded into the
+    key so argpartition only has to do a partial selection.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    key = scores.astype(np.int64) * n + (n - 1 - np.arange(n))
+    if k < n:
+        selected = np.argpartition(-key, k - 1)[:k]
+    else:
+        selected = np.arange(n)
+    return selected[np.argsort(-key[selected])]
+
+
+def rank_candidates(my_profile: dict, profiles: List[dict], limit: int) -> List[dict]:
+    """Score every candidate in one pass and return the top `limit`."""
+    if not profiles:
+        return []
+
+    batch, my_bits, my_interest_count = build_batch(my_profile, profiles)
+    my_location = my_profile["location"]
+    distance = haversine_km(my_location["lat"], my_location["lng"], batch.lat, batch.lng)
+    scores = score_batch(batch, my_bits, my_interest_count, distance)
+
+    return [
+        {
+            "profile": batch.profiles[i],
+            "match_score": int(scores[i]),
+            "distance_km": round(float(distance[i]), 1)
+        }
+        for i in top_k(scores, limit)
+    ]
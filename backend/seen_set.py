@@ -0,0 +1,281 @@
+"""
+Per-user "already seen" sets.
+
+Each user gets a scalable Bloom filter of the user_ids they have viewed or
+swiped on. Filters live in an in-memory LRU, are persisted to the
+`seen_sets` collection by a background flush, and are rebuilt from
+`interactions` and `profile_views` the first time a user is seen without a
+stored filter.
+
+A Bloom filter never forgets an id, but may report a small fraction of
+unseen ids as seen (about SEEN_SET_ERROR_RATE). Because filters are
+persisted, such a false positive is permanent: that profile is never shown
+to that user.
+
+Several workers may hold a filter for the same user. Filters only ever gain
+bits, so persisting ORs the stored filter into the local one and writes the
+union under a version check, retrying if another worker wrote in between.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from cache import retrieve_exception
+from serialization import timestamp
+
+logger = logging.getLogger(__name__)
+
+SEEN_SET_INITIAL_CAPACITY = int(os.environ.get("SEEN_SET_INITIAL_CAPACITY", "1000"))
+SEEN_SET_ERROR_RATE = float(os.environ.get("SEEN_SET_ERROR_RATE", "0.01"))
+SEEN_SET_CACHE_SIZE = int(os.environ.get("SEEN_SET_CACHE_SIZE", "10000"))
+SEEN_SET_FLUSH_SECONDS = float(os.environ.get("SEEN_SET_FLUSH_SECONDS", "5"))
+# Version-check retries when other workers keep writing the same user's filter
+SEEN_SET_PERSIST_ATTEMPTS = 5
+
+
+# ================= BLOOM FILTERS =================
+
+def _hashes(item: str):
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter over strings."""
+
+    def __init__(self, capacity: int, error_rate: float, bits: Optional[bytes] = None, count: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = count
+
+    def _positions(self, item: str):
+        h1, h2 = _hashes(item)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def estimated_count(self) -> int:
+        """Items implied by the number of set bits."""
+        set_bits = sum(bin(byte).count("1") for byte in self.bits)
+        if set_bits >= self.num_bits:
+            return self.capacity
+        return round(-self.num_bits / self.num_hashes * math.log(1 - set_bits / self.num_bits))
+
+    def merge(self, other: "BloomFilter"):
+        """Union with a filter of the same size."""
+        self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+        self.count = max(self.count, other.count, self.estimated_count())
+
+
+class ScalableBloomFilter:
+    """
+    Chain of Bloom filters that grows as items are added.
+
+    Each new layer doubles the capacity and halves the error rate so the
+    overall false-positive rate stays bounded by roughly twice the
+    initial one.
+    """
+
+    def __init__(self, layers=None):
+        self.layers = layers or [BloomFilter(SEEN_SET_INITIAL_CAPACITY, SEEN_SET_ERROR_RATE / 2)]
+
+    def add(self, item: str) -> bool:
+        """Add `item`; returns False if it was (probably) already present."""
+        if item in self:
+            return False
+        if self.layers[-1].is_full:
+            last = self.layers[-1]
+            self.layers.append(BloomFilter(last.capacity * 2, last.error_rate / 2))
+        self.layers[-1].add(item)
+        return True
+
+    def __contains__(self, item: str) -> bool:
+        return any(item in layer for layer in self.layers)
+
+    def merge(self, other: "ScalableBloomFilter"):
+        """Union with another filter; layers grow identically, so they pair up."""
+        for i, layer in enumerate(other.layers):
+            mine = self.layers[i] if i < len(self.layers) else None
+            if mine is not None and mine.num_bits == layer.num_bits:
+                mine.merge(layer)
+            else:
+                # Sized under other settings: keep it as a layer of its own
+                self.layers.append(BloomFilter(layer.capacity, layer.error_rate, layer.bits, layer.count))
+
+    def to_document(self) -> list:
+        return [
+            {
+                "capacity": layer.capacity,
+                "error_rate": layer.error_rate,
+                "count": layer.count,
+                "bits": bytes(layer.bits)
+            }
+            for layer in self.layers
+        ]
+
+    @classmethod
+    def from_document(cls, layers: list) -> "ScalableBloomFilter":
+        return cls([
+            BloomFilter(layer["capacity"], layer["error_rate"], layer["bits"], layer["count"])
+            for layer in layers
+        ])
+
+
+# ================= STORE =================
+
+class SeenSetStore:
+    """LRU of per-user seen filters with write-back persistence."""
+
+    def __init__(self, db, cache_size: int = SEEN_SET_CACHE_SIZE, flush_seconds: float = SEEN_SET_FLUSH_SECONDS):
+        self.db = db
+        self.cache_size = cache_size
+        self.flush_seconds = flush_seconds
+        self._filters: "OrderedDict[str, ScalableBloomFilter]" = OrderedDict()
+        self._dirty = set()
+        # Dirty filters pushed out of the LRU, kept until the flush persists them
+        self._evicted: Dict[str, ScalableBloomFilter] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, user_id: str) -> ScalableBloomFilter:
+        """Seen filter for `user_id`, loading or rebuilding it on a miss."""
+        seen = self._filters.get(user_id)
+        if seen is not None:
+            self._filters.move_to_end(user_id)
+            return seen
+        seen = self._evicted.pop(user_id, None)
+        if seen is not None:
+            self._filters[user_id] = seen
+            self._evict()
+            return seen
+
+        # Coalesce concurrent misses for the same user into one load, run as
+        # its own task so a cancelled caller doesn't strand the others
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_and_cache(user_id))
+            task.add_done_callback(retrieve_exception)
+            self._loading[user_id] = task
+        return await asyncio.shield(task)
+
+    async def _load_and_cache(self, user_id: str) -> ScalableBloomFilter:
+        try:
+            seen = await self._load(user_id)
+            self._filters[user_id] = seen
+            self._evict()
+            return seen
+        finally:
+            del self._loading[user_id]
+
+    async def add(self, user_id: str, target_user_id: str):
+        """Mark `target_user_id` as seen by `user_id`."""
+        seen = await self.get(user_id)
+        if seen.add(target_user_id):
+            self._dirty.add(user_id)
+
+    async def _load(self, user_id: str) -> ScalableBloomFilter:
+        doc = await self.db.seen_sets.find_one({"user_id": user_id}, {"_id": 0, "layers": 1})
+        if doc:
+            return ScalableBloomFilter.from_document(doc["layers"])
+
+        # First time: rebuild from interaction history and persist it
+        seen = ScalableBloomFilter()
+        async for interaction in self.db.interactions.find(
+            {"user_id": user_id},
+            {"_id": 0, "target_user_id": 1}
+        ):
+            seen.add(interaction["target_user_id"])
+        async for view in self.db.profile_views.find(
+            {"viewer_id": user_id},
+            {"_id": 0, "target_user_id": 1}
+        ):
+            seen.add(view["target_user_id"])
+        self._dirty.add(user_id)
+        return seen
+
+    def _evict(self):
+        # Runs inside other users' requests, so persisting is left to the
+        # flush task: a failure there can't fail them or lose these additions
+        while len(self._filters) > self.cache_size:
+            user_id, seen = self._filters.popitem(last=False)
+            if user_id in self._dirty:
+                self._evicted[user_id] = seen
+
+    async def _persist(self, user_id: str, seen: ScalableBloomFilter):
+        """Store `seen` merged with what other workers stored; `seen` gets their additions too."""
+        for _ in range(SEEN_SET_PERSIST_ATTEMPTS):
+            stored = await self.db.seen_sets.find_one({"user_id": user_id}, {"_id": 0, "layers": 1, "version": 1})
+            version = stored.get("version") if stored else None
+            if stored:
+                seen.merge(ScalableBloomFilter.from_document(stored["layers"]))
+            try:
+                result = await self.db.seen_sets.update_one(
+                    {"user_id": user_id, "version": {"$exists": False} if version is None else version},
+                    {
+                        "$set": {
+                            "layers": seen.to_document(),
+                            "updated_at": timestamp()
+                        },
+                        "$inc": {"version": 1}
+                    },
+                    upsert=stored is None
+                )
+            except DuplicateKeyError:
+                continue  # another worker created the document first
+            if result.matched_count or result.upserted_id is not None:
+                return
+        raise RuntimeError(f"Seen set for {user_id} kept changing while persisting")
+
+    async def flush(self):
+        """Persist every filter changed since the last flush."""
+        dirty, self._dirty = self._dirty, set()
+        for user_id in dirty:
+            seen = self._filters.get(user_id) or self._evicted.get(user_id)
+            if seen is None:
+                continue
+            try:
+                await self._persist(user_id, seen)
+            except Exception:
+                logger.exception("Failed to persist seen set for %s", user_id)
+                self._dirty.add(user_id)
+                continue
+            if self._evicted.get(user_id) is seen:
+                del self._evicted[user_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
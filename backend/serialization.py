@@ -0,0 +1,198 @@
+"""
+Fast JSON responses and lightweight document builders for hot endpoints.
+
+FastJSONResponse renders with orjson. Handlers return it directly (via
+fast_json) so FastAPI skips its jsonable_encoder walk over the payload.
+Datetimes are written as RFC 3339 in UTC, so `...+00:00` is the only
+format clients see. Values from Mongo are already aware (the client is
+tz_aware); OPT_NAIVE_UTC only covers naive datetimes built in Python.
+
+Timestamps are stored as native BSON dates. Collections written before that
+hold ISO strings until `python migrations.py native-datetimes` has run, so
+reads go through parse_timestamp / timestamp_query, which accept both.
+
+interaction_doc / message_doc build storage documents as plain dicts instead
+of constructing a Pydantic model, dumping it and patching its datetimes;
+to_document does the same patching for the models that are still used.
+
+`python serialization.py` compares both paths on representative payloads.
+"""
+import timeit
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional, Union
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+# ================= TIMESTAMPS =================
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def timestamp(dt: Optional[datetime] = None) -> datetime:
+    """Stored form of a timestamp: UTC, truncated to BSON's millisecond precision."""
+    dt = (dt or utc_now()).astimezone(timezone.utc)
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
+
+
+def parse_timestamp(value: Union[datetime, str, None]) -> Optional[datetime]:
+    """Aware UTC datetime for a stored timestamp in either form (date or legacy ISO string)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def format_timestamp(value: Union[datetime, str, None]) -> Optional[str]:
+    """ISO 8601 with UTC offset, the format legacy string timestamps use."""
+    value = parse_timestamp(value)
+    return value.isoformat() if value is not None else None
+
+
+def timestamp_query(field: str, **bounds: datetime) -> dict:
+    """
+    Range filter on a timestamp field matching both stored forms, e.g.
+    timestamp_query("sent_at", gte=start, lt=end). Mongo only compares values
+    of the same BSON type, so each form gets its own clause.
+    """
+    native = {f"${op}": parse_timestamp(value) for op, value in bounds.items()}
+    legacy = {f"${op}": format_timestamp(value) for op, value in bounds.items()}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+# ================= DOCUMENTS =================
+
+def to_document(model: BaseModel) -> dict:
+    """model_dump() with datetimes in their stored form."""
+    doc = model.model_dump()
+    for key, value in doc.items():
+        if isinstance(value, datetime):
+            doc[key] = timestamp(value)
+    return doc
+
+
+def interaction_doc(user_id: str, target_user_id: str, action: str) -> dict:
+    """Same document as to_document(Interaction(...)), without the model."""
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "target_user_id": target_user_id,
+        "action": action,
+        "created_at": timestamp()
+    }
+
+
+def message_doc(match_id: str, sender_id: str, receiver_id: str, content: str) -> dict:
+    """Same document as to_document(Message(...)), without the model."""
+    return {
+        "id": str(uuid.uuid4()),
+        "match_id": match_id,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "content": content,
+        "sent_at": timestamp(),
+        "read_at": None
+    }
+
+
+# ================= RESPONSES =================
+
+def _default(obj: Any):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+def fast_json(content: Any, response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    Response for `content`, keeping headers a handler set on its injected
+    `response` parameter (FastAPI drops those when a Response is returned).
+    """
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+# ================= BENCHMARK =================
+
+def _payloads() -> dict:
+    now = utc_now()
+    card = {
+        "user_id": str(uuid.uuid4()),
+        "bio": "Coffee, climbing and long walks. " * 3,
+        "age": 29,
+        "interests": ["hiking", "coffee", "travel", "music", "art"],
+        "looking_for": "relationship",
+        "is_verified": True,
+        "location": {"city": "NYC", "neighborhood": "Downtown"},
+        "photos": ["/api/photos/" + "ab" * 32]
+    }
+    return {
+        "potential": [{"profile": dict(card), "match_score": 150, "distance_km": 3.2} for _ in range(20)],
+        "messages": [
+            message_doc(str(uuid.uuid4()), "a", "b", "See you at eight?")
+            for _ in range(50)
+        ],
+        "my-matches": [
+            {"match_id": str(uuid.uuid4()), "matched_at": now, "last_message_at": now, "profile": dict(card)}
+            for _ in range(50)
+        ],
+        "swipe": {"action": "like", "matched": True, "match_id": str(uuid.uuid4())},
+    }
+
+
+def main():
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    # Imported lazily so the module can be used without the app's env.
+    from server import Interaction, Message
+
+    rounds = 2000
+    print(f"{'':<28}{'current':>12}{'fast':>12}{'speedup':>10}")
+
+    def report(name, current, fast):
+        current_us = timeit.timeit(current, number=rounds) / rounds * 1e6
+        fast_us = timeit.timeit(fast, number=rounds) / rounds * 1e6
+        print(f"{name:<28}{current_us:>10.1f}us{fast_us:>10.1f}us{current_us / fast_us:>9.1f}x")
+
+    for name, payload in _payloads().items():
+        report(
+            f"response: {name}",
+            lambda: JSONResponse(jsonable_encoder(payload)).body,
+            lambda: FastJSONResponse(payload).body
+        )
+
+    def model_interaction():
+        doc = Interaction(user_id="a", target_user_id="b", action="like").model_dump()
+        doc["created_at"] = doc["created_at"].isoformat()
+        return doc
+
+    def model_message():
+        doc = Message(match_id="m", sender_id="a", receiver_id="b", content="hi").model_dump()
+        doc["sent_at"] = doc["sent_at"].isoformat()
+        return doc
+
+    report("document: interaction", model_interaction, lambda: interaction_doc("a", "b", "like"))
+    report("document: message", model_message, lambda: message_doc("m", "a", "b", "hi"))
+
+
+if __name__ == "__main__":
+    main()
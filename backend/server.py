@@ -1,7 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, status, Depends, File, Request, Response, UploadFile, WebSocket
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ASCENDING, DESCENDING, GEOSPHERE, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
@@ -9,11 +12,40 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import random
-import string
 import math
 import logging
 
-from auth import hash_password, verify_password, create_access_token, get_current_user
+from auth import (
+    hash_password, verify_password, create_access_token, get_current_user, get_admin_user, user_from_token,
+    use_token_versions, forget_token_version, token_cache_snapshot, password_hasher
+)
+from indexes import ensure_indexes
+from scoring import rank_candidates
+from seen_set import SeenSetStore
+from candidate_queue import CandidateQueues
+from interests import InterestVocabulary, words_to_mask, overlap_and_union
+from interaction_writer import InteractionWriter
+from pagination import (
+    NEXT_CURSOR_HEADER, BEFORE_CURSOR_HEADER, AFTER_CURSOR_HEADER,
+    encode_cursor, decode_cursor, ascending_after, descending_after
+)
+from realtime import RealtimeHub, backend_from_env, CLOSE_POLICY_VIOLATION
+from user_stats import StatsRecorder
+from rollups import RollupScheduler, query_range
+from view_recorder import ViewRecorder
+from cache import AsyncTTLCache
+from waitlist_rank import WaitlistRanking
+from referral_codes import ReferralCodeAllocator, generate_referral_code
+from blob_store import BlobTooLarge, blob_store_from_env, is_digest
+from photos import (
+    PhotoRejected, PhotoStore, RangeNotSatisfiable,
+    decode_base64_photo, parse_range, photo_url, upload_chunks
+)
+from waitlist_io import FORMATS as WAITLIST_FORMATS, MEDIA_TYPES, QUEUE_ORDER, WaitlistImporter, export_lines, iter_lines, iter_rows
+from serialization import (
+    FastJSONResponse, fast_json, format_timestamp, interaction_doc, message_doc, parse_timestamp,
+    timestamp, timestamp_query, to_document
+)
 
 # ==================== ENV ====================
 
@@ -23,13 +55,59 @@ load_dotenv(ROOT_DIR / ".env")
 MONGO_URL = os.environ["MONGO_URL"]
 DB_NAME = os.environ["DB_NAME"]
 
+# Candidate retrieval for /matches/potential: "geo" (nearest-first within a
+# radius, needs the location.point backfill) or "city" (legacy city filter)
+CANDIDATE_RETRIEVAL_MODE = os.environ.get("CANDIDATE_RETRIEVAL_MODE", "geo")
+MATCH_MAX_DISTANCE_KM = float(os.environ.get("MATCH_MAX_DISTANCE_KM", "50"))
+MATCH_CANDIDATE_POOL = int(os.environ.get("MATCH_CANDIDATE_POOL", "100"))
+# Profiles read per page while skipping already-seen ones; further pages are
+# read until the pool is full or the radius is exhausted
+MATCH_CANDIDATE_SCAN_LIMIT = int(os.environ.get("MATCH_CANDIDATE_SCAN_LIMIT", "2000"))
+# Per-process read-through cache for get_profile_by_user_id
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.environ.get("PROFILE_CACHE_TTL_SECONDS", "30"))
+# Per-process read-through cache of users documents behind /auth/me
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "30"))
+
 # ==================== DB ====================
 
-client = AsyncIOMotorClient(MONGO_URL)
+# tz_aware: stored dates come back as UTC-aware datetimes
+client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
 db = client[DB_NAME]
 
 print("✅ Connected MongoDB Database:", db.name)
 
+# Per-user Bloom filters of already viewed/swiped user_ids
+seen_sets = SeenSetStore(db)
+
+# Interest string -> bit position mapping for profiles.interest_mask
+interest_vocab = InterestVocabulary(db)
+
+# Write-behind buffer for interactions nobody reads back immediately
+interaction_writer = InteractionWriter(db.interactions)
+
+# WebSocket fan-out; REALTIME_BACKEND=mongo to reach sockets on other workers
+realtime_hub = RealtimeHub(backend_from_env(db))
+
+# Incrementally maintained counters behind /analytics/my-stats
+user_stats = StatsRecorder(db)
+
+# Deduplicated profile views, upserted per (viewer, target) in the background
+view_recorder = ViewRecorder(db, user_stats, seen_sets)
+
+# Hourly/daily platform rollups behind /analytics/admin
+rollup_scheduler = RollupScheduler(db)
+
+# In-memory queue positions behind the waitlist endpoints
+waitlist_ranking = WaitlistRanking(db)
+
+# Unique-index-backed referral code assignment
+referral_codes = ReferralCodeAllocator(db.waitlist)
+
+# Photo bytes live in the blob store; profiles keep /api/photos/<digest> URLs
+photo_store = PhotoStore(db, blob_store_from_env())
+
 # ==================== APP ====================
 
 app = FastAPI()
@@ -107,6 +185,7 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_active: bool = True
     has_profile: bool = False
+    token_version: int = 0  # bumped to revoke every issued token
 
 
 # Profile Models (Phase 3)
@@ -118,8 +197,15 @@ class Profile(BaseModel):
     bio: str
     age: int
     interests: List[str] = []
+    interest_mask: List[int] = []  # interests as vocabulary bitmask words
     photos: List[str] = []  # URLs or base64
-    location: dict = {"city": "NYC", "neighborhood": "Downtown", "lat": 40.7128, "lng": -74.0060}
+    location: dict = {
+        "city": "NYC",
+        "neighborhood": "Downtown",
+        "lat": 40.7128,
+        "lng": -74.0060,
+        "point": {"type": "Point", "coordinates": [-74.0060, 40.7128]}
+    }
     looking_for: str = "relationship"  # "relationship", "dating", "friends"
     is_verified: bool = False
     verification_photos: List[str] = []
@@ -151,9 +237,15 @@ class Match(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user1_id: str
     user2_id: str
+    pair_key: str  # see match_pair_key(); unique per pair of users
     matched_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     last_message_at: Optional[datetime] = None
     is_active: bool = True
+    # user_id -> sent_at of the newest message that user has read
+    read_up_to: dict = {}
+    # Conversation summary maintained by send_message / get_messages
+    last_message: Optional[dict] = None  # {"sender_id", "snippet", "sent_at"}
+    unread: dict = {}  # user_id -> unread message count
 
 class Interaction(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -193,19 +285,306 @@ class PoseDetectionResponse(BaseModel):
     detected_poses: List[str]
     message: str
 
+# Fields list screens need to render a profile card
+PROFILE_CARD_FIELDS = (
+    "user_id", "bio", "age", "interests", "looking_for", "is_verified",
+    "location.city", "location.neighborhood"
+)
+PROFILE_CARD_PROJECTION = {
+    "_id": 0,
+    **{field: 1 for field in PROFILE_CARD_FIELDS},
+    "photos": {"$slice": 1}
+}
+
+# Card plus what scoring.py reads, as a $project stage for candidate retrieval
+CANDIDATE_PROJECTION = {
+    "_id": 0,
+    **{field: 1 for field in PROFILE_CARD_FIELDS},
+    "location.lat": 1,
+    "location.lng": 1,
+    "interest_mask": 1,
+    "photo_count": {"$size": {"$ifNull": ["$photos", []]}},
+    "photos": {"$slice": [{"$ifNull": ["$photos", []]}, 1]}
+}
+
+# Opt-in `fields` for GET /profile/{user_id}; anything else is rejected
+PROFILE_SELECTABLE_FIELDS = {
+    "user_id", "bio", "age", "interests", "looking_for", "is_verified", "photos",
+    "location", "location.city", "location.neighborhood", "created_at", "updated_at"
+}
+
+MY_MATCHES_MAX_LIMIT = 200
+MESSAGES_MAX_LIMIT = 200
+MESSAGE_SNIPPET_LENGTH = 100
+
+# Peer's read watermark on GET /messages/{match_id}
+PEER_READ_UP_TO_HEADER = "X-Peer-Read-Up-To"
+
+# ==================== INDEXES ====================
+# Applied idempotently on startup; `python indexes.py report` lists
+# missing/unused ones and `python indexes.py apply` runs them as a migration.
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "profiles": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("location.point", GEOSPHERE)], name="location_point_2dsphere"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "interest_vocab": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+        IndexModel([("bit", ASCENDING)], name="bit_unique", unique=True),
+    ],
+    "profile_views": [
+        IndexModel([("viewer_id", ASCENDING), ("target_user_id", ASCENDING)], name="viewer_target_unique", unique=True),
+        IndexModel([("target_user_id", ASCENDING), ("last_seen", DESCENDING)], name="target_last_seen"),
+        IndexModel([("first_seen", ASCENDING)], name="first_seen"),
+        IndexModel([("last_seen", ASCENDING)], name="last_seen"),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "analytics_rollups": [
+        IndexModel([("granularity", ASCENDING), ("start", ASCENDING)], name="granularity_start"),
+        # Hourly buckets carry expire_at; daily ones are kept
+        IndexModel([("expire_at", ASCENDING)], name="expire_at_ttl", expireAfterSeconds=0),
+    ],
+    "seen_sets": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "interactions": [
+        IndexModel(
+            [("user_id", ASCENDING), ("target_user_id", ASCENDING), ("action", ASCENDING)],
+            name="user_target_action"
+        ),
+        IndexModel([("user_id", ASCENDING), ("action", ASCENDING)], name="user_action"),
+        IndexModel([("target_user_id", ASCENDING), ("action", ASCENDING)], name="target_action"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "matches": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Partial so legacy matches without a key don't collide before the backfill
+        IndexModel(
+            [("pair_key", ASCENDING)],
+            name="pair_key_unique",
+            unique=True,
+            partialFilterExpression={"pair_key": {"$exists": True}}
+        ),
+        IndexModel(
+            [("user1_id", ASCENDING), ("user2_id", ASCENDING), ("is_active", ASCENDING)],
+            name="user1_user2_active"
+        ),
+        IndexModel([("matched_at", ASCENDING)], name="matched_at"),
+        # Serve /matches/my-matches pages for either side of the match
+        IndexModel(
+            [("user1_id", ASCENDING), ("is_active", ASCENDING), ("last_message_at", DESCENDING), ("id", DESCENDING)],
+            name="user1_active_last_message"
+        ),
+        IndexModel(
+            [("user2_id", ASCENDING), ("is_active", ASCENDING), ("last_message_at", DESCENDING), ("id", DESCENDING)],
+            name="user2_active_last_message"
+        ),
+    ],
+    "messages": [
+        IndexModel(
+            [("match_id", ASCENDING), ("sent_at", ASCENDING), ("id", ASCENDING)],
+            name="match_sent_at_id"
+        ),
+        IndexModel([("sent_at", ASCENDING)], name="sent_at"),
+    ],
+    "photos": [
+        IndexModel([("digest", ASCENDING)], name="digest_unique", unique=True),
+    ],
+    "waitlist": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("referral_code", ASCENDING)], name="referral_code_unique", unique=True),
+        IndexModel(QUEUE_ORDER, name="queue_order"),
+    ],
+}
+
 # ==================== HELPERS ====================
 
-def generate_referral_code(length=8):
-    """Generate a unique referral code"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+def match_pair_key(user_a: str, user_b: str) -> str:
+    """Order-independent key identifying the match between two users"""
+    return ":".join(sorted((user_a, user_b)))
+
+async def get_or_create_match(user_id: str, target_user_id: str):
+    """Upsert the pair's match; returns (match_id, created)"""
+    match = Match(
+        user1_id=user_id,
+        user2_id=target_user_id,
+        pair_key=match_pair_key(user_id, target_user_id)
+    )
+    match_doc = to_document(match)
+    
+    try:
+        existing = await db.matches.find_one_and_update(
+            {"pair_key": match.pair_key},
+            {"$setOnInsert": match_doc},
+            projection={"_id": 0, "id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost a concurrent upsert race; the winner's match is the match
+        existing = await db.matches.find_one({"pair_key": match.pair_key}, {"_id": 0, "id": 1})
+    
+    return existing["id"], existing["id"] == match.id
+
+def waitlist_user_stats(record: dict) -> "UserStats":
+    """UserStats for an in-memory waitlist record, positioned in O(log n)"""
+    return UserStats(
+        email=record["email"],
+        referral_code=record["referral_code"],
+        boosts=record.get("boosts") or 0,
+        verified_referrals=record.get("verified_referrals") or 0,
+        position_in_line=waitlist_ranking.position(record["email"]),
+        is_vip=bool(record.get("is_vip"))
+    )
+
+async def load_token_version(user_id: str) -> Optional[int]:
+    user = await db.users.find_one({"_id": user_id}, {"token_version": 1})
+    return user.get("token_version", 0) if user else None
+
+# Tokens carry the user's token_version; a mismatch means they were revoked
+use_token_versions(load_token_version)
 
 async def get_user_by_email(email: str):
     return await db.users.find_one({"email": email})
 
-async def get_profile_by_user_id(user_id: str):
-    """Get profile by user_id"""
-    profile = await db.profiles.find_one({"user_id": user_id}, {"_id": 0})
-    return profile
+async def load_user(user_id: str):
+    return await db.users.find_one({"_id": user_id}, {"password_hash": 0, "token_version": 0})
+
+# Users documents by id for /auth/me; writers must call user_cache.invalidate
+user_cache = AsyncTTLCache(load_user, USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+async def load_profile(user_id: str):
+    return await db.profiles.find_one({"user_id": user_id}, {"_id": 0})
+
+# Whole profiles by user_id; writers must call profile_cache.invalidate
+profile_cache = AsyncTTLCache(load_profile, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+async def get_profile_by_user_id(user_id: str, projection: Optional[dict] = None):
+    """Get profile by user_id (optionally only the fields in `projection`)"""
+    if projection:
+        # Partial reads go to Mongo so only the projected bytes are fetched
+        return await db.profiles.find_one({"user_id": user_id}, projection)
+    return await profile_cache.get(user_id)
+
+def profile_fields_projection(fields: str) -> dict:
+    """Mongo projection for a comma-separated `fields` query parameter"""
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - PROFILE_SELECTABLE_FIELDS
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown profile fields: {', '.join(sorted(unknown))}"
+        )
+    # A parent path already covers its children (Mongo rejects both together)
+    requested = {f for f in requested if f.split(".")[0] == f or f.split(".")[0] not in requested}
+    return {"_id": 0, "user_id": 1, **{field: 1 for field in requested}}
+
+def profile_card(profile: dict) -> dict:
+    """Drop the scoring-only fields CANDIDATE_PROJECTION adds to a card"""
+    card = {field: profile[field] for field in PROFILE_CARD_FIELDS if "." not in field and field in profile}
+    location = profile.get("location", {})
+    card["location"] = {key: location[key] for key in ("city", "neighborhood") if key in location}
+    card["photos"] = profile.get("photos", [])
+    return card
+
+def geo_point(lat: float, lng: float) -> dict:
+    """GeoJSON point for the location.point 2dsphere index"""
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+def candidate_pipeline(my_profile: dict, max_distance_km: float, after: Optional[tuple]) -> list:
+    """
+    One page of candidates past `after`, the (position, user_ids) of the
+    previous page's last profile: distance in geo mode, user_id in city mode.
+    """
+    user_id = my_profile["user_id"]
+    
+    if CANDIDATE_RETRIEVAL_MODE == "city":
+        match = {"user_id": {"$ne": user_id}, "location.city": my_profile["location"].get("city", "NYC")}
+        if after is not None:
+            match["user_id"] = {"$ne": user_id, "$gt": after[0]}
+        return [
+            {"$match": match},
+            {"$sort": {"user_id": 1}},
+            {"$limit": MATCH_CANDIDATE_SCAN_LIMIT},
+            {"$project": CANDIDATE_PROJECTION}
+        ]
+    
+    my_location = my_profile["location"]
+    near = my_location.get("point") or geo_point(my_location["lat"], my_location["lng"])
+    geo_near = {
+        "near": near,
+        "key": "location.point",
+        "distanceField": "distance_m",
+        "maxDistance": max_distance_km * 1000,
+        "spherical": True,
+        "query": {"user_id": {"$ne": user_id}}
+    }
+    if after is not None:
+        # minDistance is inclusive: skip the profiles already read at that distance
+        geo_near["minDistance"] = after[0]
+        geo_near["query"] = {"user_id": {"$nin": [user_id, *after[1]]}}
+    return [
+        {"$geoNear": geo_near},
+        {"$limit": MATCH_CANDIDATE_SCAN_LIMIT},
+        {"$project": {**CANDIDATE_PROJECTION, "distance_m": 1}}
+    ]
+
+async def find_candidate_profiles(my_profile: dict, seen, max_distance_km: float):
+    """Nearest-first candidate profiles within `max_distance_km`, skipping `seen`"""
+    candidates = []
+    after = None
+    while len(candidates) < MATCH_CANDIDATE_POOL:
+        scanned = 0
+        cursor = db.profiles.aggregate(candidate_pipeline(my_profile, max_distance_km, after))
+        try:
+            async for profile in cursor:
+                scanned += 1
+                position = profile.pop("distance_m", profile["user_id"])
+                if after is not None and after[0] == position:
+                    after[1].append(profile["user_id"])
+                else:
+                    after = (position, [profile["user_id"]])
+                # Exclusion is a constant-time filter check, independent of swipe history
+                if profile["user_id"] in seen:
+                    continue
+                candidates.append(profile)
+                if len(candidates) >= MATCH_CANDIDATE_POOL:
+                    break
+        finally:
+            await cursor.close()
+        if scanned < MATCH_CANDIDATE_SCAN_LIMIT:
+            break  # radius (or city) exhausted
+    return candidates
+
+async def load_candidate_queue(user_id: str, size: int, max_distance_km: float = MATCH_MAX_DISTANCE_KM):
+    """Ranked candidates for the user's queue (runs in the background refill workers)"""
+    my_profile = await get_profile_by_user_id(user_id)
+    if not my_profile:
+        raise HTTPException(status_code=404, detail="Please create your profile first")
+    
+    seen = await seen_sets.get(user_id)
+    potential_profiles = await find_candidate_profiles(my_profile, seen, max_distance_km)
+    
+    # Score all candidates in one vectorized pass and keep the top `size`
+    ranked = rank_candidates(my_profile, potential_profiles, size)
+    for entry in ranked:
+        entry["profile"] = profile_card(entry["profile"])
+    return ranked
+
+# Materialized per-user candidate queues for /matches/potential
+candidate_queues = CandidateQueues(load_candidate_queue)
+
+# Scalar reference implementations; scoring.py is the vectorized version
+# used by /matches/potential and must produce the same results.
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two coordinates in km"""
@@ -234,17 +613,23 @@ def calculate_match_score(user_profile, target_profile, distance_km):
         score += 10
     
     # Interest overlap (max 40 points)
-    user_interests = set(user_profile.get("interests", []))
-    target_interests = set(target_profile.get("interests", []))
-    if user_interests and target_interests:
-        overlap = len(user_interests & target_interests)
-        total = len(user_interests | target_interests)
+    user_mask = user_profile.get("interest_mask")
+    target_mask = target_profile.get("interest_mask")
+    if user_mask is not None and target_mask is not None:
+        overlap, total = overlap_and_union(words_to_mask(user_mask), words_to_mask(target_mask))
         score += int((overlap / total) * 40) if total > 0 else 0
+    else:
+        user_interests = set(user_profile.get("interests", []))
+        target_interests = set(target_profile.get("interests", []))
+        if user_interests and target_interests:
+            overlap = len(user_interests & target_interests)
+            total = len(user_interests | target_interests)
+            score += int((overlap / total) * 40) if total > 0 else 0
     
     # Profile completeness (max 30 points)
     if target_profile.get("bio"):
         score += 10
-    if len(target_profile.get("photos", [])) >= 3:
+    if target_profile.get("photo_count", len(target_profile.get("photos", []))) >= 3:
         score += 10
     if target_profile.get("is_verified"):
         score += 10
@@ -261,7 +646,7 @@ async def signup(user_data: UserSignup):
 
     user = User(
         email=user_data.email,
-        password_hash=hash_password(user_data.password),
+        password_hash=await hash_password(user_data.password),
         full_name=user_data.full_name,
         gender=user_data.gender,
         date_of_birth=user_data.date_of_birth
@@ -275,10 +660,12 @@ async def signup(user_data: UserSignup):
     if not result.inserted_id:
         raise HTTPException(500, "User insert failed")
 
-    access_token = create_access_token({
-        "user_id": user.id,
-        "email": user.email
-    })
+    access_token = create_access_token(
+        {"user_id": user.id, "email": user.email},
+        is_active=user.is_active,
+        has_profile=False,
+        token_version=user.token_version
+    )
 
     return Token(
         access_token=access_token,
@@ -291,13 +678,21 @@ async def signup(user_data: UserSignup):
 async def login(credentials: UserLogin):
 
     user = await get_user_by_email(credentials.email)
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user:
         raise HTTPException(401, "Invalid email or password")
-
-    token = create_access_token({
-        "user_id": user["_id"],
-        "email": user["email"]
-    })
+    valid, new_hash = await verify_password(credentials.password, user["password_hash"])
+    if not valid:
+        raise HTTPException(401, "Invalid email or password")
+    if new_hash:
+        # Stored with older Argon2 parameters; upgrade while we have the password
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password_hash": new_hash}})
+
+    token = create_access_token(
+        {"user_id": user["_id"], "email": user["email"]},
+        is_active=user.get("is_active", True),
+        has_profile=user.get("has_profile", False),
+        token_version=user.get("token_version", 0)
+    )
 
     return Token(
         access_token=token,
@@ -308,13 +703,22 @@ async def login(credentials: UserLogin):
 
 @api_router.get("/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one(
-        {"_id": current_user["user_id"]},
-        {"password_hash": 0}
-    )
+    user = await user_cache.get(current_user["user_id"])
     if not user:
         raise HTTPException(404, "User not found")
-    return user
+    # has_profile never goes back to False, so a token saying True is current
+    # even while another worker's cached copy still says False
+    return {**user, "has_profile": bool(user.get("has_profile") or current_user["claims"].get("has_profile"))}
+
+@api_router.post("/auth/logout-all")
+async def logout_all(current_user: dict = Depends(get_current_user)):
+    """Revoke every token issued to the current user"""
+    await db.users.update_one(
+        {"_id": current_user["user_id"]},
+        {"$inc": {"token_version": 1}}
+    )
+    forget_token_version(current_user["user_id"])
+    return {"message": "Signed out of all sessions"}
 
 # ==================== PROFILE ENDPOINTS ====================
 
@@ -338,19 +742,19 @@ async def create_profile(profile_data: ProfileCreate, current_user: dict = Depen
         bio=profile_data.bio,
         age=profile_data.age,
         interests=profile_data.interests,
+        interest_mask=await interest_vocab.encode_words(profile_data.interests),
         looking_for=profile_data.looking_for,
         location={
             "city": "NYC",
             "neighborhood": profile_data.neighborhood,
             "lat": 40.7128,
-            "lng": -74.0060
+            "lng": -74.0060,
+            "point": geo_point(40.7128, -74.0060)
         }
     )
     
     # Save to database
-    doc = profile.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
+    doc = to_document(profile)
     await db.profiles.insert_one(doc)
     
     # Update user has_profile flag
@@ -358,6 +762,9 @@ async def create_profile(profile_data: ProfileCreate, current_user: dict = Depen
         {"id": current_user["user_id"]},
         {"$set": {"has_profile": True}}
     )
+    user_cache.invalidate(current_user["user_id"])
+    profile_cache.invalidate(current_user["user_id"])
+    candidate_queues.invalidate(current_user["user_id"])
     
     return {"message": "Profile created successfully", "profile_id": profile.id}
 
@@ -378,7 +785,9 @@ async def update_profile(profile_data: ProfileUpdate, current_user: dict = Depen
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if "interests" in update_data:
+        update_data["interest_mask"] = await interest_vocab.encode_words(update_data["interests"])
+    update_data["updated_at"] = timestamp()
     
     result = await db.profiles.update_one(
         {"user_id": current_user["user_id"]},
@@ -388,115 +797,165 @@ async def update_profile(profile_data: ProfileUpdate, current_user: dict = Depen
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Profile not found")
     
+    profile_cache.invalidate(current_user["user_id"])
+    # Interests and preferences feed the ranking
+    candidate_queues.invalidate(current_user["user_id"])
+    
     return {"message": "Profile updated successfully"}
 
 
 @api_router.post("/profile/upload-photo")
-async def upload_photo(photo_base64: str, current_user: dict = Depends(get_current_user)):
-    """Upload profile photo"""
-    profile = await get_profile_by_user_id(current_user["user_id"])
+async def upload_photo(
+    file: Optional[UploadFile] = File(None),
+    photo_base64: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Upload profile photo as a multipart `file` (or legacy `photo_base64`)"""
+    profile = await db.profiles.find_one({"user_id": current_user["user_id"]}, {"_id": 1})
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
+    if file is None and not photo_base64:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No photo provided")
+    
+    try:
+        if file is not None:
+            photo = await photo_store.save(upload_chunks(file))
+        else:
+            photo = await photo_store.save_bytes(decode_base64_photo(photo_base64))
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except PhotoRejected as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    url = photo_url(photo["digest"])
     
     # Verify with pose detection
-    verification = await verify_pose_internal(photo_base64, current_user["user_id"])
+    verification = await verify_pose_internal(url, current_user["user_id"])
     if not verification["success"]:
+        # Rejected photos don't stay behind in the blob store
+        await photo_store.discard(photo["digest"])
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=verification["message"]
         )
     
-    # Add photo to profile
+    # Profiles only reference the stored photo; URLs are content-addressed,
+    # so uploading the same image again doesn't add it twice
     await db.profiles.update_one(
         {"user_id": current_user["user_id"]},
-        {"$push": {"photos": photo_base64}}
+        {"$addToSet": {"photos": url}}
     )
+    profile_cache.invalidate(current_user["user_id"])
     
-    return {"message": "Photo uploaded successfully", "verification": verification}
+    return {
+        "message": "Photo uploaded successfully",
+        "verification": verification,
+        "photo": {"url": url, "thumbnail_url": url + "?size=thumb"}
+    }
+
+
+@api_router.get("/photos/{digest}")
+async def get_photo(digest: str, request: Request, size: str = "original"):
+    """Serve a stored photo (or its thumbnail) with ETag and Range support"""
+    if size not in ("original", "thumb"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="size must be original or thumb")
+    photo = await photo_store.get(digest) if is_digest(digest) else None
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    blob = photo["thumbnail"] if size == "thumb" and photo.get("thumbnail") else photo
+    
+    # Content-addressed, so the digest is a strong validator and never goes stale
+    etag = f'"{blob["digest"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    total = blob["size"]
+    try:
+        byte_range = parse_range(request.headers.get("range"), total)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{total}"}
+        )
+    if byte_range is None:
+        headers["Content-Length"] = str(total)
+        return StreamingResponse(photo_store.blobs.read(blob["digest"]), media_type=blob["content_type"], headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        photo_store.blobs.read(blob["digest"], start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=blob["content_type"],
+        headers=headers
+    )
 
 
 @api_router.get("/profile/{user_id}")
-async def get_profile(user_id: str, current_user: dict = Depends(get_current_user)):
-    """Get another user's profile"""
-    profile = await get_profile_by_user_id(user_id)
+async def get_profile(
+    user_id: str,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get another user's profile (`fields=bio,age,...` returns only those)"""
+    projection = profile_fields_projection(fields) if fields else None
+    profile = await get_profile_by_user_id(user_id, projection)
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    # Record view interaction
-    interaction = Interaction(
-        user_id=current_user["user_id"],
-        target_user_id=user_id,
-        action="view"
-    )
-    doc = interaction.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.interactions.insert_one(doc)
+    # Deduplicated in memory and written in the background; nothing awaited here
+    view_recorder.record(current_user["user_id"], user_id)
+    candidate_queues.pop(current_user["user_id"], user_id)
     
     return profile
 
 
 # ==================== MATCHING & SWIPE ENDPOINTS ====================
 
-@api_router.get("/matches/potential")
-async def get_potential_matches(limit: int = 20, current_user: dict = Depends(get_current_user)):
+@api_router.get("/matches/potential", response_class=FastJSONResponse)
+async def get_potential_matches(
+    limit: int = 20,
+    offset: int = 0,
+    max_distance_km: Optional[float] = None,
+    current_user: dict = Depends(get_current_user)
+):
     """Get potential matches based on location, interests, and activity"""
-    # Get current user's profile
-    my_profile = await get_profile_by_user_id(current_user["user_id"])
-    if not my_profile:
-        raise HTTPException(status_code=404, detail="Please create your profile first")
-    
-    # Get users already interacted with
-    interactions = await db.interactions.find(
-        {"user_id": current_user["user_id"]},
-        {"target_user_id": 1}
-    ).to_list(1000)
-    interacted_ids = [i["target_user_id"] for i in interactions]
-    interacted_ids.append(current_user["user_id"])  # Exclude self
-    
-    # Get potential matches (users not interacted with, in NYC)
-    potential_profiles = await db.profiles.find(
-        {
-            "user_id": {"$nin": interacted_ids},
-            "location.city": "NYC"
-        },
-        {"_id": 0}
-    ).to_list(100)
-    
-    # Calculate match scores
-    scored_matches = []
-    my_location = my_profile["location"]
-    for profile in potential_profiles:
-        target_location = profile["location"]
-        distance = calculate_distance(
-            my_location["lat"], my_location["lng"],
-            target_location["lat"], target_location["lng"]
+    if max_distance_km is not None and not 0 < max_distance_km <= MATCH_MAX_DISTANCE_KM:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"max_distance_km must be greater than 0 and at most {MATCH_MAX_DISTANCE_KM:g}"
         )
-        
-        score = calculate_match_score(my_profile, profile, distance)
-        scored_matches.append({
-            "profile": profile,
-            "match_score": score,
-            "distance_km": round(distance, 1)
-        })
-    
-    # Sort by match score
-    scored_matches.sort(key=lambda x: x["match_score"], reverse=True)
     
-    return scored_matches[:limit]
+    # Served from the user's precomputed queue, refilled in the background
+    page = await candidate_queues.page(current_user["user_id"], offset, limit, max_distance_km)
+    if max_distance_km is not None and len(page) < limit:
+        # The queue holds the best candidates of the whole radius, so a
+        # narrower one can run out early: rank that radius directly instead
+        ranked = await load_candidate_queue(current_user["user_id"], offset + limit, max_distance_km)
+        # City retrieval doesn't bound distance itself
+        ranked = [entry for entry in ranked if entry["distance_km"] <= max_distance_km]
+        page = ranked[offset:offset + limit]
+    return fast_json(page)
 
 
-@api_router.post("/matches/swipe")
+@api_router.post("/matches/swipe", response_class=FastJSONResponse)
 async def swipe(swipe_data: SwipeAction, current_user: dict = Depends(get_current_user)):
     """Record a swipe action (like, pass, super_like)"""
     # Record interaction
-    interaction = Interaction(
-        user_id=current_user["user_id"],
-        target_user_id=swipe_data.target_user_id,
-        action=swipe_data.action
-    )
-    doc = interaction.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.interactions.insert_one(doc)
+    doc = interaction_doc(current_user["user_id"], swipe_data.target_user_id, swipe_data.action)
+    if swipe_data.action in ["like", "super_like"]:
+        # Must be visible to the other user's mutual-like check right away
+        await interaction_writer.write_now(doc)
+    else:
+        await interaction_writer.write(doc)
+    user_stats.record_interaction(current_user["user_id"], swipe_data.target_user_id, swipe_data.action)
+    await seen_sets.add(current_user["user_id"], swipe_data.target_user_id)
+    candidate_queues.pop(current_user["user_id"], swipe_data.target_user_id)
     
     # Check if it's a match (if target also liked current user)
     if swipe_data.action in ["like", "super_like"]:
@@ -507,66 +966,86 @@ async def swipe(swipe_data: SwipeAction, current_user: dict = Depends(get_curren
         })
         
         if mutual_like:
-            # Create match
-            match = Match(
-                user1_id=current_user["user_id"],
-                user2_id=swipe_data.target_user_id
+            # Exactly one match per pair, even if both like at the same moment
+            match_id, created = await get_or_create_match(
+                current_user["user_id"],
+                swipe_data.target_user_id
             )
-            match_doc = match.model_dump()
-            match_doc['matched_at'] = match_doc['matched_at'].isoformat()
-            await db.matches.insert_one(match_doc)
             
-            # Record match interaction for both users
-            for user_id, target_id in [
-                (current_user["user_id"], swipe_data.target_user_id),
-                (swipe_data.target_user_id, current_user["user_id"])
-            ]:
-                match_interaction = Interaction(
-                    user_id=user_id,
-                    target_user_id=target_id,
-                    action="match"
-                )
-                int_doc = match_interaction.model_dump()
-                int_doc['created_at'] = int_doc['created_at'].isoformat()
-                await db.interactions.insert_one(int_doc)
+            # Record match interaction for both users (only by whoever created it)
+            if created:
+                int_docs = []
+                for user_id, target_id in [
+                    (current_user["user_id"], swipe_data.target_user_id),
+                    (swipe_data.target_user_id, current_user["user_id"])
+                ]:
+                    int_docs.append(interaction_doc(user_id, target_id, "match"))
+                    user_stats.record_interaction(user_id, target_id, "match")
+                await interaction_writer.write_many_now(int_docs)
             
-            return {"action": swipe_data.action, "matched": True, "match_id": match.id}
+            return fast_json({"action": swipe_data.action, "matched": True, "match_id": match_id})
     
-    return {"action": swipe_data.action, "matched": False}
+    return fast_json({"action": swipe_data.action, "matched": False})
 
 
-@api_router.get("/matches/my-matches")
-async def get_my_matches(current_user: dict = Depends(get_current_user)):
-    """Get all user's matches"""
+@api_router.get("/matches/my-matches", response_class=FastJSONResponse)
+async def get_my_matches(
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get user's matches, most recent conversation first (next page cursor in X-Next-Cursor)"""
+    limit = max(1, min(limit, MY_MATCHES_MAX_LIMIT))
+    query = {
+        "$or": [
+            {"user1_id": current_user["user_id"]},
+            {"user2_id": current_user["user_id"]}
+        ],
+        "is_active": True
+    }
+    if cursor:
+        last_message_at, match_id = decode_cursor(cursor, 2)
+        query = {"$and": [query, descending_after("last_message_at", last_message_at, match_id)]}
+    
     matches = await db.matches.find(
-        {
-            "$or": [
-                {"user1_id": current_user["user_id"]},
-                {"user2_id": current_user["user_id"]}
-            ],
-            "is_active": True
-        },
-        {"_id": 0}
-    ).to_list(1000)
+        query,
+        {"_id": 0, "id": 1, "user1_id": 1, "user2_id": 1, "matched_at": 1, "last_message_at": 1}
+    ).sort([("last_message_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    if len(matches) > limit:
+        matches = matches[:limit]
+        last = matches[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.get("last_message_at"), last["id"])
+    
+    # Enrich with profile cards in a single query
+    other_ids = [
+        match["user2_id"] if match["user1_id"] == current_user["user_id"] else match["user1_id"]
+        for match in matches
+    ]
+    profiles = await db.profiles.find(
+        {"user_id": {"$in": other_ids}},
+        PROFILE_CARD_PROJECTION
+    ).to_list(len(other_ids))
+    profiles_by_user = {profile["user_id"]: profile for profile in profiles}
     
-    # Enrich with profile data
     enriched_matches = []
-    for match in matches:
-        other_user_id = match["user2_id"] if match["user1_id"] == current_user["user_id"] else match["user1_id"]
-        other_profile = await get_profile_by_user_id(other_user_id)
+    for match, other_user_id in zip(matches, other_ids):
+        other_profile = profiles_by_user.get(other_user_id)
         if other_profile:
             enriched_matches.append({
                 "match_id": match["id"],
                 "matched_at": match["matched_at"],
+                "last_message_at": match.get("last_message_at"),
                 "profile": other_profile
             })
     
-    return enriched_matches
+    return fast_json(enriched_matches, response)
 
 
 # ==================== MESSAGING ENDPOINTS ====================
 
-@api_router.post("/messages/send")
+@api_router.post("/messages/send", response_class=FastJSONResponse)
 async def send_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
     """Send a message to a matched user"""
     # Verify users are matched
@@ -585,58 +1064,182 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
         )
     
     # Create message
-    message = Message(
-        match_id=match["id"],
-        sender_id=current_user["user_id"],
-        receiver_id=message_data.receiver_id,
-        content=message_data.content
-    )
-    
-    doc = message.model_dump()
-    doc['sent_at'] = doc['sent_at'].isoformat()
+    doc = message_doc(match["id"], current_user["user_id"], message_data.receiver_id, message_data.content)
     await db.messages.insert_one(doc)
     
-    # Update match last_message_at
+    # Update the conversation summary and the receiver's unread counter
+    # (before publishing, so a client reacting to the push sees both).
+    # Concurrent sends can land out of order: last_message_at only moves
+    # forward, and last_message is only replaced while this message is newest
     await db.matches.update_one(
         {"id": match["id"]},
-        {"$set": {"last_message_at": datetime.now(timezone.utc).isoformat()}}
+        {
+            "$max": {"last_message_at": doc['sent_at']},
+            "$inc": {f"unread.{message_data.receiver_id}": 1}
+        }
+    )
+    await db.matches.update_one(
+        {"id": match["id"], "last_message_at": {"$lte": doc['sent_at']}},
+        {"$set": {"last_message": {
+            "sender_id": doc['sender_id'],
+            "snippet": doc['content'][:MESSAGE_SNIPPET_LENGTH],
+            "sent_at": doc['sent_at']
+        }}}
     )
     
-    return {"message_id": message.id, "sent_at": message.sent_at}
+    # Push to the receiver's open WebSocket connections
+    event_message = {k: v for k, v in doc.items() if k != "_id"}
+    event_message["sent_at"] = format_timestamp(doc["sent_at"])
+    await realtime_hub.publish(message_data.receiver_id, {"type": "message", "message": event_message})
+    
+    return fast_json({"message_id": doc['id'], "sent_at": doc['sent_at']})
 
 
-@api_router.get("/messages/{match_id}")
-async def get_messages(match_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all messages for a match"""
+@api_router.get("/messages/inbox")
+async def get_inbox(current_user: dict = Depends(get_current_user)):
+    """Unread counts and last message of every conversation, most recent first"""
+    user_id = current_user["user_id"]
+    matches = await db.matches.find(
+        {
+            "$or": [
+                {"user1_id": user_id},
+                {"user2_id": user_id}
+            ],
+            "is_active": True
+        },
+        {
+            "_id": 0,
+            "id": 1,
+            "user1_id": 1,
+            "user2_id": 1,
+            "last_message_at": 1,
+            "last_message": 1,
+            f"unread.{user_id}": 1
+        }
+    ).sort([("last_message_at", -1), ("id", -1)]).to_list(None)
+    
+    conversations = [
+        {
+            "match_id": match["id"],
+            "other_user_id": match["user2_id"] if match["user1_id"] == user_id else match["user1_id"],
+            "last_message_at": match.get("last_message_at"),
+            "last_message": match.get("last_message"),
+            "unread_count": (match.get("unread") or {}).get(user_id, 0)
+        }
+        for match in matches
+    ]
+    
+    return {
+        "total_unread": sum(c["unread_count"] for c in conversations),
+        "conversations": conversations
+    }
+
+
+@api_router.get("/messages/{match_id}", response_class=FastJSONResponse)
+async def get_messages(
+    match_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a page of messages for a match, oldest first.
+    
+    Without cursors returns the latest page. X-Before-Cursor (only if older
+    messages exist) loads the previous page via `before`; X-After-Cursor
+    fetches only newer messages via `after`.
+    """
     # Verify user is part of match
-    match = await db.matches.find_one({
-        "id": match_id,
-        "$or": [
-            {"user1_id": current_user["user_id"]},
-            {"user2_id": current_user["user_id"]}
-        ]
-    })
+    match = await db.matches.find_one(
+        {
+            "id": match_id,
+            "$or": [
+                {"user1_id": current_user["user_id"]},
+                {"user2_id": current_user["user_id"]}
+            ]
+        },
+        {"_id": 0, "user1_id": 1, "user2_id": 1, "read_up_to": 1, "unread": 1}
+    )
     
     if not match:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get messages
-    messages = await db.messages.find(
-        {"match_id": match_id},
-        {"_id": 0}
-    ).sort("sent_at", 1).to_list(1000)
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    limit = max(1, min(limit, MESSAGES_MAX_LIMIT))
+    query = {"match_id": match_id}
+    
+    if after:
+        # Incremental sync: messages newer than the cursor, oldest first
+        sent_at, message_id = decode_cursor(after, 2)
+        query.update(ascending_after("sent_at", sent_at, message_id))
+        messages = await db.messages.find(query, {"_id": 0}).sort(
+            [("sent_at", 1), ("id", 1)]
+        ).limit(limit).to_list(limit)
+        has_older = False
+    else:
+        # Latest page, or the page before `before`
+        if before:
+            sent_at, message_id = decode_cursor(before, 2)
+            query.update(descending_after("sent_at", sent_at, message_id))
+        messages = await db.messages.find(query, {"_id": 0}).sort(
+            [("sent_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        has_older = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+    
+    if has_older:
+        response.headers[BEFORE_CURSOR_HEADER] = encode_cursor(messages[0]["sent_at"], messages[0]["id"])
+    if messages:
+        response.headers[AFTER_CURSOR_HEADER] = encode_cursor(messages[-1]["sent_at"], messages[-1]["id"])
+    elif after:
+        response.headers[AFTER_CURSOR_HEADER] = after
+    
+    read_up_to = match.get("read_up_to") or {}
+    other_user_id = match["user2_id"] if match["user1_id"] == current_user["user_id"] else match["user1_id"]
+    if read_up_to.get(other_user_id):
+        response.headers[PEER_READ_UP_TO_HEADER] = format_timestamp(read_up_to[other_user_id])
+    
+    # Mark messages as read by advancing this user's watermark
+    if not before and messages:
+        # Either side may still be a legacy ISO string; compare as datetimes
+        newest = parse_timestamp(messages[-1]["sent_at"])
+        mine = parse_timestamp(read_up_to.get(current_user["user_id"]))
+        unread = (match.get("unread") or {}).get(current_user["user_id"])
+        if mine is None or mine < newest or unread:
+            watermark = newest if mine is None or mine < newest else mine
+            # Recount rather than zero: a send landing between this count and
+            # the sender's $inc leaves the counter one high, never stuck, and
+            # any nonzero counter is recounted on the next read
+            unread = await db.messages.count_documents({"$and": [
+                {"match_id": match_id, "receiver_id": current_user["user_id"]},
+                timestamp_query("sent_at", gt=watermark)
+            ]})
+            await db.matches.update_one(
+                {"id": match_id},
+                {
+                    "$max": {f"read_up_to.{current_user['user_id']}": watermark},
+                    "$set": {f"unread.{current_user['user_id']}": unread}
+                }
+            )
     
-    # Mark messages as read
-    await db.messages.update_many(
-        {
-            "match_id": match_id,
-            "receiver_id": current_user["user_id"],
-            "read_at": None
-        },
-        {"$set": {"read_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    return fast_json(messages, response)
+
+
+@api_router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket, token: str):
+    """Real-time events for the current user (JWT passed as ?token=)"""
+    try:
+        current_user = await user_from_token(token)
+    except HTTPException:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
     
-    return messages
+    await websocket.accept()
+    await realtime_hub.serve(websocket, current_user["user_id"])
 
 
 # ==================== ANALYTICS ENDPOINTS ====================
@@ -644,38 +1247,14 @@ async def get_messages(match_id: str, current_user: dict = Depends(get_current_u
 @api_router.get("/analytics/my-stats")
 async def get_my_analytics(current_user: dict = Depends(get_current_user)):
     """Get user's interaction analytics"""
-    # Get all interactions
-    views = await db.interactions.count_documents({
-        "user_id": current_user["user_id"],
-        "action": "view"
-    })
-    
-    likes = await db.interactions.count_documents({
-        "user_id": current_user["user_id"],
-        "action": {"$in": ["like", "super_like"]}
-    })
-    
-    passes = await db.interactions.count_documents({
-        "user_id": current_user["user_id"],
-        "action": "pass"
-    })
-    
-    matches = await db.interactions.count_documents({
-        "user_id": current_user["user_id"],
-        "action": "match"
-    })
-    
-    # Profile views (how many viewed me)
-    profile_views = await db.interactions.count_documents({
-        "target_user_id": current_user["user_id"],
-        "action": "view"
-    })
-    
-    # Likes received
-    likes_received = await db.interactions.count_documents({
-        "target_user_id": current_user["user_id"],
-        "action": {"$in": ["like", "super_like"]}
-    })
+    # Single document read; counters are maintained by the write paths
+    stats = await user_stats.get(current_user["user_id"])
+    views = stats["views"]
+    likes = stats["likes_sent"]
+    passes = stats["passes"]
+    matches = stats["matches"]
+    profile_views = stats["profile_views"]
+    likes_received = stats["likes_received"]
     
     total_interactions = views + likes + passes
     goal_progress = (total_interactions / 20) * 100
@@ -694,18 +1273,21 @@ async def get_my_analytics(current_user: dict = Depends(get_current_user)):
 
 
 @api_router.get("/analytics/admin")
-async def get_admin_analytics():
-    """Get platform-wide analytics (admin only)"""
-    total_users = await db.users.count_documents({})
-    total_profiles = await db.profiles.count_documents({})
-    total_matches = await db.matches.count_documents({})
-    total_messages = await db.messages.count_documents({})
-    
-    # Active users (interacted in last 7 days)
-    week_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    active_users = await db.interactions.distinct("user_id", {
-        "created_at": {"$gte": week_ago}
-    })
+async def get_admin_analytics(start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Get platform-wide analytics (admin only), for [start, end) or the last 7 days"""
+    # Naive timestamps are taken as UTC; others are converted so the rollup
+    # bucket ids (which are UTC hours and days) line up
+    end = parse_timestamp(end) or datetime.now(timezone.utc)
+    start = parse_timestamp(start) or end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    # Collection totals come from metadata, range figures from the rollups
+    total_users = await db.users.estimated_document_count()
+    total_profiles = await db.profiles.estimated_document_count()
+    total_matches = await db.matches.estimated_document_count()
+    total_messages = await db.messages.estimated_document_count()
+    period = await query_range(db, start, end)
     
     return {
         "total_users": total_users,
@@ -713,8 +1295,14 @@ async def get_admin_analytics():
         "profile_completion_rate": round((total_profiles / total_users * 100), 1) if total_users > 0 else 0,
         "total_matches": total_matches,
         "total_messages": total_messages,
-        "active_users_7d": len(active_users),
-        "messages_per_match": round(total_messages / total_matches, 1) if total_matches > 0 else 0
+        # Kept under its old name; covers the requested period (7 days by default)
+        "active_users_7d": period["active_users"],
+        "messages_per_match": round(total_messages / total_matches, 1) if total_matches > 0 else 0,
+        "period": {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            **period
+        }
     }
 
 
@@ -723,8 +1311,7 @@ async def get_admin_analytics():
 @api_router.post("/waitlist/join", response_model=UserStats, status_code=status.HTTP_201_CREATED)
 async def join_waitlist(signup: WaitlistSignup):
     """Join the waitlist with email and optional referral code"""
-    existing_user = await db.waitlist.find_one({"email": signup.email}, {"_id": 0})
-    if existing_user:
+    if waitlist_ranking.get(signup.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered on waitlist"
@@ -739,78 +1326,60 @@ async def join_waitlist(signup: WaitlistSignup):
                 detail="Invalid referral code"
             )
     
-    referral_code = generate_referral_code()
-    while await db.waitlist.find_one({"referral_code": referral_code}):
-        referral_code = generate_referral_code()
-    
-    is_vip = signup.gender and signup.gender.lower() == "female"
+    is_vip = bool(signup.gender and signup.gender.lower() == "female")
     new_user = WaitlistUser(
         email=signup.email,
-        referral_code=referral_code,
+        referral_code=generate_referral_code(),
         referred_by=signup.referred_by,
         gender=signup.gender,
         is_vip=is_vip,
         boosts=1 if is_vip else 0
     )
     
-    doc = new_user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.waitlist.insert_one(doc)
+    doc = to_document(new_user)
+    try:
+        # The unique indexes decide: a taken code is redrawn, a taken email is rejected
+        await referral_codes.insert(doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered on waitlist"
+        )
+    
+    waitlist_ranking.upsert(doc)
     
     if referrer:
-        await db.waitlist.update_one(
+        updated_referrer = await db.waitlist.find_one_and_update(
             {"email": referrer["email"]},
-            {"$inc": {"verified_referrals": 1, "boosts": 1}}
+            {"$inc": {"verified_referrals": 1, "boosts": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
+        if updated_referrer:
+            waitlist_ranking.upsert(updated_referrer)
     
-    if is_vip:
-        position = await db.waitlist.count_documents({"is_vip": True, "created_at": {"$lt": doc['created_at']}})
-    else:
-        vip_count = await db.waitlist.count_documents({"is_vip": True})
-        non_vip_before = await db.waitlist.count_documents({
-            "is_vip": False,
-            "created_at": {"$lt": doc['created_at']}
-        })
-        position = vip_count + non_vip_before
-    
-    return UserStats(
-        email=new_user.email,
-        referral_code=new_user.referral_code,
-        boosts=new_user.boosts,
-        verified_referrals=new_user.verified_referrals,
-        position_in_line=position + 1,
-        is_vip=is_vip
-    )
+    # A rebuild during the awaits above may have swapped in a snapshot taken
+    # before the insert
+    record = waitlist_ranking.get(new_user.email)
+    if record is None:
+        waitlist_ranking.upsert(doc)
+        record = doc
+    return waitlist_user_stats(record)
 
 
 @api_router.get("/waitlist/stats/{email}", response_model=UserStats)
 async def get_waitlist_user_stats(email: str):
     """Get user's waitlist stats by email"""
-    user = await db.waitlist.find_one({"email": email}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    
-    if user.get("is_vip"):
-        position = await db.waitlist.count_documents({
-            "is_vip": True,
-            "created_at": {"$lt": user["created_at"]}
-        })
-    else:
-        vip_count = await db.waitlist.count_documents({"is_vip": True})
-        non_vip_before = await db.waitlist.count_documents({
-            "is_vip": False,
-            "created_at": {"$lt": user["created_at"]}
-        })
-        position = vip_count + non_vip_before
+    record = waitlist_ranking.get(email)
+    if record is None:
+        # Joined through another worker since the last rebuild
+        user = await db.waitlist.find_one({"email": email}, {"_id": 0})
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        waitlist_ranking.upsert(user)
+        record = waitlist_ranking.get(email)
     
-    return UserStats(
-        email=user["email"],
-        referral_code=user["referral_code"],
-        boosts=user.get("boosts", 0),
-        verified_referrals=user.get("verified_referrals", 0),
-        position_in_line=position + 1,
-        is_vip=user.get("is_vip", False)
-    )
+    return waitlist_user_stats(record)
 
 
 @api_router.get("/waitlist/stats", response_model=WaitlistStats)
@@ -835,6 +1404,33 @@ async def get_waitlist_stats():
     )
 
 
+def check_waitlist_format(format: str):
+    if format not in WAITLIST_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(WAITLIST_FORMATS)}"
+        )
+
+
+@api_router.post("/waitlist/import", response_model=dict)
+async def import_waitlist(request: Request, format: str = "csv", admin: dict = Depends(get_admin_user)):
+    """Bulk-load signups from a streamed CSV or NDJSON request body (admin only)"""
+    check_waitlist_format(format)
+    importer = WaitlistImporter(db, referral_codes, waitlist_ranking)
+    return await importer.run(iter_rows(iter_lines(request.stream()), format))
+
+
+@api_router.get("/waitlist/export")
+async def export_waitlist(format: str = "csv", admin: dict = Depends(get_admin_user)):
+    """Stream the whole waitlist in queue order as CSV or NDJSON (admin only)"""
+    check_waitlist_format(format)
+    return StreamingResponse(
+        export_lines(db, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=waitlist.{format}"}
+    )
+
+
 @api_router.post("/waitlist/verify-referral", response_model=dict)
 async def verify_referral(verification: ReferralVerification):
     """Verify if a referral code is valid"""
@@ -850,8 +1446,8 @@ async def verify_referral(verification: ReferralVerification):
 
 # ==================== POSE DETECTION ENDPOINTS (MOCKED) ====================
 
-async def verify_pose_internal(image_base64: str, user_id: str):
-    """Internal pose verification function"""
+async def verify_pose_internal(image: str, user_id: str):
+    """Internal pose verification function (base64 data or a stored photo URL)"""
     mock_confidence = random.uniform(0.85, 0.99)
     mock_poses = ["standing", "face_visible", "full_body"]
     success = random.random() < 0.9
@@ -884,7 +1480,7 @@ async def create_subscription(user_id: str, plan_type: str = "premium"):
         "price": 10.0,
         "status": "active",
         "stripe_subscription_id": mock_subscription_id,
-        "start_date": datetime.now(timezone.utc).isoformat()
+        "start_date": timestamp()
     }
     
     await db.subscriptions.insert_one(subscription)
@@ -909,7 +1505,7 @@ async def purchase_powerup(user_id: str, powerup_type: str):
         "power_up_type": powerup_type,
         "price": prices.get(powerup_type, 2.99),
         "stripe_payment_id": mock_payment_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": timestamp()
     }
     
     await db.powerup_purchases.insert_one(purchase)
@@ -951,6 +1547,12 @@ async def health_check():
             "pose_detection": "mocked",
             "stripe": "mocked"
         },
+        "caches": {
+            "users": user_cache.snapshot(),
+            "profiles": profile_cache.snapshot(),
+            "tokens": token_cache_snapshot()
+        },
+        "password_hashing": password_hasher.snapshot(),
         "phase": 3
     }
 
@@ -964,10 +1566,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        NEXT_CURSOR_HEADER,
+        BEFORE_CURSOR_HEADER,
+        AFTER_CURSOR_HEADER,
+        PEER_READ_UP_TO_HEADER
+    ],
 )
 
 logging.basicConfig(level=logging.INFO)
 
+@app.on_event("startup")
+async def startup():
+    await ensure_indexes(db, INDEXES)
+    await interest_vocab.load()
+    interaction_writer.start()
+    await realtime_hub.start()
+    user_stats.start()
+    view_recorder.start()
+    rollup_scheduler.start()
+    await waitlist_ranking.rebuild()
+    waitlist_ranking.start()
+    seen_sets.start()
+    candidate_queues.start()
+
 @app.on_event("shutdown")
 async def shutdown():
+    await realtime_hub.stop()
+    await rollup_scheduler.stop()
+    await waitlist_ranking.stop()
+    await candidate_queues.stop()
+    await interaction_writer.stop()
+    await view_recorder.stop()
+    await seen_sets.stop()
+    await user_stats.stop()
+    await password_hasher.shutdown()
     client.close()
@@ -0,0 +1,194 @@
+"""
+Per-user interaction counters for /analytics/my-stats.
+
+The swipe, view and match paths call StatsRecorder.record_interaction, which
+accumulates increments in memory and flushes them to `user_stats` with one
+bulk $inc upsert per batch. `compute_user_stats` derives the same numbers
+from `interactions` and `profile_views` with one $facet aggregation each and
+backs the `python user_stats.py backfill|verify` job.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from serialization import timestamp
+
+logger = logging.getLogger(__name__)
+
+USER_STATS_FLUSH_SECONDS = float(os.environ.get("USER_STATS_FLUSH_SECONDS", "2"))
+
+STAT_FIELDS = ("views", "likes_sent", "passes", "matches", "profile_views", "likes_received")
+
+# action -> (counter for the acting user, counter for the target user)
+ACTION_FIELDS = {
+    "view": ("views", "profile_views"),
+    "like": ("likes_sent", "likes_received"),
+    "super_like": ("likes_sent", "likes_received"),
+    "pass": ("passes", None),
+    "match": ("matches", None),
+}
+
+
+# ================= RECORDER =================
+
+class StatsRecorder:
+    """Buffers counter increments and flushes them as bulk upserts."""
+
+    def __init__(self, db, flush_seconds: float = USER_STATS_FLUSH_SECONDS):
+        self.db = db
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[str, Counter] = defaultdict(Counter)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, field: str, amount: int = 1):
+        self._pending[user_id][field] += amount
+
+    def record_interaction(self, user_id: str, target_user_id: str, action: str):
+        actor_field, target_field = ACTION_FIELDS.get(action, (None, None))
+        if actor_field:
+            self.record(user_id, actor_field)
+        if target_field:
+            self.record(target_user_id, target_field)
+
+    async def get(self, user_id: str) -> dict:
+        """Stored counters plus increments not flushed yet."""
+        doc = await self.db.user_stats.find_one({"user_id": user_id}, {"_id": 0}) or {}
+        pending = self._pending.get(user_id, {})
+        return {field: doc.get(field, 0) + pending.get(field, 0) for field in STAT_FIELDS}
+
+    async def flush(self):
+        pending, self._pending = self._pending, defaultdict(Counter)
+        if not pending:
+            return
+        now = timestamp()
+        ops = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$inc": dict(counts), "$set": {"updated_at": now}},
+                upsert=True
+            )
+            for user_id, counts in pending.items()
+        ]
+        try:
+            await self.db.user_stats.bulk_write(ops, ordered=False)
+        except PyMongoError:
+            logger.exception("User stats flush failed, keeping %d users for retry", len(pending))
+            for user_id, counts in pending.items():
+                self._pending[user_id].update(counts)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# ================= BACKFILL / VERIFY =================
+
+async def compute_user_stats(db, user_id: str) -> dict:
+    """Counters for `user_id` recomputed from `interactions` and `profile_views`."""
+    pipeline = [
+        {"$match": {"$or": [{"user_id": user_id}, {"target_user_id": user_id}]}},
+        {"$facet": {
+            "sent": [
+                {"$match": {"user_id": user_id}},
+                {"$group": {"_id": "$action", "count": {"$sum": 1}}}
+            ],
+            "received": [
+                {"$match": {"target_user_id": user_id}},
+                {"$group": {"_id": "$action", "count": {"$sum": 1}}}
+            ]
+        }}
+    ]
+    result = await db.interactions.aggregate(pipeline).to_list(1)
+    facets = result[0] if result else {"sent": [], "received": []}
+
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    for direction, index in (("sent", 0), ("received", 1)):
+        for row in facets[direction]:
+            field = ACTION_FIELDS.get(row["_id"], (None, None))[index]
+            if field:
+                stats[field] += row["count"]
+
+    # Views are stored per (viewer, target) pair with a deduplicated count
+    views = await db.profile_views.aggregate([
+        {"$match": {"$or": [{"viewer_id": user_id}, {"target_user_id": user_id}]}},
+        {"$facet": {
+            "views": [
+                {"$match": {"viewer_id": user_id}},
+                {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+            ],
+            "profile_views": [
+                {"$match": {"target_user_id": user_id}},
+                {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+            ]
+        }}
+    ]).to_list(1)
+    if views:
+        for field in ("views", "profile_views"):
+            if views[0][field]:
+                stats[field] += views[0][field][0]["count"]
+    return stats
+
+
+async def _run(command: str, user_id: Optional[str]):
+    # Imported lazily so the module can be used without the app's env.
+    from server import db, client
+
+    try:
+        if user_id:
+            user_ids = [user_id]
+        else:
+            user_ids = [u["id"] async for u in db.users.find({}, {"_id": 0, "id": 1})]
+
+        mismatched = 0
+        for uid in user_ids:
+            expected = await compute_user_stats(db, uid)
+            if command == "backfill":
+                await db.user_stats.update_one(
+                    {"user_id": uid},
+                    {"$set": {**expected, "updated_at": timestamp()}},
+                    upsert=True
+                )
+                continue
+            stored = await db.user_stats.find_one({"user_id": uid}, {"_id": 0}) or {}
+            diff = {f: (stored.get(f, 0), expected[f]) for f in STAT_FIELDS if stored.get(f, 0) != expected[f]}
+            if diff:
+                mismatched += 1
+                print(f"{uid}: " + ", ".join(f"{f} stored={s} expected={e}" for f, (s, e) in diff.items()))
+
+        print(f"{command}: {len(user_ids)} users" + (f", {mismatched} mismatched" if command == "verify" else ""))
+        return 1 if mismatched else 0
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill or verify user_stats counters")
+    parser.add_argument("command", choices=["backfill", "verify"])
+    parser.add_argument("--user", dest="user_id")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_run(args.command, args.user_id)))
+
+
+if __name__ == "__main__":
+    main()
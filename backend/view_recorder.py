@@ -0,0 +1,148 @@
+"""
+Coalesced profile-view recording.
+
+GET /profile/{user_id} calls ViewRecorder.record, which only touches memory:
+a view of the same profile by the same viewer within VIEW_DEDUP_WINDOW_SECONDS
+is not counted again. Counted views are flushed in the background as one
+upsert per (viewer, target) pair into `profile_views`:
+
+  {viewer_id, target_user_id, count, first_seen, last_seen}
+
+The flush also feeds the viewer's seen set; view counters for
+/analytics/my-stats go through StatsRecorder as before.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from serialization import timestamp
+
+logger = logging.getLogger(__name__)
+
+VIEW_DEDUP_WINDOW_SECONDS = float(os.environ.get("VIEW_DEDUP_WINDOW_SECONDS", "1800"))
+VIEW_FLUSH_SECONDS = float(os.environ.get("VIEW_FLUSH_SECONDS", "5"))
+# Pairs remembered for deduplication; the oldest are forgotten first
+VIEW_DEDUP_MAX_PAIRS = int(os.environ.get("VIEW_DEDUP_MAX_PAIRS", "200000"))
+
+Pair = Tuple[str, str]
+
+
+class ViewRecorder:
+    """Deduplicates views in memory and writes them as per-pair upserts."""
+
+    def __init__(
+        self,
+        db,
+        stats,
+        seen_sets,
+        window_seconds: float = VIEW_DEDUP_WINDOW_SECONDS,
+        flush_seconds: float = VIEW_FLUSH_SECONDS,
+        max_pairs: int = VIEW_DEDUP_MAX_PAIRS
+    ):
+        self.db = db
+        self.stats = stats
+        self.seen_sets = seen_sets
+        self.window_seconds = window_seconds
+        self.flush_seconds = flush_seconds
+        self.max_pairs = max_pairs
+        self._last_counted: "OrderedDict[Pair, float]" = OrderedDict()
+        self._pending: Dict[Pair, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"recorded": 0, "deduplicated": 0, "flushed_pairs": 0}
+
+    def record(self, viewer_id: str, target_user_id: str) -> bool:
+        """Note a view; returns whether it counted (False inside the window)."""
+        pair = (viewer_id, target_user_id)
+        now = time.monotonic()
+        seen_at = timestamp()
+
+        pending = self._pending.get(pair)
+        if pending is None:
+            pending = self._pending[pair] = {"count": 0, "first_seen": seen_at}
+        pending["last_seen"] = seen_at
+
+        last = self._last_counted.get(pair)
+        if last is not None and now - last < self.window_seconds:
+            self.counters["deduplicated"] += 1
+            return False
+
+        self._last_counted[pair] = now
+        self._last_counted.move_to_end(pair)
+        while len(self._last_counted) > self.max_pairs:
+            self._last_counted.popitem(last=False)
+
+        pending["count"] += 1
+        self.counters["recorded"] += 1
+        self.stats.record_interaction(viewer_id, target_user_id, "view")
+        return True
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        ops = [
+            UpdateOne(
+                {"viewer_id": viewer_id, "target_user_id": target_user_id},
+                {
+                    "$inc": {"count": view["count"]},
+                    "$max": {"last_seen": view["last_seen"]},
+                    "$setOnInsert": {"first_seen": view["first_seen"]}
+                },
+                upsert=True
+            )
+            for (viewer_id, target_user_id), view in pending.items()
+        ]
+        try:
+            await self.db.profile_views.bulk_write(ops, ordered=False)
+        except PyMongoError:
+            logger.exception("Profile view flush failed, keeping %d pairs for retry", len(pending))
+            self._requeue(pending)
+            return
+        self.counters["flushed_pairs"] += len(pending)
+
+        # Seen sets only change on counted views; a revisit is already in there
+        counted: List[Pair] = [pair for pair, view in pending.items() if view["count"]]
+        for viewer_id, target_user_id in counted:
+            try:
+                await self.seen_sets.add(viewer_id, target_user_id)
+            except Exception:
+                logger.exception("Seen set update failed for %s", viewer_id)
+
+    def _requeue(self, pending: Dict[Pair, dict]):
+        for pair, view in pending.items():
+            current = self._pending.get(pair)
+            if current is None:
+                self._pending[pair] = view
+                continue
+            current["count"] += view["count"]
+            current["first_seen"] = min(current["first_seen"], view["first_seen"])
+            current["last_seen"] = max(current["last_seen"], view["last_seen"])
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                # Keep flushing; a dead loop would hold every view until shutdown
+                logger.exception("Profile view flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,339 @@
+"""
+Streaming bulk import and export for the waitlist.
+
+Import reads CSV (header row with `email`, `gender`, `referred_by`) or NDJSON
+(one object per line with the same keys) incrementally. Rows are validated
+with WaitlistSignup, deduplicated against the file and the collection, given
+referral codes from ReferralCodeAllocator.allocate_many and written with one
+unordered insert_many per chunk; referrers are credited with one bulk $inc
+per chunk.
+
+Export streams the queue in position order straight off the `queue_order`
+index, one line at a time.
+
+  python waitlist_io.py import signups.csv
+  python waitlist_io.py export --format ndjson --output waitlist.ndjson
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from collections import Counter
+from datetime import timedelta
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from referral_codes import ReferralCodeAllocator, duplicate_key_field
+from serialization import format_timestamp, timestamp, to_document
+
+logger = logging.getLogger(__name__)
+
+WAITLIST_IMPORT_CHUNK_SIZE = int(os.environ.get("WAITLIST_IMPORT_CHUNK_SIZE", "1000"))
+MAX_ERROR_SAMPLES = 20
+
+FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Same order as waitlist_rank.rank_key, served by the queue_order index
+QUEUE_ORDER = [("is_vip", -1), ("boosts", -1), ("created_at", 1), ("email", 1)]
+EXPORT_FIELDS = (
+    "position_in_line", "email", "gender", "is_vip", "boosts", "verified_referrals",
+    "referral_code", "referred_by", "status", "city", "created_at"
+)
+
+Row = Tuple[int, Optional[dict]]
+
+
+# ================= PARSING =================
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without buffering more than one line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Row]:
+    """
+    (line number, row dict) pairs; the row is None when the line is malformed.
+    A quoted CSV field may span lines; its row is numbered by its first line.
+    """
+    header = None
+    line_no = 0
+    record, record_no = None, 0
+    async for line in lines:
+        line_no += 1
+        if fmt == "csv":
+            if record is None:
+                record, record_no = line, line_no
+            else:
+                record += "\n" + line
+            # An odd number of quotes leaves a quoted field open ("" escapes count twice)
+            if record.count('"') % 2:
+                continue
+            line, record = record, None
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_no, row if isinstance(row, dict) else None
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield record_no, None
+            continue
+        yield record_no, {k: (v.strip() or None) for k, v in zip(header, values)}
+    if record is not None:
+        # Quote never closed
+        yield record_no, None
+
+
+# ================= IMPORT =================
+
+class WaitlistImporter:
+    """Loads a stream of signup rows into `waitlist` chunk by chunk."""
+
+    def __init__(
+        self,
+        db,
+        allocator: ReferralCodeAllocator,
+        ranking=None,
+        chunk_size: int = WAITLIST_IMPORT_CHUNK_SIZE
+    ):
+        # Imported lazily: server imports this module.
+        from server import WaitlistSignup, WaitlistUser
+
+        self.signup_model = WaitlistSignup
+        self.user_model = WaitlistUser
+        self.db = db
+        self.allocator = allocator
+        self.ranking = ranking
+        self.chunk_size = chunk_size
+        self._seen = set()
+        self._next_created_at = None
+        self.result = {"imported": 0, "duplicates": 0, "invalid": 0, "errors": []}
+
+    def _reject(self, line_no: int, message: str):
+        self.result["invalid"] += 1
+        if len(self.result["errors"]) < MAX_ERROR_SAMPLES:
+            self.result["errors"].append({"line": line_no, "error": message})
+
+    async def run(self, rows: AsyncIterator[Row]) -> dict:
+        chunk = []
+        async for line_no, row in rows:
+            if row is None:
+                self._reject(line_no, "Malformed line")
+                continue
+            try:
+                signup = self.signup_model(**row)
+            except ValidationError as exc:
+                self._reject(line_no, exc.errors()[0]["msg"])
+                continue
+            if signup.email in self._seen:
+                self.result["duplicates"] += 1
+                continue
+            self._seen.add(signup.email)
+            chunk.append((line_no, signup))
+            if len(chunk) >= self.chunk_size:
+                await self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            await self._write_chunk(chunk)
+        return self.result
+
+    async def _write_chunk(self, chunk: list):
+        emails = [signup.email for _, signup in chunk]
+        existing = set(await self.db.waitlist.distinct("email", {"email": {"$in": emails}}))
+        referred = list({signup.referred_by for _, signup in chunk if signup.referred_by})
+        valid_referrers = set()
+        if referred:
+            valid_referrers = set(await self.db.waitlist.distinct(
+                "referral_code", {"referral_code": {"$in": referred}}
+            ))
+
+        fresh = [(line_no, signup) for line_no, signup in chunk if signup.email not in existing]
+        self.result["duplicates"] += len(chunk) - len(fresh)
+        if not fresh:
+            return
+        codes = await self.allocator.allocate_many(len(fresh))
+
+        # Spread timestamps a millisecond apart (BSON date precision), also
+        # across chunks, so the file's order is kept as queue order
+        base = timestamp()
+        if self._next_created_at is not None and self._next_created_at > base:
+            base = self._next_created_at
+        self._next_created_at = base + timedelta(milliseconds=len(fresh))
+        docs, lines = [], []
+        for i, ((line_no, signup), code) in enumerate(zip(fresh, codes)):
+            if signup.referred_by and signup.referred_by not in valid_referrers:
+                self._reject(line_no, "Invalid referral code")
+                continue
+            is_vip = bool(signup.gender and signup.gender.lower() == "female")
+            doc = to_document(self.user_model(
+                email=signup.email,
+                referral_code=code,
+                referred_by=signup.referred_by,
+                gender=signup.gender,
+                is_vip=is_vip,
+                boosts=1 if is_vip else 0,
+                created_at=base + timedelta(milliseconds=i)
+            ))
+            docs.append(doc)
+            lines.append(line_no)
+
+        inserted = await self._insert(docs, lines)
+        self.result["imported"] += len(inserted)
+        await self._credit_referrers(inserted)
+        if self.ranking is not None:
+            for doc in inserted:
+                self.ranking.upsert(doc)
+
+    async def _insert(self, docs: List[dict], lines: List[int]) -> List[dict]:
+        if not docs:
+            return []
+        try:
+            await self.db.waitlist.insert_many(docs, ordered=False)
+            return docs
+        except BulkWriteError as exc:
+            failed = {error["index"]: error for error in exc.details.get("writeErrors", [])}
+
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        for index, error in failed.items():
+            doc = docs[index]
+            if error.get("code") != 11000:
+                self._reject(lines[index], error.get("errmsg", "Write failed"))
+            elif duplicate_key_field(error) == "referral_code":
+                # Code taken since allocate_many checked it: redraw it
+                doc["referral_code"] = None
+                try:
+                    inserted.append(await self.allocator.insert(doc))
+                except DuplicateKeyError:
+                    self.result["duplicates"] += 1
+            else:
+                # Email registered concurrently
+                self.result["duplicates"] += 1
+        return inserted
+
+    async def _credit_referrers(self, inserted: List[dict]):
+        credits = Counter(doc["referred_by"] for doc in inserted if doc.get("referred_by"))
+        if not credits:
+            return
+        await self.db.waitlist.bulk_write([
+            UpdateOne({"referral_code": code}, {"$inc": {"verified_referrals": n, "boosts": n}})
+            for code, n in credits.items()
+        ], ordered=False)
+        if self.ranking is not None:
+            async for referrer in self.db.waitlist.find(
+                {"referral_code": {"$in": list(credits)}}, {"_id": 0}
+            ):
+                self.ranking.upsert(referrer)
+
+
+# ================= EXPORT =================
+
+async def export_lines(db, fmt: str) -> AsyncIterator[str]:
+    """The waitlist in queue order as CSV or NDJSON lines, streamed from the cursor."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def csv_line(values: Iterable) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    if fmt == "csv":
+        yield csv_line(EXPORT_FIELDS)
+
+    position = 0
+    cursor = db.waitlist.find({}, {"_id": 0}, sort=QUEUE_ORDER, batch_size=WAITLIST_IMPORT_CHUNK_SIZE)
+    async for doc in cursor:
+        position += 1
+        doc["position_in_line"] = position
+        doc["created_at"] = format_timestamp(doc.get("created_at"))
+        row = [doc.get(field) for field in EXPORT_FIELDS]
+        if fmt == "csv":
+            yield csv_line(row)
+        else:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+# ================= CLI =================
+
+async def _file_chunks(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _format_for(path: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "ndjson" if path and path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+async def _run(args) -> int:
+    # Imported lazily so the module can be used without the app's env.
+    from server import db, client
+
+    try:
+        if args.command == "import":
+            fmt = _format_for(args.path, args.format)
+            importer = WaitlistImporter(db, ReferralCodeAllocator(db.waitlist), chunk_size=args.chunk_size)
+            result = await importer.run(iter_rows(iter_lines(_file_chunks(args.path)), fmt))
+            print(json.dumps(result, indent=2))
+            return 1 if result["invalid"] else 0
+
+        fmt = _format_for(args.output, args.format)
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        try:
+            async for line in export_lines(db, fmt):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return 0
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk waitlist import/export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_parser = sub.add_parser("import")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--chunk-size", type=int, default=WAITLIST_IMPORT_CHUNK_SIZE)
+    export_parser = sub.add_parser("export")
+    export_parser.add_argument("--format", choices=FORMATS)
+    export_parser.add_argument("--output")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_run(args)))
+
+
+if __name__ == "__main__":
+    main()
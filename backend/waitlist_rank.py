@@ -0,0 +1,194 @@
+"""
+In-memory waitlist ranking.
+
+Queue order is VIPs first, then more boosts, then earlier signup. Entries are
+kept in a RankIndex (sorted blocks of bounded size plus a Fenwick tree over
+the block sizes), so inserting, re-ranking and looking up a position are
+logarithmic in the number of blocks plus a bounded in-block bisect, instead
+of two count_documents range scans per request.
+
+The ranking is rebuilt from Mongo on startup and every
+WAITLIST_RANK_REBUILD_SECONDS, which also picks up writes made by other
+worker processes.
+"""
+import asyncio
+import logging
+import os
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from serialization import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+WAITLIST_RANK_REBUILD_SECONDS = float(os.environ.get("WAITLIST_RANK_REBUILD_SECONDS", "600"))
+
+RECORD_FIELDS = ("email", "referral_code", "boosts", "verified_referrals", "is_vip", "created_at")
+
+
+# ================= ORDER-STATISTIC INDEX =================
+
+class RankIndex:
+    """Sorted multiset of comparable keys with fast rank queries."""
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, keys=None):
+        self._blocks: List[list] = []
+        self._maxes: list = []
+        self._tree: List[int] = []
+        self._size = 0
+        if keys:
+            self._build(sorted(keys))
+
+    def __len__(self):
+        return self._size
+
+    def _build(self, keys: list):
+        self._blocks = [keys[i:i + self.BLOCK_SIZE] for i in range(0, len(keys), self.BLOCK_SIZE)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._size = len(keys)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        tree = [0] * (len(self._blocks) + 1)
+        for i, block in enumerate(self._blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, block_index: int, delta: int):
+        i = block_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _tree_prefix(self, block_index: int) -> int:
+        """Number of keys in blocks [0, block_index)."""
+        total = 0
+        i = block_index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def insert(self, key):
+        if not self._blocks:
+            self._build([key])
+            return
+        i = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, key)
+        self._maxes[i] = block[-1]
+        self._size += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self._blocks[i:i + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self._maxes[i:i + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            raise KeyError(key)
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            raise KeyError(key)
+        del block[j]
+        self._size -= 1
+        if block:
+            self._maxes[i] = block[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+
+    def rank(self, key) -> int:
+        """Number of keys strictly less than `key`."""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            return self._size
+        return self._tree_prefix(i) + bisect_left(self._blocks[i], key)
+
+
+# ================= WAITLIST RANKING =================
+
+def rank_key(entry: dict) -> tuple:
+    """Queue order: VIPs first, then more boosts, then earlier signup."""
+    return (
+        0 if entry.get("is_vip") else 1,
+        -(entry.get("boosts") or 0),
+        parse_timestamp(entry["created_at"]),
+        entry["email"]
+    )
+
+
+class WaitlistRanking:
+    """Waitlist records and their queue positions, served from memory."""
+
+    def __init__(self, db, rebuild_seconds: float = WAITLIST_RANK_REBUILD_SECONDS):
+        self.db = db
+        self.rebuild_seconds = rebuild_seconds
+        self._records: Dict[str, dict] = {}
+        self._keys: Dict[str, tuple] = {}
+        self._index = RankIndex()
+        self._task: Optional[asyncio.Task] = None
+
+    async def rebuild(self):
+        records = {}
+        async for doc in self.db.waitlist.find({}, {"_id": 0, **{f: 1 for f in RECORD_FIELDS}}):
+            records[doc["email"]] = doc
+        keys = {email: rank_key(record) for email, record in records.items()}
+        # Swap in one step so readers never see a half-built ranking
+        self._records, self._keys, self._index = records, keys, RankIndex(keys.values())
+
+    def upsert(self, entry: dict):
+        """Add or re-rank a waitlist entry (e.g. after its boosts changed)."""
+        record = {f: entry.get(f) for f in RECORD_FIELDS}
+        email = record["email"]
+        old_key = self._keys.get(email)
+        new_key = rank_key(record)
+        if old_key != new_key:
+            if old_key is not None:
+                self._index.remove(old_key)
+            self._index.insert(new_key)
+            self._keys[email] = new_key
+        self._records[email] = record
+
+    def get(self, email: str) -> Optional[dict]:
+        return self._records.get(email)
+
+    def position(self, email: str) -> int:
+        """1-based position in line."""
+        return self._index.rank(self._keys[email]) + 1
+
+    def __len__(self):
+        return len(self._index)
+
+    async def _rebuild_loop(self):
+        while True:
+            await asyncio.sleep(self.rebuild_seconds)
+            try:
+                await self.rebuild()
+            except PyMongoError:
+                logger.exception("Waitlist ranking rebuild failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._rebuild_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
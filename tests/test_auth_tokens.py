@@ -0,0 +1,85 @@
+import asyncio
+from collections import OrderedDict
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+from auth import create_access_token, forget_token_version, use_token_versions, user_from_token
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def fresh_token_cache(monkeypatch):
+    monkeypatch.setattr(auth, "_verified_tokens", OrderedDict())
+    monkeypatch.setattr(auth, "token_cache_stats", {"hits": 0, "misses": 0, "evictions": 0})
+    monkeypatch.setattr(auth, "_token_versions", None)
+
+
+def token(user_id="u1", **kwargs):
+    return create_access_token({"user_id": user_id, "email": f"{user_id}@x.com"}, **kwargs)
+
+
+def test_repeat_requests_hit_the_cache():
+    access = token()
+    assert run(user_from_token(access))["user_id"] == "u1"
+    assert run(user_from_token(access))["user_id"] == "u1"
+    assert auth.token_cache_stats == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_expired_cache_entries_are_not_served(monkeypatch):
+    access = token(expires_delta=timedelta(seconds=60))
+    run(user_from_token(access))
+    now = auth.time.time()
+    monkeypatch.setattr("auth.time.time", lambda: now + 120)
+    # The cached claims are past `exp`, so the token is verified again
+    run(user_from_token(access))
+    assert auth.token_cache_stats["hits"] == 0
+    assert auth.token_cache_stats["misses"] == 2
+
+
+def test_least_recently_used_tokens_are_evicted(monkeypatch):
+    monkeypatch.setattr(auth, "TOKEN_CACHE_SIZE", 2)
+    first, second, third = token("a"), token("b"), token("c")
+    for access in (first, second, first, third):
+        run(user_from_token(access))
+    assert auth.token_cache_stats["evictions"] == 1
+    run(user_from_token(first))
+    assert auth.token_cache_stats["hits"] == 2  # `first` survived, `second` was evicted
+    run(user_from_token(second))
+    assert auth.token_cache_stats["misses"] == 4
+
+
+def test_invalid_tokens_are_rejected():
+    with pytest.raises(HTTPException) as exc:
+        run(user_from_token(token() + "x"))
+    assert exc.value.status_code == 401
+
+
+def test_bumped_token_version_revokes_cached_tokens():
+    async def scenario():
+        versions = {"u1": 0}
+
+        async def load_version(user_id):
+            return versions.get(user_id)
+
+        use_token_versions(load_version)
+        access = token(token_version=0)
+        assert (await user_from_token(access))["user_id"] == "u1"
+        # What /auth/logout-all does: bump the stored version, drop the cached one
+        versions["u1"] = 1
+        forget_token_version("u1")
+        with pytest.raises(HTTPException) as exc:
+            await user_from_token(access)
+        assert exc.value.detail == "Token revoked"
+        assert (await user_from_token(token(token_version=1)))["user_id"] == "u1"
+    run(scenario())
+
+
+def test_tokens_carry_no_personal_details():
+    claims = auth.decode_access_token(token(has_profile=True, is_active=True))
+    assert set(claims) == {"user_id", "email", "has_profile", "is_active", "exp", "ver"}
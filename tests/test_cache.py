@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from cache import AsyncTTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Loader:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, key):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"value-{key}-{self.calls}"
+
+
+def test_hit_after_miss():
+    async def scenario():
+        loader = Loader()
+        cache = AsyncTTLCache(loader, maxsize=10, ttl_seconds=60)
+        assert await cache.get("a") == "value-a-1"
+        assert await cache.get("a") == "value-a-1"
+        assert loader.calls == 1
+        assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+    run(scenario())
+
+
+def test_expired_entries_reload(monkeypatch):
+    async def scenario():
+        now = [1000.0]
+        monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+        loader = Loader()
+        cache = AsyncTTLCache(loader, maxsize=10, ttl_seconds=30)
+        await cache.get("a")
+        now[0] += 31
+        assert await cache.get("a") == "value-a-2"
+        assert cache.stats["expirations"] == 1
+    run(scenario())
+
+
+def test_least_recently_used_is_evicted():
+    async def scenario():
+        loader = Loader()
+        cache = AsyncTTLCache(loader, maxsize=2, ttl_seconds=60)
+        await cache.get("a")
+        await cache.get("b")
+        await cache.get("a")
+        await cache.get("c")
+        assert len(cache) == 2 and cache.stats["evictions"] == 1
+        await cache.get("a")
+        assert loader.calls == 3  # "a" survived, "b" was evicted
+    run(scenario())
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        loader = Loader(delay=0.02)
+        cache = AsyncTTLCache(loader, maxsize=10, ttl_seconds=60)
+        results = await asyncio.gather(*(cache.get("a") for _ in range(5)))
+        assert set(results) == {"value-a-1"}
+        assert loader.calls == 1 and cache.stats["coalesced"] == 4
+    run(scenario())
+
+
+def test_cancelled_loader_does_not_strand_waiters():
+    async def scenario():
+        loader = Loader(delay=0.05)
+        cache = AsyncTTLCache(loader, maxsize=10, ttl_seconds=60)
+        first = asyncio.create_task(cache.get("a"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(cache.get("a"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await asyncio.wait_for(second, 1) == "value-a-1"
+        assert await cache.get("a") == "value-a-1"
+        assert loader.calls == 1
+    run(scenario())
+
+
+def test_invalidate_during_load_discards_the_loaded_value():
+    async def scenario():
+        loader = Loader(delay=0.02)
+        cache = AsyncTTLCache(loader, maxsize=10, ttl_seconds=60)
+        pending = asyncio.create_task(cache.get("a"))
+        await asyncio.sleep(0.005)
+        cache.invalidate("a")
+        assert await pending == "value-a-1"
+        assert await cache.get("a") == "value-a-2"
+    run(scenario())
+
+
+def test_loader_errors_propagate_and_are_not_cached():
+    async def scenario():
+        calls = 0
+
+        async def failing(key):
+            nonlocal calls
+            calls += 1
+            raise ValueError(key)
+
+        cache = AsyncTTLCache(failing, maxsize=10, ttl_seconds=60)
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await cache.get("a")
+        assert calls == 2 and len(cache) == 0
+    run(scenario())
@@ -0,0 +1,63 @@
+import asyncio
+
+from candidate_queue import CandidateQueues
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def entry(user_id):
+    return {"profile": {"user_id": user_id}, "match_score": 0, "distance_km": 1.0}
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self, user_id, size):
+        self.calls += 1
+        call = self.calls
+        if self.release is not None:
+            await self.release.wait()
+        return [entry(f"{user_id}-load{call}-{i}") for i in range(3)]
+
+
+def test_first_get_loads_and_caches():
+    async def scenario():
+        loader = Loader()
+        queues = CandidateQueues(loader)
+        first = await queues.get("me")
+        assert len(first) == 3
+        assert await queues.get("me") is first
+        assert loader.calls == 1
+    run(scenario())
+
+
+def test_pop_removes_target():
+    async def scenario():
+        queues = CandidateQueues(Loader())
+        await queues.get("me")
+        queues.pop("me", "me-load1-0")
+        assert [e["profile"]["user_id"] for e in await queues.get("me")] == ["me-load1-1", "me-load1-2"]
+    run(scenario())
+
+
+def test_get_reloads_when_invalidated_mid_load():
+    async def scenario():
+        loader = Loader()
+        loader.release = asyncio.Event()
+        queues = CandidateQueues(loader)
+        first = asyncio.ensure_future(queues.get("me"))
+        while loader.calls == 0:
+            await asyncio.sleep(0)
+        queues.invalidate("me")
+        second = asyncio.ensure_future(queues.get("me"))
+        await asyncio.sleep(0)
+        loader.release.set()
+        first, second = await first, await second
+        # The stale load is discarded; both callers get the fresh one
+        assert first and first == second
+        assert first[0]["profile"]["user_id"] == "me-load2-0"
+    run(scenario())
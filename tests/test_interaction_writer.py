@@ -0,0 +1,66 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from interaction_writer import InteractionWriter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Collection:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.docs.extend(docs)
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+def docs(n):
+    return [{"id": str(i)} for i in range(n)]
+
+
+def test_batches_are_flushed_on_stop():
+    async def scenario():
+        collection = Collection()
+        writer = InteractionWriter(collection, batch_size=2, flush_seconds=60)
+        writer.start()
+        for doc in docs(5):
+            await writer.write(doc)
+        await writer.stop()
+        assert len(collection.docs) == 5
+        assert writer.stats["written"] == 5
+    run(scenario())
+
+
+def test_partial_bulk_failure_counts_inserted_docs():
+    async def scenario():
+        error = BulkWriteError({"nInserted": 2, "writeErrors": [{"code": 2, "errmsg": "bad"}]})
+        writer = InteractionWriter(Collection([error]), batch_size=3, flush_seconds=60)
+        writer.start()
+        for doc in docs(3):
+            await writer.write(doc)
+        await writer.stop()
+        assert writer.stats["written"] == 2
+        assert writer.stats["failed_batches"] == 1
+    run(scenario())
+
+
+def test_unexpected_error_does_not_stop_the_writer():
+    async def scenario():
+        collection = Collection([ValueError("not encodable")])
+        writer = InteractionWriter(collection, batch_size=1, flush_seconds=60)
+        writer.start()
+        for doc in docs(3):
+            await writer.write(doc)
+        await writer.stop()
+        assert len(collection.docs) == 2
+        assert writer.stats["failed_batches"] == 1
+    run(scenario())
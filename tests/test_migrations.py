@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import migrations
+from migrations import NATIVE_DATETIMES_STATE_ID, convert_timestamps_to_dates
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def database():
+    return AsyncMongoMockClient(tz_aware=True)["migrations"]
+
+
+def iso(day):
+    return datetime(2024, 1, day, tzinfo=timezone.utc).isoformat()
+
+
+async def seed_profiles(db, n=5):
+    await db.profiles.insert_many([{"_id": i, "created_at": iso(i + 1)} for i in range(n)])
+
+
+async def state(db):
+    return await db.migration_state.find_one({"_id": NATIVE_DATETIMES_STATE_ID})
+
+
+def test_converts_strings_to_dates():
+    async def scenario():
+        db = database()
+        await seed_profiles(db, 3)
+        await db.matches.insert_one({
+            "_id": "m",
+            "matched_at": iso(1),
+            "last_message": {"sent_at": iso(2)},
+            "read_up_to": {"a": iso(3), "b": datetime(2024, 1, 4, tzinfo=timezone.utc)}
+        })
+        await db.messages.insert_one({"_id": "x", "sent_at": "yesterday"})
+        result = await convert_timestamps_to_dates(db, pause_seconds=0)
+        assert result["converted"]["profiles"] == 3
+        assert result["converted"]["messages"] == 0
+        profile = await db.profiles.find_one({"_id": 0})
+        assert profile["created_at"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+        match = await db.matches.find_one({"_id": "m"})
+        assert isinstance(match["last_message"]["sent_at"], datetime)
+        assert isinstance(match["read_up_to"]["a"], datetime)
+        assert (await db.messages.find_one({"_id": "x"}))["sent_at"] == "yesterday"
+        assert (await state(db))["done"] is True
+    run(scenario())
+
+
+def test_interrupted_run_resumes_from_checkpoint(monkeypatch):
+    async def scenario():
+        db = database()
+        await seed_profiles(db)
+
+        async def interrupt(seconds):
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(migrations.asyncio, "sleep", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            await convert_timestamps_to_dates(db, batch_size=2, pause_seconds=1)
+        # Newest first: only the two highest ids were converted before the stop
+        checkpoint = (await state(db))["collections"]["profiles"]
+        assert checkpoint == {"last_id": 3, "converted": 2, "done": False}
+        strings = await db.profiles.find({"created_at": {"$type": "string"}}).distinct("_id")
+        assert sorted(strings) == [0, 1, 2]
+
+        monkeypatch.undo()
+        result = await convert_timestamps_to_dates(db, batch_size=2, pause_seconds=0)
+        assert result["converted"]["profiles"] == 5
+        assert await db.profiles.count_documents({"created_at": {"$type": "string"}}) == 0
+    run(scenario())
+
+
+def test_resume_skips_documents_before_the_checkpoint():
+    async def scenario():
+        db = database()
+        await seed_profiles(db)
+        await db.migration_state.insert_one({
+            "_id": NATIVE_DATETIMES_STATE_ID,
+            "collections": {"profiles": {"last_id": 2, "converted": 2, "done": False}}
+        })
+        result = await convert_timestamps_to_dates(db, pause_seconds=0)
+        assert result["converted"]["profiles"] == 4
+        strings = await db.profiles.find({"created_at": {"$type": "string"}}).distinct("_id")
+        assert sorted(strings) == [2, 3, 4]
+    run(scenario())
+
+
+def test_run_after_completion_sweeps_again():
+    async def scenario():
+        db = database()
+        await seed_profiles(db, 2)
+        await convert_timestamps_to_dates(db, pause_seconds=0)
+        # A straggler written by an old app version after the first run
+        await db.profiles.insert_one({"_id": 9, "created_at": iso(9)})
+        result = await convert_timestamps_to_dates(db, pause_seconds=0)
+        assert result["converted"]["profiles"] == 1
+        assert isinstance((await db.profiles.find_one({"_id": 9}))["created_at"], datetime)
+    run(scenario())
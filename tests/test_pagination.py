@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import ascending_after, decode_cursor, descending_after, encode_cursor
+
+SENT_AT = datetime(2026, 3, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("values", [
+    ("2026-03-01T12:30:15.123456+00:00", "message-id"),
+    (None, "match-id"),
+    (SENT_AT, "message-id"),
+    (3, "x"),
+])
+def test_cursor_round_trip(values):
+    cursor = encode_cursor(*values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, len(values)) == list(values)
+
+
+def test_cursor_keeps_datetimes_apart_from_strings():
+    as_date, as_string = decode_cursor(encode_cursor(SENT_AT, SENT_AT.isoformat()), 2)
+    assert as_date == SENT_AT and isinstance(as_date, datetime)
+    assert isinstance(as_string, str)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 !!",
+    encode_cursor("only-one"),
+    encode_cursor("a", "b", "c"),
+    "eyJhIjoxfQ",  # {"a":1}
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, 2)
+    assert exc.value.status_code == 400
+
+
+def test_descending_after_reaches_null_tail():
+    assert descending_after("last_message_at", None, "m1") == {"last_message_at": None, "id": {"$lt": "m1"}}
+    clauses = descending_after("last_message_at", "2026-01-01T00:00:00+00:00", "m1")["$or"]
+    assert {"last_message_at": None} in clauses
+    assert {"last_message_at": {"$type": "string"}} not in clauses
+
+
+def test_descending_after_a_date_continues_into_legacy_strings():
+    clauses = descending_after("sent_at", SENT_AT, "m1")["$or"]
+    assert {"sent_at": {"$lt": SENT_AT}} in clauses
+    assert {"sent_at": SENT_AT, "id": {"$lt": "m1"}} in clauses
+    assert {"sent_at": {"$type": "string"}} in clauses
+
+
+def test_ascending_after_a_string_continues_into_dates():
+    clauses = ascending_after("sent_at", "2026-01-01T00:00:00+00:00", "m1")["$or"]
+    assert {"sent_at": {"$type": "date"}} in clauses
+    assert {"sent_at": {"$type": "date"}} not in ascending_after("sent_at", SENT_AT, "m1")["$or"]
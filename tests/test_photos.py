@@ -0,0 +1,110 @@
+import asyncio
+import io
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image
+
+from blob_store import LocalBlobStore
+from photos import PhotoRejected, PhotoStore, RangeNotSatisfiable, parse_range, photo_url, sniff_content_type
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def png(color="red") -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(out, "PNG")
+    return out.getvalue()
+
+
+# ---------- ranges ----------
+
+def test_range_forms():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=5-", 100) == (5, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+
+
+def test_ranges_served_as_full_body():
+    assert parse_range(None, 100) is None
+    assert parse_range("items=0-9", 100) is None
+    assert parse_range("bytes=0-9,20-29", 100) is None
+    assert parse_range("bytes=a-b", 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=150-200", "bytes=9-5", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+# ---------- content sniffing ----------
+
+def test_sniff_content_type():
+    assert sniff_content_type(b"\xff\xd8\xff\xe0" + b"\0" * 12) == "image/jpeg"
+    assert sniff_content_type(png()[:16]) == "image/png"
+    assert sniff_content_type(b"GIF89a" + b"\0" * 10) == "image/gif"
+    assert sniff_content_type(b"RIFF\0\0\0\0WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(b"<html><body>") is None
+
+
+# ---------- store ----------
+
+def store(tmp_path):
+    db = AsyncMongoMockClient(tz_aware=True)["photos"]
+    return PhotoStore(db, LocalBlobStore(str(tmp_path)))
+
+
+def blob_files(tmp_path):
+    return sorted(p.name for p in tmp_path.rglob("*") if p.is_file())
+
+
+def test_save_stores_photo_and_thumbnail(tmp_path):
+    async def scenario():
+        photos = store(tmp_path)
+        photo = await photos.save_bytes(png())
+        assert photo["content_type"] == "image/png"
+        assert photo["thumbnail"]["content_type"] == "image/jpeg"
+        assert blob_files(tmp_path) == sorted([photo["digest"], photo["thumbnail"]["digest"]])
+        again = await photos.save_bytes(png())
+        assert again["digest"] == photo["digest"] and again["refs"] == 2
+    run(scenario())
+
+
+@pytest.mark.parametrize("data", [b"not an image at all", b"\x89PNG\r\n\x1a\n" + b"\0" * 64])
+def test_rejected_uploads_leave_nothing_behind(tmp_path, data):
+    async def scenario():
+        photos = store(tmp_path)
+        with pytest.raises(PhotoRejected):
+            await photos.save_bytes(data)
+        assert blob_files(tmp_path) == []
+        assert await photos.db.photos.count_documents({}) == 0
+    run(scenario())
+
+
+def test_discard_deletes_after_the_last_reference(tmp_path):
+    async def scenario():
+        photos = store(tmp_path)
+        photo = await photos.save_bytes(png())
+        await photos.save_bytes(png())
+        await photos.discard(photo["digest"])
+        assert (await photos.get(photo["digest"]))["refs"] == 1
+        await photos.discard(photo["digest"])
+        assert await photos.get(photo["digest"]) is None
+        assert blob_files(tmp_path) == []
+    run(scenario())
+
+
+def test_discard_keeps_photos_profiles_use(tmp_path):
+    async def scenario():
+        photos = store(tmp_path)
+        photo = await photos.save_bytes(png())
+        await photos.db.profiles.insert_one({"user_id": "a", "photos": [photo_url(photo["digest"])]})
+        await photos.discard(photo["digest"])
+        assert await photos.get(photo["digest"]) is not None
+        assert photo["digest"] in blob_files(tmp_path)
+    run(scenario())
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from referral_codes import REFERRAL_CODE_ALPHABET, ReferralCodeAllocator, duplicate_key_field
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def duplicate(field):
+    return DuplicateKeyError("E11000 duplicate key", 11000, {"keyPattern": {field: 1}, "keyValue": {field: "x"}})
+
+
+class Collection:
+    def __init__(self, failures=(), taken=()):
+        self.failures = list(failures)
+        self.taken = set(taken)
+        self.docs = []
+
+    async def insert_one(self, doc):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.docs.append(dict(doc))
+
+    async def distinct(self, field, query):
+        return [code for code in query[field]["$in"] if code in self.taken]
+
+
+def test_duplicate_key_field():
+    assert duplicate_key_field({"keyPattern": {"referral_code": 1}}) == "referral_code"
+    assert duplicate_key_field({"keyValue": {"email": "a@b.c"}}) == "email"
+    assert duplicate_key_field({"errmsg": "E11000 ... index: referral_code_unique"}) == "referral_code"
+    assert duplicate_key_field({"errmsg": "E11000 ... index: email_unique"}) == "email"
+    assert duplicate_key_field({}) == ""
+
+
+def test_insert_assigns_a_code():
+    async def scenario():
+        collection = Collection()
+        doc = await ReferralCodeAllocator(collection).insert({"email": "a@b.c"})
+        code = doc["referral_code"]
+        assert len(code) == 8 and set(code) <= set(REFERRAL_CODE_ALPHABET)
+        assert collection.docs == [doc]
+    run(scenario())
+
+
+def test_insert_retries_with_a_new_code_on_collision():
+    async def scenario():
+        collection = Collection([duplicate("referral_code")])
+        allocator = ReferralCodeAllocator(collection)
+        doc = await allocator.insert({"email": "a@b.c", "referral_code": "TAKEN123"})
+        assert allocator.collisions == 1
+        assert doc["referral_code"] != "TAKEN123"
+        assert collection.docs[0]["referral_code"] == doc["referral_code"]
+    run(scenario())
+
+
+def test_insert_reraises_other_duplicates():
+    async def scenario():
+        allocator = ReferralCodeAllocator(Collection([duplicate("email")]))
+        with pytest.raises(DuplicateKeyError):
+            await allocator.insert({"email": "a@b.c"})
+        assert allocator.collisions == 0
+    run(scenario())
+
+
+def test_insert_gives_up_after_repeated_collisions():
+    async def scenario():
+        allocator = ReferralCodeAllocator(Collection([duplicate("referral_code")] * 10))
+        with pytest.raises(RuntimeError):
+            await allocator.insert({"email": "a@b.c"})
+    run(scenario())
+
+
+def test_allocate_many_skips_codes_in_use(monkeypatch):
+    async def scenario():
+        draws = iter(["AAAA0001", "AAAA0002", "AAAA0003", "AAAA0004"])
+        monkeypatch.setattr("referral_codes.generate_referral_code", lambda length: next(draws))
+        allocator = ReferralCodeAllocator(Collection(taken={"AAAA0002"}))
+        codes = await allocator.allocate_many(3)
+        assert sorted(codes) == ["AAAA0001", "AAAA0003", "AAAA0004"]
+        assert allocator.collisions == 1
+    run(scenario())
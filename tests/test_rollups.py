@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from rollups import DAY, HyperLogLog, bucket_plan, compute_hour
+
+
+def sketch(items):
+    hll = HyperLogLog()
+    hll.update(items)
+    return hll
+
+
+def ids(prefix, n):
+    return [f"{prefix}-{i}" for i in range(n)]
+
+
+def test_empty_sketch_counts_zero():
+    assert HyperLogLog().count() == 0
+
+
+def test_small_counts_are_near_exact():
+    assert abs(sketch(ids("user", 100)).count() - 100) <= 2
+
+
+def test_count_within_error():
+    for n in (1000, 50000):
+        estimate = sketch(ids("user", n)).count()
+        # Standard error is ~0.8%; allow four of them
+        assert abs(estimate - n) / n < 0.035
+
+
+def test_duplicates_do_not_count():
+    assert sketch(ids("user", 1000) * 3).count() == sketch(ids("user", 1000)).count()
+
+
+def test_merge_equals_union():
+    first = sketch(ids("user", 3000))
+    second = sketch(ids("user", 6000)[2000:])
+    first.merge(second)
+    union = sketch(ids("user", 6000))
+    assert first.count() == union.count()
+    assert (first.registers == union.registers).all()
+
+
+def test_bytes_round_trip():
+    original = sketch(ids("user", 5000))
+    restored = HyperLogLog(registers=original.to_bytes())
+    assert restored.count() == original.count()
+    restored.add("another")  # the restored registers must be writable
+
+
+def test_bucket_plan_uses_utc_ids():
+    offset = timezone(timedelta(hours=5))
+    start = datetime(2025, 1, 2, 5, 0, tzinfo=offset)  # 2025-01-02T00:00Z
+    end = datetime(2025, 1, 3, 7, 0, tzinfo=offset)  # 2025-01-03T02:00Z
+    assert bucket_plan(start, end) == ["day:2025-01-02", "hour:2025-01-03T00", "hour:2025-01-03T01"]
+    naive = bucket_plan(datetime(2025, 1, 2), datetime(2025, 1, 3))
+    assert naive == ["day:2025-01-02"]
+
+
+def test_viewers_count_as_active_users():
+    async def scenario():
+        db = AsyncMongoMockClient(tz_aware=True)["rollups"]
+        start = datetime(2025, 1, 2, 10, tzinfo=timezone.utc)
+        await db.interactions.insert_one({"user_id": "swiper", "target_user_id": "x", "created_at": start})
+        await db.profile_views.insert_many([
+            {"viewer_id": "browser", "target_user_id": "x", "first_seen": start, "last_seen": start},
+            {"viewer_id": "swiper", "target_user_id": "y", "first_seen": start, "last_seen": start},
+            {"viewer_id": "earlier", "target_user_id": "x", "first_seen": start - DAY, "last_seen": start - DAY},
+        ])
+        bucket = await compute_hour(db, start)
+        assert bucket["counts"]["interactions"] == 1
+        assert bucket["counts"]["profile_views"] == 2
+        assert HyperLogLog(registers=bucket["active_users_hll"]).count() == 2
+    asyncio.run(scenario())
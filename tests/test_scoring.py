@@ -0,0 +1,67 @@
+"""rank_candidates must agree with the scalar reference scorer in server.py."""
+import random
+
+import pytest
+
+from scoring import rank_candidates
+from server import calculate_distance, calculate_match_score
+
+INTERESTS = ["hiking", "coffee", "travel", "music", "art", "food", "yoga", "film", "books", "gaming"]
+
+
+def random_profile(rng: random.Random, i: int, with_mask: bool) -> dict:
+    profile = {
+        "user_id": f"user-{i}",
+        "location": {"lat": 40.7128 + rng.uniform(-0.2, 0.2), "lng": -74.0060 + rng.uniform(-0.2, 0.2)},
+        "interests": rng.sample(INTERESTS, rng.randint(0, 6)),
+        "bio": rng.choice(["", "Hello there"]),
+        "photos": ["/api/photos/x"] * rng.randint(0, 5),
+        "is_verified": rng.random() < 0.5,
+    }
+    if with_mask:
+        profile["interest_mask"] = [rng.randint(-(2 ** 63), 2 ** 63 - 1) for _ in range(rng.randint(1, 2))]
+    return profile
+
+
+def reference_ranking(me: dict, profiles: list) -> list:
+    scored = []
+    for profile in profiles:
+        distance = calculate_distance(
+            me["location"]["lat"], me["location"]["lng"],
+            profile["location"]["lat"], profile["location"]["lng"]
+        )
+        scored.append({
+            "profile": profile,
+            "match_score": calculate_match_score(me, profile, distance),
+            "distance_km": round(distance, 1)
+        })
+    # Stable: equal scores keep input order
+    return sorted(scored, key=lambda entry: -entry["match_score"])
+
+
+@pytest.mark.parametrize("with_mask", [False, True])
+def test_rank_candidates_matches_scalar_reference(with_mask):
+    rng = random.Random(1234 + with_mask)
+    for trial in range(150):
+        me = random_profile(rng, -1, with_mask)
+        profiles = [random_profile(rng, i, with_mask) for i in range(rng.randint(1, 40))]
+        expected = reference_ranking(me, profiles)
+        actual = rank_candidates(me, profiles, limit=len(profiles))
+        assert [
+            (e["profile"]["user_id"], e["match_score"], e["distance_km"]) for e in actual
+        ] == [
+            (e["profile"]["user_id"], e["match_score"], e["distance_km"]) for e in expected
+        ], f"trial {trial}"
+
+
+def test_rank_candidates_limit_keeps_best_first():
+    rng = random.Random(7)
+    me = random_profile(rng, -1, False)
+    profiles = [random_profile(rng, i, False) for i in range(50)]
+    expected = reference_ranking(me, profiles)[:10]
+    actual = rank_candidates(me, profiles, limit=10)
+    assert [e["profile"]["user_id"] for e in actual] == [e["profile"]["user_id"] for e in expected]
+
+
+def test_rank_candidates_empty():
+    assert rank_candidates({"location": {"lat": 0, "lng": 0}}, [], limit=5) == []
@@ -0,0 +1,122 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from seen_set import BloomFilter, ScalableBloomFilter, SeenSetStore
+
+
+def ids(prefix, n):
+    return [f"{prefix}-{i}" for i in range(n)]
+
+
+def test_no_false_negatives():
+    seen = ScalableBloomFilter([BloomFilter(500, 0.01)])
+    for item in ids("seen", 2000):
+        seen.add(item)
+    assert all(item in seen for item in ids("seen", 2000))
+
+
+def test_false_positive_rate_near_target():
+    bloom = BloomFilter(5000, 0.01)
+    for item in ids("seen", 5000):
+        bloom.add(item)
+    false_positives = sum(item in bloom for item in ids("unseen", 20000))
+    assert false_positives / 20000 < 0.02
+
+
+def test_add_reports_duplicates():
+    seen = ScalableBloomFilter()
+    assert seen.add("a") is True
+    assert seen.add("a") is False
+
+
+def test_layers_double_capacity_and_halve_error_rate():
+    seen = ScalableBloomFilter([BloomFilter(100, 0.01)])
+    for item in ids("seen", 350):
+        seen.add(item)
+    assert [layer.capacity for layer in seen.layers] == [100, 200, 400]
+    assert [layer.error_rate for layer in seen.layers] == [0.01, 0.005, 0.0025]
+
+
+def test_document_round_trip():
+    seen = ScalableBloomFilter([BloomFilter(100, 0.01)])
+    for item in ids("seen", 150):
+        seen.add(item)
+    restored = ScalableBloomFilter.from_document(seen.to_document())
+    assert restored.to_document() == seen.to_document()
+    assert all(item in restored for item in ids("seen", 150))
+
+
+def test_merge_keeps_both_sides():
+    first = ScalableBloomFilter([BloomFilter(1000, 0.01)])
+    second = ScalableBloomFilter([BloomFilter(1000, 0.01)])
+    for item in ids("first", 300):
+        first.add(item)
+    for item in ids("second", 300):
+        second.add(item)
+    first.merge(second)
+    assert all(item in first for item in ids("first", 300) + ids("second", 300))
+    # The merged count is estimated from the bits, not just the larger side
+    assert 550 <= first.layers[0].count <= 650
+
+
+def test_merge_appends_layers_the_other_side_grew():
+    small = ScalableBloomFilter([BloomFilter(100, 0.01)])
+    grown = ScalableBloomFilter([BloomFilter(100, 0.01)])
+    for item in ids("grown", 250):
+        grown.add(item)
+    small.merge(grown)
+    assert len(small.layers) == len(grown.layers)
+    assert all(item in small for item in ids("grown", 250))
+
+
+def database():
+    return AsyncMongoMockClient(tz_aware=True)["seen_sets"]
+
+
+def test_concurrent_workers_keep_each_others_additions():
+    async def scenario():
+        db = database()
+        first, second = SeenSetStore(db), SeenSetStore(db)
+        for item in ids("first", 50):
+            await first.add("me", item)
+        for item in ids("second", 50):
+            await second.add("me", item)
+        await first.flush()
+        await second.flush()
+        stored = await SeenSetStore(db).get("me")
+        assert all(item in stored for item in ids("first", 50) + ids("second", 50))
+    asyncio.run(scenario())
+
+
+def test_eviction_defers_persisting_to_the_flush():
+    async def scenario():
+        db = database()
+        store = SeenSetStore(db, cache_size=1)
+        await store.add("a", "x")
+        await store.add("b", "y")  # evicts "a"
+        assert await db.seen_sets.count_documents({}) == 0
+        assert "x" in await store.get("a")  # revived, not reloaded
+        await store.flush()
+        assert await db.seen_sets.count_documents({}) == 2
+    asyncio.run(scenario())
+
+
+def test_failed_persist_keeps_evicted_additions(monkeypatch):
+    async def scenario():
+        db = database()
+        store = SeenSetStore(db, cache_size=1)
+        persist = store._persist
+
+        async def failing(user_id, seen):
+            raise RuntimeError("kept changing")
+
+        monkeypatch.setattr(store, "_persist", failing)
+        await store.add("a", "x")
+        await store.add("b", "y")  # evicting "a" must not fail this request
+        await store.flush()
+        monkeypatch.setattr(store, "_persist", persist)
+        await store.flush()
+        assert "x" in await SeenSetStore(db).get("a")
+        assert store._evicted == {}
+    asyncio.run(scenario())
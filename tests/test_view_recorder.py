@@ -0,0 +1,124 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect
+
+from view_recorder import ViewRecorder
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Stats:
+    def __init__(self):
+        self.calls = []
+
+    def record_interaction(self, user_id, target_user_id, action):
+        self.calls.append((user_id, target_user_id, action))
+
+
+class SeenSets:
+    def __init__(self, error=None):
+        self.error = error
+        self.added = []
+
+    async def add(self, user_id, target_user_id):
+        if self.error is not None and not self.added:
+            self.added.append(None)
+            raise self.error
+        self.added.append((user_id, target_user_id))
+
+
+class ProfileViews:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.batches = []
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append(ops)
+
+
+class DB:
+    def __init__(self, profile_views):
+        self.profile_views = profile_views
+
+
+def recorder(profile_views=None, seen_sets=None, **kwargs):
+    return ViewRecorder(DB(profile_views or ProfileViews()), Stats(), seen_sets or SeenSets(), **kwargs)
+
+
+def test_views_inside_the_window_are_not_counted():
+    views = recorder(window_seconds=60)
+    assert views.record("a", "b") is True
+    assert views.record("a", "b") is False
+    assert views.record("a", "c") is True
+    assert views.counters == {"recorded": 2, "deduplicated": 1, "flushed_pairs": 0}
+    assert views.stats.calls == [("a", "b", "view"), ("a", "c", "view")]
+
+
+def test_views_count_again_after_the_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("view_recorder.time.monotonic", lambda: now[0])
+    views = recorder(window_seconds=60)
+    views.record("a", "b")
+    now[0] += 61
+    assert views.record("a", "b") is True
+    assert views._pending[("a", "b")]["count"] == 2
+
+
+def test_failed_flush_is_merged_with_new_views():
+    async def scenario():
+        profile_views = ProfileViews([AutoReconnect("down")])
+        views = recorder(profile_views, window_seconds=0)
+        views.record("a", "b")
+        first_seen = views._pending[("a", "b")]["first_seen"]
+        await views.flush()
+        assert profile_views.batches == []
+        views.record("a", "b")
+        pending = views._pending[("a", "b")]
+        assert pending["count"] == 2 and pending["first_seen"] == first_seen
+        await views.flush()
+        assert profile_views.batches[0][0]._doc["$inc"] == {"count": 2}
+        assert views._pending == {}
+    run(scenario())
+
+
+def test_only_counted_views_reach_seen_sets():
+    async def scenario():
+        seen_sets = SeenSets()
+        views = recorder(seen_sets=seen_sets, window_seconds=60)
+        views.record("a", "b")
+        await views.flush()
+        views.record("a", "b")  # revisit inside the window
+        views.record("a", "c")
+        await views.flush()
+        assert seen_sets.added == [("a", "b"), ("a", "c")]
+    run(scenario())
+
+
+def test_seen_set_failure_does_not_skip_other_pairs():
+    async def scenario():
+        seen_sets = SeenSets(RuntimeError("kept changing"))
+        views = recorder(seen_sets=seen_sets, window_seconds=60)
+        views.record("a", "b")
+        views.record("a", "c")
+        await views.flush()
+        assert seen_sets.added[1:] == [("a", "c")]
+    run(scenario())
+
+
+def test_flush_loop_survives_unexpected_errors():
+    async def scenario():
+        profile_views = ProfileViews([ValueError("not encodable")])
+        views = recorder(profile_views, flush_seconds=0.01)
+        views.start()
+        views.record("a", "b")
+        await asyncio.sleep(0.05)
+        views.record("a", "c")
+        await asyncio.sleep(0.05)
+        assert not views._task.done()
+        assert len(profile_views.batches) == 1
+        await views.stop()
+    run(scenario())
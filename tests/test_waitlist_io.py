@@ -0,0 +1,104 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from referral_codes import ReferralCodeAllocator
+from waitlist_io import WaitlistImporter, export_lines, iter_lines, iter_rows
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def chunks(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def rows(text: str, fmt: str):
+    return [row async for row in iter_rows(iter_lines(chunks(text.encode())), fmt)]
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_lines_split_across_chunks():
+    text = "﻿email,gender\r\na@x.com,female\r\nb@x.com,"
+    lines = run(collect(iter_lines(chunks(text.encode("utf-8"), 3))))
+    assert lines == ["email,gender", "a@x.com,female", "b@x.com,"]
+
+
+def test_csv_rows():
+    parsed = run(rows("email,gender\n\na@x.com, female \nb@x.com,\nbroken\n", "csv"))
+    assert parsed == [
+        (3, {"email": "a@x.com", "gender": "female"}),
+        (4, {"email": "b@x.com", "gender": None}),
+        (5, None),
+    ]
+
+
+def test_csv_quoted_field_spanning_lines():
+    text = 'email,referred_by\n"a@x.com","CODE\n""1"""\nb@x.com,\n'
+    parsed = run(rows(text, "csv"))
+    assert parsed == [
+        (2, {"email": "a@x.com", "referred_by": 'CODE\n"1"'}),
+        (4, {"email": "b@x.com", "referred_by": None}),
+    ]
+    assert run(rows('email\n"never closed\nb@x.com\n', "csv")) == [(2, None)]
+
+
+def test_ndjson_rows():
+    parsed = run(rows('{"email": "a@x.com"}\n[1]\nnot json\n', "ndjson"))
+    assert parsed == [(1, {"email": "a@x.com"}), (2, None), (3, None)]
+
+
+def database():
+    return AsyncMongoMockClient(tz_aware=True)["waitlist_io"]
+
+
+def test_import_counts_valid_duplicate_and_invalid():
+    async def scenario():
+        db = database()
+        await db.waitlist.insert_one({"email": "old@x.com", "referral_code": "REFCODE1", "boosts": 0})
+        importer = WaitlistImporter(db, ReferralCodeAllocator(db.waitlist), chunk_size=2)
+        text = "\n".join([
+            "email,gender,referred_by",
+            "a@x.com,female,",
+            "b@x.com,male,REFCODE1",
+            "a@x.com,female,",  # repeated in the file
+            "old@x.com,male,",  # already on the waitlist
+            "not-an-email,male,",
+            "c@x.com,male,NOSUCHCODE",
+            "d@x.com",
+        ])
+        result = await importer.run(iter_rows(iter_lines(chunks(text.encode())), "csv"))
+        assert result["imported"] == 2
+        assert result["duplicates"] == 2
+        assert result["invalid"] == 3
+        assert sorted(error["line"] for error in result["errors"]) == [6, 7, 8]
+        referrer = await db.waitlist.find_one({"email": "old@x.com"})
+        assert referrer["boosts"] == 1 and referrer["verified_referrals"] == 1
+    run(scenario())
+
+
+def test_export_follows_queue_order():
+    async def scenario():
+        db = database()
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        await db.waitlist.insert_many([
+            {"email": "late-vip@x.com", "is_vip": True, "boosts": 0, "created_at": start + timedelta(hours=2)},
+            {"email": "plain@x.com", "is_vip": False, "boosts": 0, "created_at": start},
+            {"email": "boosted@x.com", "is_vip": False, "boosts": 3, "created_at": start + timedelta(hours=5)},
+            {"email": "early-vip@x.com", "is_vip": True, "boosts": 0, "created_at": start + timedelta(hours=1)},
+        ])
+        lines = await collect(export_lines(db, "ndjson"))
+        exported = [json.loads(line) for line in lines]
+        assert [row["email"] for row in exported] == ["early-vip@x.com", "late-vip@x.com", "boosted@x.com", "plain@x.com"]
+        assert [row["position_in_line"] for row in exported] == [1, 2, 3, 4]
+        csv_lines = await collect(export_lines(db, "csv"))
+        assert csv_lines[0].startswith("position_in_line,email,")
+        assert csv_lines[1].startswith("1,early-vip@x.com,")
+    run(scenario())
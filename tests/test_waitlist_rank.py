@@ -0,0 +1,75 @@
+import random
+from bisect import bisect_left, insort
+
+import pytest
+
+from waitlist_rank import RankIndex, WaitlistRanking
+
+
+def test_rank_index_matches_sorted_list():
+    rng = random.Random(42)
+    index, reference = RankIndex(), []
+    for _ in range(20000):
+        if reference and rng.random() < 0.45:
+            key = rng.choice(reference)
+            index.remove(key)
+            reference.remove(key)
+        else:
+            key = rng.randint(0, 5000)
+            index.insert(key)
+            insort(reference, key)
+        probe = rng.randint(-1, 5001)
+        assert index.rank(probe) == bisect_left(reference, probe)
+        assert len(index) == len(reference)
+
+
+def test_rank_index_survives_emptied_blocks():
+    index = RankIndex(range(3 * RankIndex.BLOCK_SIZE))
+    # Empty the first block entirely, then keep querying later blocks
+    for key in range(RankIndex.BLOCK_SIZE):
+        index.remove(key)
+    for probe in range(0, 3 * RankIndex.BLOCK_SIZE + 1, 7):
+        assert index.rank(probe) == max(0, probe - RankIndex.BLOCK_SIZE)
+    index.insert(-1)
+    assert index.rank(2 * RankIndex.BLOCK_SIZE + 10) == RankIndex.BLOCK_SIZE + 11
+
+
+def test_rank_index_remove_missing_key():
+    index = RankIndex([1, 2, 3])
+    with pytest.raises(KeyError):
+        index.remove(5)
+
+
+def entry(email, created_at, is_vip=False, boosts=0):
+    return {
+        "email": email,
+        "referral_code": email[:8].upper(),
+        "boosts": boosts,
+        "verified_referrals": 0,
+        "is_vip": is_vip,
+        "created_at": created_at,
+    }
+
+
+def test_waitlist_positions_follow_queue_order():
+    ranking = WaitlistRanking(db=None)
+    ranking.upsert(entry("early@x.com", "2026-01-01T00:00:00+00:00"))
+    ranking.upsert(entry("late@x.com", "2026-01-02T00:00:00+00:00"))
+    ranking.upsert(entry("boosted@x.com", "2026-01-03T00:00:00+00:00", boosts=2))
+    ranking.upsert(entry("vip@x.com", "2026-01-04T00:00:00+00:00", is_vip=True, boosts=1))
+    assert [ranking.position(e) for e in ("vip@x.com", "boosted@x.com", "early@x.com", "late@x.com")] == [1, 2, 3, 4]
+
+    # A referral boost re-ranks the entry
+    ranking.upsert(entry("late@x.com", "2026-01-02T00:00:00+00:00", boosts=3))
+    assert ranking.position("late@x.com") == 2
+    assert len(ranking) == 4
+
+
+def test_waitlist_ranking_accepts_mixed_timestamp_forms_and_missing_boosts():
+    from datetime import datetime, timezone
+
+    ranking = WaitlistRanking(db=None)
+    ranking.upsert(entry("native@x.com", datetime(2026, 1, 2, tzinfo=timezone.utc)))
+    ranking.upsert({**entry("legacy@x.com", "2026-01-01T00:00:00+00:00"), "boosts": None})
+    assert ranking.position("legacy@x.com") == 1
+    assert ranking.position("native@x.com") == 2